@@ -1,19 +1,24 @@
-from typing import Any, Dict, Tuple, Union, Mapping, Optional
+from typing import Any, Dict, Tuple, Union, Mapping, Callable, Optional, Sequence
 from typing_extensions import Literal
 
 from types import MappingProxyType
-from tqdm.auto import tqdm
+from functools import partial
 
 import scanpy as sc
 from anndata import AnnData
 from cellrank import logging as logg
+from cellrank.tl._enum import _DEFAULT_BACKEND, Backend_t
 from cellrank.ul._docs import d, inject_docs
 from cellrank.tl._utils import _maybe_subset_hvgs
+from cellrank.ul._parallelize import parallelize
+from cellrank.tl.kernels._utils import _row_max, _sparsify_rows
+from cellrank.tl._linear_operator import SparsePlusLowRank
 from cellrank.external.kernels._utils import MarkerGenes
 from cellrank.tl.kernels._exp_time_kernel import LastTimePoint
 
 import numpy as np
 import pandas as pd
+from scipy.sparse import spmatrix, csr_matrix
 
 _error = None
 try:
@@ -183,6 +188,10 @@ class WOTKernel(Kernel, error=_error):
             - mouse, proliferation - :cite:`tirosh:16:nature`.
             - mouse, apoptosis - `Hallmark P53 Pathway, MSigDB <https://www.gsea-msigdb.org/gsea/msigdb/cards/HALLMARK_P53_PATHWAY>`_.
 
+        Transport maps for the time pairs are computed in parallel, each job processing its time pairs one at a time.
+        Cost matrices computed from features are only created when needed, so at most ``n_jobs`` of them are in
+        memory. Unlike `'threading'`, other backends copy the data to each job.
+
         For more information about WOT, see the official `tutorial <https://broadinstitute.github.io/wot/tutorial/>`_.
         """  # noqa: E501
 
@@ -252,6 +261,7 @@ class WOTKernel(Kernel, error=_error):
             return pd.Series(gr, index=self.adata.obs_names)
         self.adata.obs[key_added] = gr
 
+    @d.dedent
     @inject_docs(ltp=LastTimePoint)
     def compute_transition_matrix(
         self,
@@ -269,7 +279,13 @@ class WOTKernel(Kernel, error=_error):
             "uniform", "diagonal", "connectivities"
         ] = LastTimePoint.UNIFORM,
         threshold: Optional[Union[float, Literal["auto"]]] = "auto",
+        top_k: Optional[int] = None,
+        mass: Optional[float] = None,
         conn_kwargs: Mapping[str, Any] = MappingProxyType({}),
+        matrix_free: bool = False,
+        n_jobs: Optional[int] = None,
+        backend: Backend_t = _DEFAULT_BACKEND,
+        show_progress_bar: bool = True,
         **kwargs: Any,
     ) -> "WOTKernel":
         """
@@ -320,10 +336,23 @@ class WOTKernel(Kernel, error=_error):
                   Rows where all values are removed will have uniform distribution.
                 - `None` - do not threshold.
 
+        top_k
+            Number of the largest transition probabilities to keep in each row of the transition matrix, bounding
+            its number of non-zeros by ``top_k * n_cells``. The transport maps are sparsified while being stitched
+            together, the last time point after ``threshold`` has been applied. Ties, e.g. when using
+            ``last_time_point = {ltp.UNIFORM!r}``, are broken by the order of cells. If `None`, keep all.
+        mass
+            Keep the fewest largest transition probabilities which account for at least ``mass`` of each row of the
+            transport maps. Needs to fall within the interval `(0, 1]`. If `None`, keep all.
         conn_kwargs
             Keyword arguments for :func:`scanpy.pp.neighbors`, when using ``last_time_point = {ltp.CONNECTIVITIES!r}``.
             Can contain `'density_normalize'` for
             :meth:`cellrank.tl.kernels.ConnectivityKernel.compute_transition_matrix`.
+        matrix_free
+            Whether to represent the transitions within the last time point as a rank-1 term of
+            :class:`cellrank.tl.SparsePlusLowRank` instead of materializing them. Only used when
+            ``last_time_point = {ltp.UNIFORM!r}``, in which case ``threshold`` only applies to the transport maps.
+        %(parallel)s
         kwargs
             Additional keyword arguments for optimal transport configuration.
 
@@ -350,6 +379,15 @@ class WOTKernel(Kernel, error=_error):
         kwargs["epsilon"] = epsilon
         kwargs["growth_iters"] = max(growth_iters, 1)
         last_time_point = LastTimePoint(last_time_point)
+        if matrix_free:
+            if top_k is not None:
+                raise ValueError("Unable to use `top_k` with `matrix_free=True`.")
+            if last_time_point != LastTimePoint.UNIFORM:
+                logg.warning(
+                    f"Matrix-free transition matrix is only used with `last_time_point={LastTimePoint.UNIFORM!r}`, "
+                    f"found `{last_time_point}`. Using `matrix_free=False`"
+                )
+                matrix_free = False
 
         start = logg.info(
             "Computing transition matrix using Waddington optimal transport"
@@ -365,6 +403,9 @@ class WOTKernel(Kernel, error=_error):
                 "use_highly_variable": use_highly_variable,
                 "last_time_point": last_time_point,
                 "threshold": threshold,
+                "top_k": top_k,
+                "mass": mass,
+                "matrix_free": matrix_free,
                 **kwargs,
             },
             time=start,
@@ -376,18 +417,34 @@ class WOTKernel(Kernel, error=_error):
             cost_matrices=cost_matrices,
             solver=solver,
             growth_rate_field=growth_rate_key,
+            n_jobs=n_jobs,
+            backend=backend,
+            show_progress_bar=show_progress_bar,
             **kwargs,
         )
-        tmap = self._restich_tmaps(tmap, last_time_point, conn_kwargs=conn_kwargs)
+        last_names = tmap[list(tmap.keys())[-1]].var_names
+        tmap = self._restich_tmaps(
+            tmap,
+            last_time_point,
+            conn_kwargs=conn_kwargs,
+            top_k=top_k,
+            mass=mass,
+            implicit_uniform=matrix_free,
+        )
         self._growth_rates = tmap.obs
 
+        tmat = tmap.X
+        if matrix_free:
+            last = self.adata.obs_names.isin(last_names).astype(np.float64)
+            tmat = SparsePlusLowRank(tmat, U=last, V=last / len(last_names))
+
         self._compute_transition_matrix(
-            matrix=tmap.X,
+            matrix=tmat,
             density_normalize=False,
             check_irreducibility=False,
         )
-        if threshold:
-            self._threshold_transition_matrix(threshold)
+        if threshold or top_k is not None:
+            self._threshold_transition_matrix(threshold, top_k=top_k)
         self.adata.obs["estimated_growth_rates"] = self.growth_rates[f"g{growth_iters}"]
 
         logg.info("    Finish", time=start)
@@ -402,6 +459,9 @@ class WOTKernel(Kernel, error=_error):
         ] = None,
         solver: Literal["fixed_iters", "duality_gap"] = "duality_gap",
         growth_rate_field: Optional[str] = None,
+        n_jobs: Optional[int] = None,
+        backend: Backend_t = _DEFAULT_BACKEND,
+        show_progress_bar: bool = True,
         **kwargs: Any,
     ) -> Dict[Tuple[float, float], AnnData]:
         _ = wot.ot.OTModel(
@@ -423,14 +483,24 @@ class WOTKernel(Kernel, error=_error):
             **kwargs,
         )
 
-        self._tmaps: Dict[Tuple[float, float], AnnData] = {}
         start = logg.info(
             f"Computing transport maps for `{len(cost_matrices)}` time pairs"
         )
-        for tpair, cost_matrix in tqdm(cost_matrices.items(), unit="time pair"):
-            tmap: Optional[AnnData] = self._ot_model.compute_transport_map(
-                *tpair, cost_matrix=cost_matrix
-            )
+        tpairs = list(cost_matrices.keys())
+        res = parallelize(
+            _compute_tmaps_helper,
+            np.arange(len(tpairs)),
+            as_array=False,
+            unit="time pair",
+            n_jobs=n_jobs,
+            backend=backend,
+            show_progress_bar=show_progress_bar,
+        )(self._ot_model, tpairs, cost_matrices)
+        tmaps = dict(kv for r in res for kv in r.items())
+
+        self._tmaps: Dict[Tuple[float, float], AnnData] = {}
+        for tpair in tpairs:
+            tmap: Optional[AnnData] = tmaps[tpair]
             if tmap is None:
                 raise TypeError(
                     f"Unable to compute transport map for time pair `{tpair}`. "
@@ -507,14 +577,13 @@ class WOTKernel(Kernel, error=_error):
                         f"Unable to find key `{cost_matrices!r}` in `adata.layers` or `adata.obsm`."
                     ) from None
 
+            # computed lazily when computing the transport maps
             cmats = {}
-            for tpair in tqdm(timepoints, unit="cost matrix"):
+            for tpair in timepoints:
                 start_ixs = np.where(self.experimental_time == tpair[0])[0]
                 end_ixs = np.where(self.experimental_time == tpair[1])[0]
-
-                # being sparse is handled in WOT's function below
-                cmats[tpair] = wot.ot.OTModel.compute_default_cost_matrix(
-                    features[start_ixs], features[end_ixs]
+                cmats[tpair] = partial(
+                    _default_cost_matrix, features, start_ixs, end_ixs
                 )
 
             return cmats, f"{modifier}:{cost_matrices}"
@@ -525,14 +594,21 @@ class WOTKernel(Kernel, error=_error):
         )
 
     def _threshold_transition_matrix(
-        self, threshold: Union[float, Literal["auto"]]
+        self,
+        threshold: Optional[Union[float, Literal["auto"]]],
+        top_k: Optional[int] = None,
     ) -> None:
         tmat = self.transition_matrix
+        low_rank = None
+        if isinstance(tmat, SparsePlusLowRank):
+            # only the transport maps are thresholded
+            low_rank, tmat = (tmat.U, tmat.V), tmat.sparse.copy()
+        tmat = csr_matrix(tmat)
         if threshold == "auto":
-            threshold = min(np.max(tmat[i].data) for i in range(tmat.shape[0]))
+            threshold = np.min(_row_max(tmat))
             logg.info(f"Using `threshold={threshold}`")
             tmat.data[tmat.data < threshold] = 0.0
-        else:
+        elif threshold:
             if not (0 <= threshold <= 100):
                 raise ValueError(
                     f"Expected `threshold to be in `[0, 100]`, found `{threshold}`.`"
@@ -541,7 +617,11 @@ class WOTKernel(Kernel, error=_error):
             logg.info(f"Using `threshold={threshold}`")
             tmat.data[tmat.data <= threshold] = 0.0
 
+        if top_k is not None:
+            tmat = _sparsify_rows(tmat, top_k=top_k)
         tmat.eliminate_zeros()
+        if low_rank is not None:
+            tmat = SparsePlusLowRank(tmat, *low_rank)
 
         self._compute_transition_matrix(
             matrix=tmat,
@@ -559,3 +639,38 @@ class WOTKernel(Kernel, error=_error):
         # because WOT reads from `adata`
         self.adata.obs[self._time_key] = self.experimental_time
         return self
+
+
+def _default_cost_matrix(
+    features: Union[np.ndarray, spmatrix], start_ixs: np.ndarray, end_ixs: np.ndarray
+) -> np.ndarray:
+    # being sparse is handled in WOT's function below
+    return wot.ot.OTModel.compute_default_cost_matrix(
+        features[start_ixs], features[end_ixs]
+    )
+
+
+def _compute_tmaps_helper(
+    ixs: np.ndarray,
+    ot_model: "wot.ot.OTModel",
+    tpairs: Sequence[Tuple[float, float]],
+    cost_matrices: Mapping[Tuple[float, float], Optional[Union[np.ndarray, Callable]]],
+    queue=None,
+) -> Dict[Tuple[float, float], Optional[AnnData]]:
+    res = {}
+    for ix in ixs:
+        tpair = tpairs[ix]
+        cost_matrix = cost_matrices[tpair]
+        if callable(cost_matrix):
+            cost_matrix = cost_matrix()
+        res[tpair] = ot_model.compute_transport_map(*tpair, cost_matrix=cost_matrix)
+        # release the dense cost matrix before the next pair
+        del cost_matrix
+
+        if queue is not None:
+            queue.put(1)
+
+    if queue is not None:
+        queue.put(None)
+
+    return res
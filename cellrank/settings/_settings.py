@@ -27,3 +27,8 @@ settings._root_logger = _RootLogger(settings.verbosity)
 # this is a hacky way of modifying the logging, in the future, use our own
 _set_log_file(settings)
 settings.verbosity = settings.verbosity
+
+# opt-in persistent cache of transition matrices, stored under `settings.cachedir`
+settings.kernel_cache = False
+# maximum size of the cache in bytes, least recently used entries are evicted first
+settings.kernel_cache_max_size = 1 << 30
@@ -2,5 +2,6 @@ import cellrank.tl.kernels
 import cellrank.tl.estimators
 from cellrank.tl._lineage import Lineage
 from cellrank.tl._lineages import lineages, lineage_drivers
+from cellrank.tl._linear_operator import SparsePlusLowRank
 from cellrank.tl._init_term_states import initial_states, terminal_states
 from cellrank.tl._transition_matrix import transition_matrix
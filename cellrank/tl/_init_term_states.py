@@ -90,10 +90,9 @@ def _fit(
             **kwargs,
         )
     elif isinstance(estim, GPCCA):
-        if n_lineages is None or n_lineages == 1:
+        if n_lineages is None:
             estim.compute_eigendecomposition()
-            if n_lineages is None:
-                n_lineages = estim.eigendecomposition["eigengap"] + 1
+            n_lineages = estim.eigendecomposition["eigengap"] + 1
 
         if n_lineages > 1:
             estim.compute_schur(n_lineages, method=kwargs.pop("method", "krylov"))
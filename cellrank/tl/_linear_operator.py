@@ -0,0 +1,280 @@
+"""Module containing matrix-free transition matrices."""
+from typing import List, Union, Optional, Sequence
+
+from functools import reduce
+
+import numpy as np
+from scipy.sparse import diags, issparse, spmatrix, csr_matrix
+from scipy.sparse.linalg import LinearOperator, aslinearoperator
+
+__all__ = ["SparsePlusLowRank"]
+
+
+class SparsePlusLowRank(LinearOperator):
+    """
+    Linear operator :math:`S + U V^T`, where :math:`S` is sparse and :math:`U V^T` is of low rank.
+
+    Useful for transition matrices which are dense, but structured, such as uniform transitions within a group of
+    cells, without allocating `n x n` elements.
+
+    Parameters
+    ----------
+    sparse
+        Sparse part of shape `(n, m)`.
+    U
+        Left factor of shape `(n, r)`. If `None`, the operator has no low-rank part.
+    V
+        Right factor of shape `(m, r)`. If `None`, the operator has no low-rank part.
+    """
+
+    def __init__(
+        self,
+        sparse: Union[np.ndarray, spmatrix],
+        U: Optional[np.ndarray] = None,
+        V: Optional[np.ndarray] = None,
+    ):
+        sparse = csr_matrix(sparse)
+        if U is None or V is None:
+            U = np.zeros((sparse.shape[0], 0))
+            V = np.zeros((sparse.shape[1], 0))
+        U, V = np.asarray(U), np.asarray(V)
+        if U.ndim == 1:
+            U = U[:, None]
+        if V.ndim == 1:
+            V = V[:, None]
+
+        if U.shape[1] != V.shape[1]:
+            raise ValueError(
+                f"Expected `U` and `V` to have the same rank, found `{U.shape[1]}` and `{V.shape[1]}`."
+            )
+        if U.shape[0] != sparse.shape[0] or V.shape[0] != sparse.shape[1]:
+            raise ValueError(
+                f"Expected `U` and `V` to have `{sparse.shape[0]}` and `{sparse.shape[1]}` rows, "
+                f"found `{U.shape[0]}` and `{V.shape[0]}`."
+            )
+
+        dtype = np.result_type(sparse.dtype, U.dtype, V.dtype)
+        super().__init__(dtype=dtype, shape=sparse.shape)
+        self._sparse = sparse
+        self._U = U.astype(dtype, copy=False)
+        self._V = V.astype(dtype, copy=False)
+
+    @property
+    def sparse(self) -> csr_matrix:
+        """Sparse part."""
+        return self._sparse
+
+    @property
+    def U(self) -> np.ndarray:
+        """Left factor of the low-rank part."""
+        return self._U
+
+    @property
+    def V(self) -> np.ndarray:
+        """Right factor of the low-rank part."""
+        return self._V
+
+    @property
+    def rank(self) -> int:
+        """Rank of the low-rank part."""
+        return self._U.shape[1]
+
+    def _matvec(self, x: np.ndarray) -> np.ndarray:
+        x = np.ravel(x)
+        return self._sparse @ x + self._U @ (self._V.T @ x)
+
+    def _rmatvec(self, x: np.ndarray) -> np.ndarray:
+        x = np.ravel(x)
+        return self._sparse.T @ x + self._V @ (self._U.T @ x)
+
+    def _matmat(self, X: np.ndarray) -> np.ndarray:
+        return self._sparse @ X + self._U @ (self._V.T @ X)
+
+    def _rmatmat(self, X: np.ndarray) -> np.ndarray:
+        return self._sparse.T @ X + self._V @ (self._U.T @ X)
+
+    def _adjoint(self) -> "SparsePlusLowRank":
+        return SparsePlusLowRank(
+            self._sparse.T.conj(), U=self._V.conj(), V=self._U.conj()
+        )
+
+    def _transpose(self) -> "SparsePlusLowRank":
+        return SparsePlusLowRank(self._sparse.T, U=self._V, V=self._U)
+
+    def __mul__(self, other):
+        if np.isscalar(other):
+            return SparsePlusLowRank(self._sparse * other, U=self._U * other, V=self._V)
+        return super().__mul__(other)
+
+    def __rmul__(self, other):
+        if np.isscalar(other):
+            return self * other
+        return super().__rmul__(other)
+
+    def __add__(self, other):
+        if isinstance(other, SparsePlusLowRank):
+            return SparsePlusLowRank(
+                self._sparse + other.sparse,
+                U=np.hstack([self._U, other.U]),
+                V=np.hstack([self._V, other.V]),
+            )
+        if issparse(other):
+            return SparsePlusLowRank(self._sparse + other, U=self._U, V=self._V)
+        return super().__add__(other)
+
+    def __radd__(self, other):
+        return self + other
+
+    def astype(self, dtype: np.dtype) -> "SparsePlusLowRank":
+        """Cast to ``dtype``."""
+        return SparsePlusLowRank(
+            self._sparse.astype(dtype), U=self._U.astype(dtype), V=self._V.astype(dtype)
+        )
+
+    def sum(self, axis: Optional[int] = None) -> Union[float, np.ndarray]:
+        """
+        Sum the elements.
+
+        Parameters
+        ----------
+        axis
+            Axis along which to sum. If `None`, sum all elements.
+
+        Returns
+        -------
+        The sum, shaped as in :meth:`scipy.sparse.spmatrix.sum`.
+        """
+        if axis is None:
+            return self._sparse.sum() + np.sum(self._U.sum(0) * self._V.sum(0))
+        if axis in (1, -1):
+            return np.asarray(self._sparse.sum(1)) + (self._U @ self._V.sum(0))[:, None]
+        if axis == 0:
+            return np.asarray(self._sparse.sum(0)) + (self._V @ self._U.sum(0))[None, :]
+        raise ValueError(f"Invalid axis `{axis}`.")
+
+    def scale_rows(self, d: np.ndarray) -> "SparsePlusLowRank":
+        """
+        Multiply each row by a factor.
+
+        Parameters
+        ----------
+        d
+            Factors of shape `(n,)`.
+
+        Returns
+        -------
+        The scaled operator.
+        """
+        d = np.ravel(d)
+        return SparsePlusLowRank(
+            diags(d) @ self._sparse, U=self._U * d[:, None], V=self._V
+        )
+
+    def submatrix(self, rows: np.ndarray, cols: np.ndarray) -> "SparsePlusLowRank":
+        """
+        Restrict to a submatrix.
+
+        Parameters
+        ----------
+        rows
+            Row indices.
+        cols
+            Column indices.
+
+        Returns
+        -------
+        The restricted operator of shape `(len(rows), len(cols))`.
+        """
+        return SparsePlusLowRank(
+            self._sparse[rows, :][:, cols], U=self._U[rows], V=self._V[cols]
+        )
+
+    def toarray(self) -> np.ndarray:
+        """Return a dense :class:`numpy.ndarray`. Only meant for small operators."""
+        return self._sparse.toarray() + self._U @ self._V.T
+
+    def __reduce__(self):
+        return type(self), (self._sparse, self._U, self._V)
+
+    def __repr__(self) -> str:
+        return (
+            f"<{type(self).__name__}[shape={self.shape}, nnz={self._sparse.nnz}, rank={self.rank}, "
+            f"dtype={self.dtype}]>"
+        )
+
+
+class _RestrictedOperator(LinearOperator):
+    """Restriction of a generic operator to a submatrix, applied by embedding and projecting vectors."""
+
+    def __init__(self, op: LinearOperator, rows: np.ndarray, cols: np.ndarray):
+        super().__init__(dtype=op.dtype, shape=(len(rows), len(cols)))
+        self._op = op
+        self._rows = np.asarray(rows)
+        self._cols = np.asarray(cols)
+
+    def _matmat(self, X: np.ndarray) -> np.ndarray:
+        full = np.zeros(
+            (self._op.shape[1], X.shape[1]), dtype=np.result_type(X.dtype, self.dtype)
+        )
+        full[self._cols] = X
+        return np.asarray(self._op.matmat(full))[self._rows]
+
+    def _matvec(self, x: np.ndarray) -> np.ndarray:
+        return self._matmat(np.reshape(x, (-1, 1))).ravel()
+
+    def _adjoint(self) -> "_RestrictedOperator":
+        return _RestrictedOperator(self._op.H, self._cols, self._rows)
+
+
+def _restrict(
+    op: Union[np.ndarray, spmatrix, LinearOperator], rows: np.ndarray, cols: np.ndarray
+) -> Union[np.ndarray, spmatrix, LinearOperator]:
+    """Restrict a matrix or an operator to ``rows`` and ``cols``."""
+    if isinstance(op, SparsePlusLowRank):
+        return op.submatrix(rows, cols)
+    if isinstance(op, LinearOperator):
+        return _RestrictedOperator(op, rows, cols)
+    return op[rows, :][:, cols]
+
+
+def _row_sums(op: Union[np.ndarray, spmatrix, LinearOperator]) -> np.ndarray:
+    """Compute the row sums of a matrix or an operator."""
+    if isinstance(op, SparsePlusLowRank) or not isinstance(op, LinearOperator):
+        return np.asarray(op.sum(1)).ravel()
+    return np.asarray(op.matvec(np.ones(op.shape[1], dtype=op.dtype))).ravel()
+
+
+def _normalize_operator(op: LinearOperator) -> LinearOperator:
+    """Row-normalize an operator to sum to 1."""
+    with np.errstate(divide="ignore"):
+        d = 1.0 / _row_sums(op)
+    if isinstance(op, SparsePlusLowRank):
+        return op.scale_rows(d)
+    return aslinearoperator(diags(d)) * op
+
+
+def _product(
+    mats: Sequence[Union[np.ndarray, spmatrix, LinearOperator]]
+) -> Union[np.ndarray, spmatrix, LinearOperator]:
+    """Multiply transition matrices, as :class:`cellrank.tl.kernels.KernelMul` does."""
+    if not any(isinstance(m, LinearOperator) for m in mats):
+        return reduce(np.multiply, mats)
+    return reduce(lambda a, b: a * b, [aslinearoperator(m) for m in mats])
+
+
+def _weighted_sum(
+    mats: Sequence[Union[np.ndarray, spmatrix, LinearOperator]],
+    weights: Sequence[float],
+) -> LinearOperator:
+    """Compute the weighted sum of transition matrices, at least one of which is an operator."""
+    terms: List[LinearOperator] = []
+    for m, w in zip(mats, weights):
+        if issparse(m) and not isinstance(m, LinearOperator):
+            m = SparsePlusLowRank(m)
+        terms.append(
+            w * (m if isinstance(m, SparsePlusLowRank) else aslinearoperator(m))
+        )
+
+    if all(isinstance(t, SparsePlusLowRank) for t in terms):
+        return reduce(lambda a, b: a + b, terms)
+    return reduce(lambda a, b: aslinearoperator(a) + aslinearoperator(b), terms)
@@ -19,7 +19,14 @@ from scipy.sparse import (
     isspmatrix_csc,
     isspmatrix_csr,
 )
-from scipy.sparse.linalg import gmres, lgmres, gcrotmk, bicgstab
+from scipy.sparse.linalg import (
+    LinearOperator,
+    gmres,
+    lgmres,
+    gcrotmk,
+    bicgstab,
+    aslinearoperator,
+)
 
 _DEFAULT_SOLVER = "gmres"
 _PETSC_ERROR_MSG_SHOWN = False
@@ -339,7 +346,7 @@ def _petsc_direct_solve(
 
 
 def _solve_lin_system(
-    mat_a: Union[np.ndarray, spmatrix],
+    mat_a: Union[np.ndarray, spmatrix, LinearOperator],
     mat_b: Union[np.ndarray, spmatrix],
     solver: str = _DEFAULT_SOLVER,
     use_petsc: bool = False,
@@ -369,6 +376,7 @@ def _solve_lin_system(
     ----------
     mat_a
         Matrix of shape `n x n`. We make no assumptions on ``mat_a`` being symmetric or positive definite.
+        If a :class:`scipy.sparse.linalg.LinearOperator`, only the :mod:`scipy` iterative solvers are used.
     mat_b
         Matrix of shape `n x m`, with m << n.
     solver
@@ -406,6 +414,17 @@ def _solve_lin_system(
         return np.hstack(res), sum(converged)
 
     n_jobs = _get_n_cores(n_jobs, n_jobs=None)
+    is_operator = isinstance(mat_a, LinearOperator)
+
+    if is_operator:
+        if solver == "direct":
+            raise ValueError(
+                "Direct solver requires an explicit matrix, found a matrix-free one."
+            )
+        if use_petsc:
+            logg.debug("`PETSc` requires an explicit matrix, using `scipy` solvers")
+            solver = _DEFAULT_SOLVER if solver not in _AVAIL_ITER_SOLVERS else solver
+            use_petsc = False
 
     if use_petsc:
         try:
@@ -419,9 +438,12 @@ def _solve_lin_system(
             use_petsc = False
 
     if use_eye:
-        mat_a = (
-            speye(mat_a.shape[0]) if issparse(mat_a) else np.eye(mat_a.shape[0])
-        ) - mat_a
+        if is_operator:
+            mat_a = aslinearoperator(speye(mat_a.shape[0], dtype=mat_a.dtype)) - mat_a
+        else:
+            mat_a = (
+                speye(mat_a.shape[0]) if issparse(mat_a) else np.eye(mat_a.shape[0])
+            ) - mat_a
 
     if solver == "direct":
         if use_petsc:
@@ -467,7 +489,7 @@ def _solve_lin_system(
             show_progress_bar=show_progress_bar,
         )(mat_a, solver=solver, preconditioner=preconditioner, tol=tol)
     elif solver in _AVAIL_ITER_SOLVERS:
-        if not issparse(mat_a):
+        if not issparse(mat_a) and not is_operator:
             logg.debug("Sparsifying `A` for iterative solver")
             mat_a = csr_matrix(mat_a)
 
@@ -16,7 +16,7 @@ from typing_extensions import Literal
 import os
 import wrapt
 import warnings
-from itertools import tee, product, combinations
+from itertools import tee, chain, product, combinations
 from statsmodels.stats.multitest import multipletests
 
 import scanpy as sc
@@ -33,6 +33,7 @@ from cellrank.tl._colors import (
 from cellrank.ul._parallelize import parallelize
 from cellrank.tl._linear_solver import _solve_lin_system
 from cellrank.tl.kernels._utils import np_std, np_mean, _filter_kwargs
+from cellrank.tl._linear_operator import _normalize_operator
 
 import numpy as np
 import pandas as pd
@@ -41,9 +42,12 @@ from scipy.stats import norm
 from numpy.linalg import norm as d_norm
 from scipy.sparse import eye as speye
 from scipy.sparse import diags, issparse, spmatrix, csr_matrix, isspmatrix_csr
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from pandas.api.types import infer_dtype, is_bool_dtype, is_categorical_dtype
+from sklearn.neighbors import NearestNeighbors
+from scipy.sparse.linalg import LinearOperator
 from scipy.sparse.linalg import norm as sparse_norm
+from scipy.sparse.linalg import aslinearoperator
 
 import matplotlib.colors as mcolors
 
@@ -53,6 +57,8 @@ CFLARE = TypeVar("CFLARE")
 DiGraph = TypeVar("DiGraph")
 
 EPS = np.finfo(np.float64).eps
+# maximum number of elements of the blocks of permuted lineages in `_perm_test`
+_PERM_TEST_BATCH_ELEMS = 1 << 24
 
 
 class TestMethod(ModeEnum):  # noqa
@@ -297,16 +303,26 @@ def _complex_warning(
     return X_
 
 
+def _row_moments(X: Union[np.ndarray, csr_matrix]) -> Tuple[np.ndarray, np.ndarray]:
+    if issparse(X):
+        X_bar = np.reshape(np.array(X.mean(axis=1)), (-1, 1))
+        X_std = np.reshape(
+            np.sqrt(np.array(X.power(2).mean(axis=1)) - (X_bar ** 2)), (-1, 1)
+        )
+    else:
+        X_bar = np.reshape(np_mean(X, axis=1), (-1, 1))
+        X_std = np.reshape(np_std(X, axis=1), (-1, 1))
+
+    return X_bar, X_std
+
+
 def _mat_mat_corr_sparse(
     X: csr_matrix,
     Y: np.ndarray,
 ) -> np.ndarray:
     n = X.shape[1]
 
-    X_bar = np.reshape(np.array(X.mean(axis=1)), (-1, 1))
-    X_std = np.reshape(
-        np.sqrt(np.array(X.power(2).mean(axis=1)) - (X_bar ** 2)), (-1, 1)
-    )
+    X_bar, X_std = _row_moments(X)
 
     y_bar = np.reshape(np.mean(Y, axis=0), (1, -1))
     y_std = np.reshape(np.std(Y, axis=0), (1, -1))
@@ -319,8 +335,7 @@ def _mat_mat_corr_sparse(
 def _mat_mat_corr_dense(X: np.ndarray, Y: np.ndarray) -> np.ndarray:
     n = X.shape[1]
 
-    X_bar = np.reshape(np_mean(X, axis=1), (-1, 1))
-    X_std = np.reshape(np_std(X, axis=1), (-1, 1))
+    X_bar, X_std = _row_moments(X)
 
     y_bar = np.reshape(np_mean(Y, axis=0), (1, -1))
     y_std = np.reshape(np_std(Y, axis=0), (1, -1))
@@ -335,43 +350,161 @@ def _perm_test(
     corr: np.ndarray,
     X: Union[np.ndarray, spmatrix],
     Y: np.ndarray,
+    n_perms: int,
+    q: float,
     seed: Optional[int] = None,
     queue=None,
-) -> Tuple[np.ndarray, np.ndarray]:
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     rs = np.random.RandomState(None if seed is None else seed + ixs[0])
-    cell_ixs = np.arange(X.shape[1])
+    (n_genes, n), n_lineages = X.shape, Y.shape[1]
+    cell_ixs = np.arange(n)
+    k = _n_smallest(q, n_perms)
+
     pvals = np.zeros_like(corr, dtype=np.float64)
-    corr_bs = np.zeros((len(ixs), X.shape[0], Y.shape[1]))  # perms x genes x lineages
+    has_nan = np.zeros(corr.shape, dtype=bool)
+    # `k` smallest and largest bootstrapped correlations, enough for the quantiles
+    smallest, largest = None, None
+
+    # sufficient statistics of the genes and the lineages, these don't change under permutation
+    X2 = X.power(2) if issparse(X) else X ** 2
+    x_bar, x_std = _row_moments(X)
+    x_bar, x_std = x_bar[..., None], x_std[..., None]  # genes x 1 x 1
+    y_bar = np.reshape(np.mean(Y, axis=0), (1, 1, -1))  # 1 x 1 x lineages
+    y_std = np.reshape(np.std(Y, axis=0), (1, 1, -1))
+
+    batch_size = int(
+        np.clip(_PERM_TEST_BATCH_ELEMS // (max(n_genes, n) * n_lineages), 1, len(ixs))
+    )
+    for start in range(0, len(ixs), batch_size):
+        size = min(batch_size, len(ixs) - start)
+        perms = np.empty((size, n), dtype=np.intp)
+        bootstrap_ixs = np.empty((size, n), dtype=np.intp)
+        for i in range(size):
+            rs.shuffle(cell_ixs)
+            perms[i] = cell_ixs
+            bootstrap_ixs[i] = rs.choice(cell_ixs, replace=True, size=n)
+
+        # all permutations in the batch are evaluated using one matrix product
+        Y_perm = np.transpose(Y[perms], (1, 0, 2)).reshape(n, size * n_lineages)
+        XY = np.asarray(X @ Y_perm).reshape(n_genes, size, n_lineages)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr_perm = (XY - n * x_bar * y_bar) / ((n - 1) * x_std * y_std)
+        pvals += np.sum(np.abs(corr_perm) >= np.abs(corr)[:, None, :], axis=1)
+
+        # bootstrap samples are expressed as cell weights, i.e. how many times a cell has been sampled
+        W = (
+            np.bincount(
+                (bootstrap_ixs + n * np.arange(size)[:, None]).ravel(),
+                minlength=n * size,
+            )
+            .reshape(size, n)
+            .T.astype(np.float64)
+        )
+        xb_bar, xb_std = _weighted_moments(X, X2, W)
+        yb_bar, yb_std = _weighted_moments(Y.T, Y.T ** 2, W)
+        WY = (W[:, :, None] * Y[:, None, :]).reshape(n, size * n_lineages)
+        XY = np.asarray(X @ WY).reshape(n_genes, size, n_lineages)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr_bs = (XY - n * xb_bar[..., None] * yb_bar.T[None]) / (
+                (n - 1) * xb_std[..., None] * yb_std.T[None]
+            )
+        corr_bs = np.transpose(corr_bs, (1, 0, 2))  # perms x genes x lineages
+
+        has_nan |= np.any(np.isnan(corr_bs), axis=0)
+        smallest = _update_smallest(smallest, corr_bs, k)
+        largest = _update_smallest(largest, -corr_bs, k)
+
+        if queue is not None:
+            for _ in range(size):
+                queue.put(1)
+
+    if queue is not None:
+        queue.put(None)
+
+    return pvals, smallest, largest, has_nan
+
+
+def _weighted_moments(
+    X: Union[np.ndarray, spmatrix], X2: Union[np.ndarray, spmatrix], W: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute the weighted means and standard deviations of rows of ``X`` for each column of weights ``W``."""
+    n = X.shape[1]
+    mean = np.asarray(X @ W) / n
+    std = np.sqrt(np.maximum(np.asarray(X2 @ W) / n - mean ** 2, 0))
+
+    return mean, std
+
 
-    mmc = _mat_mat_corr_sparse if issparse(X) else _mat_mat_corr_dense
+def _n_smallest(q: float, n: int) -> int:
+    """Number of smallest out of ``n`` values needed to compute their ``q`` quantile."""
+    return int(min(n, np.floor(q * (n - 1)) + 2))
 
-    for i, _ in enumerate(ixs):
-        rs.shuffle(cell_ixs)
-        corr_i = mmc(X, Y[cell_ixs, :])
-        pvals += np.abs(corr_i) >= np.abs(corr)
 
-        bootstrap_ixs = rs.choice(cell_ixs, replace=True, size=len(cell_ixs))
-        corr_bs[i, :, :] = mmc(X[:, bootstrap_ixs], Y[bootstrap_ixs, :])
+def _update_smallest(buffer: Optional[np.ndarray], x: np.ndarray, k: int) -> np.ndarray:
+    """Keep only the ``k`` smallest values along the first axis, ignoring `NaN`."""
+    if buffer is not None:
+        x = np.concatenate([buffer, x], axis=0)
+    if x.shape[0] > k:
+        x = np.partition(x, k - 1, axis=0)[:k]
 
+    return x
+
+
+def _quantile_from_smallest(smallest: np.ndarray, q: float, n: int) -> np.ndarray:
+    """Compute the ``q`` quantile of ``n`` values, given their :func:`_n_smallest` smallest values."""
+    smallest = np.sort(smallest, axis=0)
+    h = q * (n - 1)
+    lo = int(np.floor(h))
+    hi = min(lo + 1, smallest.shape[0] - 1)
+
+    return smallest[lo] + (h - lo) * (smallest[hi] - smallest[lo])
+
+
+def _read_genes(
+    X: Any, genes: slice, cells: Optional[np.ndarray] = None
+) -> Union[np.ndarray, spmatrix]:
+    """Read the expression of ``genes`` from ``X``, which can also be backed by an `h5ad` file."""
+    X = X[:, genes]
+    if cells is not None:
+        X = X[cells]
+
+    return X if issparse(X) else np.asarray(X)
+
+
+def _correlation_test_chunks(
+    starts: np.ndarray,
+    X: Any,
+    Y: np.ndarray,
+    chunk_size: int,
+    cells: Optional[np.ndarray] = None,
+    queue=None,
+    **kwargs: Any,
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    res = []
+    for start in starts:
+        chunk = _read_genes(X, slice(start, start + chunk_size), cells=cells)
+        res.append(_correlation_test_helper(chunk.T, Y, **kwargs))
         if queue is not None:
             queue.put(1)
 
     if queue is not None:
         queue.put(None)
 
-    return pvals, corr_bs
+    return res
 
 
 @d.get_sections(base="correlation_test", sections=["Returns"])
 @d.dedent
 def _correlation_test(
-    X: Union[np.ndarray, spmatrix],
+    X: Any,
     Y: "Lineage",  # noqa: F821
     gene_names: Sequence[str],
     method: TestMethod = TestMethod.FISCHER,
     confidence_level: float = 0.95,
     n_perms: Optional[int] = None,
     seed: Optional[int] = None,
+    cells: Optional[np.ndarray] = None,
+    chunk_size: Optional[int] = None,
     **kwargs: Any,
 ) -> pd.DataFrame:
     """
@@ -382,7 +515,8 @@ def _correlation_test(
     Parameters
     ----------
     X
-        Array or sparse matrix of shape ``(n_cells, n_genes)`` containing the expression.
+        Array, sparse matrix or dataset backed by an `h5ad` file of shape ``(n_cells, n_genes)``
+        containing the expression.
     Y
         Array of shape ``(n_cells, n_lineages)`` containing the absorption probabilities.
     gene_names
@@ -395,6 +529,11 @@ def _correlation_test(
         Number of permutations if ``method = 'perm_test'``.
     seed
         Random seed if ``method = 'perm_test'``.
+    cells
+        Indices or mask of cells in ``X`` to use. If `None`, use all cells.
+    chunk_size
+        Number of genes read from ``X`` at once. If `None`, read all genes. If ``method = 'fischer'``,
+        the chunks are processed in parallel, otherwise the permutations within each chunk are.
     %(parallel)s
 
     Returns
@@ -408,32 +547,256 @@ def _correlation_test(
         - ``{lineage}_ci_high`` - upper bound of the ``confidence_level`` correlation confidence interval.
     """
 
-    corr, pvals, ci_low, ci_high = _correlation_test_helper(
-        X.T,
-        Y.X,
-        method=method,
-        n_perms=n_perms,
-        seed=seed,
-        confidence_level=confidence_level,
-        **kwargs,
-    )
+    n_genes = X.shape[1]
+    if chunk_size is None:
+        chunk_size = max(1, n_genes)
+    if chunk_size <= 0:
+        raise ValueError(f"Expected `chunk_size` to be positive, found `{chunk_size}`.")
+    starts = np.arange(0, n_genes, chunk_size)
+
+    if method == TestMethod.PERM_TEST:
+        # the permutations are already run in parallel, process the chunks sequentially
+        res = _correlation_test_chunks(
+            starts,
+            X,
+            Y.X,
+            chunk_size,
+            cells=cells,
+            method=method,
+            n_perms=n_perms,
+            seed=seed,
+            confidence_level=confidence_level,
+            **kwargs,
+        )
+    else:
+        if not isinstance(X, (np.ndarray, spmatrix)) and kwargs.get(
+            "n_jobs", None
+        ) not in (None, 1):
+            # file handles cannot be shared with other processes
+            kwargs["backend"] = "threading"
+        res = parallelize(
+            _correlation_test_chunks,
+            starts,
+            as_array=False,
+            unit="chunk",
+            extractor=lambda res: list(chain.from_iterable(res)),
+            **kwargs,
+        )(
+            X,
+            Y.X,
+            chunk_size,
+            cells=cells,
+            method=method,
+            confidence_level=confidence_level,
+        )
+    # only the statistics are kept in memory, the q-values are computed from all genes below
+    corr, pvals, ci_low, ci_high = (np.concatenate(r, axis=0) for r in zip(*res))
+
     invalid = np.sum((corr < -1) | (corr > 1))
     if invalid:
         raise ValueError(f"Found `{invalid}` correlations that are not in `[0, 1]`.")
 
-    res = pd.DataFrame(corr, index=gene_names, columns=[f"{c}_corr" for c in Y.names])
-    for idx, c in enumerate(Y.names):
+    return _correlation_frame(corr, pvals, ci_low, ci_high, gene_names, Y.names)
+
+
+def _correlation_frame(
+    corr: np.ndarray,
+    pvals: np.ndarray,
+    ci_low: np.ndarray,
+    ci_high: np.ndarray,
+    gene_names: Sequence[str],
+    lineage_names: Sequence[str],
+) -> pd.DataFrame:
+    """Create the lineage drivers dataframe and compute the q-values, ignoring genes with undefined p-values."""
+    res = pd.DataFrame(
+        corr, index=gene_names, columns=[f"{c}_corr" for c in lineage_names]
+    )
+    for idx, c in enumerate(lineage_names):
+        qvals, mask = np.full_like(pvals[:, idx], np.nan), ~np.isnan(pvals[:, idx])
+        if np.any(mask):
+            qvals[mask] = multipletests(pvals[mask, idx], alpha=0.05, method="fdr_bh")[
+                1
+            ]
         res[f"{c}_pval"] = pvals[:, idx]
-        res[f"{c}_qval"] = multipletests(pvals[:, idx], alpha=0.05, method="fdr_bh")[1]
+        res[f"{c}_qval"] = qvals
         res[f"{c}_ci_low"] = ci_low[:, idx]
         res[f"{c}_ci_high"] = ci_high[:, idx]
 
     # fmt: off
-    res = res[[f"{c}_{stat}" for c in Y.names for stat in ("corr", "pval", "qval", "ci_low", "ci_high")]]
-    return res.sort_values(by=[f"{c}_corr" for c in Y.names], ascending=False)
+    res = res[[f"{c}_{stat}" for c in lineage_names for stat in ("corr", "pval", "qval", "ci_low", "ci_high")]]
+    return res.sort_values(by=[f"{c}_corr" for c in lineage_names], ascending=False)
     # fmt: on
 
 
+def _grouped_correlation_chunks(
+    starts: np.ndarray,
+    X: Any,
+    G: csr_matrix,
+    GY: csr_matrix,
+    chunk_size: int,
+    queue=None,
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    n_groups, n_lineages = G.shape[1], GY.shape[1] // G.shape[1]
+
+    res = []
+    for start in starts:
+        chunk = _read_genes(X, slice(start, start + chunk_size))
+        chunk2 = chunk.power(2) if issparse(chunk) else chunk ** 2
+        # per-group sums of `X`, `X^2` and `XY`, each computed using one product with the indicator matrix
+        sx = _densify(G.T @ chunk)
+        sxx = _densify(G.T @ chunk2)
+        sxy = _densify(chunk.T @ GY).reshape(-1, n_groups, n_lineages)
+        res.append((sx, sxx, np.transpose(sxy, (1, 0, 2))))
+        if queue is not None:
+            queue.put(1)
+
+    if queue is not None:
+        queue.put(None)
+
+    return res
+
+
+def _densify(x: Union[np.ndarray, spmatrix]) -> np.ndarray:
+    return x.toarray() if issparse(x) else np.asarray(x)
+
+
+@d.dedent
+def _grouped_correlation_test(
+    X: Any,
+    Y: "Lineage",  # noqa: F821
+    groups: pd.Series,
+    gene_names: Sequence[str],
+    confidence_level: float = 0.95,
+    chunk_size: Optional[int] = None,
+    **kwargs: Any,
+) -> pd.DataFrame:
+    """
+    Perform the Fischer test separately in each group of cells.
+
+    The correlations are computed from the per-group sums of the expression, the absorption probabilities,
+    their squares and products. Return NaN for genes which don't vary across cells of a group.
+
+    Parameters
+    ----------
+    X
+        Array, sparse matrix or dataset backed by an `h5ad` file of shape ``(n_cells, n_genes)``
+        containing the expression.
+    Y
+        Array of shape ``(n_cells, n_lineages)`` containing the absorption probabilities.
+    groups
+        Categorical series of shape ``(n_cells,)`` containing the groups. Cells with `NaN` are ignored.
+    gene_names
+        Sequence of shape ``(n_genes,)`` containing the gene names.
+    confidence_level
+        Confidence level for the confidence interval calculation. Must be in `[0, 1]`.
+    chunk_size
+        Number of genes read from ``X`` at once. If `None`, read all genes.
+    %(parallel)s
+
+    Returns
+    -------
+    Dataframe indexed by the groups and genes, with the same columns as in :func:`_correlation_test`.
+    The q-values are computed separately in each group.
+    """
+    if not is_categorical_dtype(groups):
+        raise TypeError(
+            f"Expected `groups` to be `categorical`, found `{infer_dtype(groups)}`."
+        )
+    if not (0 <= confidence_level <= 1):
+        raise ValueError(
+            f"Expected `confidence_level` to be in interval `[0, 1]`, found `{confidence_level}`."
+        )
+
+    n_genes = X.shape[1]
+    if chunk_size is None:
+        chunk_size = max(1, n_genes)
+    if chunk_size <= 0:
+        raise ValueError(f"Expected `chunk_size` to be positive, found `{chunk_size}`.")
+
+    Y_names, Y = Y.names, np.asarray(Y.X, dtype=np.float64)
+    (n_cells, n_lineages), n_groups = Y.shape, len(groups.cat.categories)
+    codes = np.asarray(groups.cat.codes, dtype=np.intp)
+    cells = np.where(codes >= 0)[0]
+
+    # `G` is the cell-group indicator, `GY` additionally holds the absorption probabilities of each lineage
+    G = csr_matrix(
+        (np.ones(len(cells)), (cells, codes[cells])), shape=(n_cells, n_groups)
+    )
+    GY = csr_matrix(
+        (
+            Y[cells].ravel(),
+            (
+                np.repeat(cells, n_lineages),
+                (codes[cells, None] * n_lineages + np.arange(n_lineages)).ravel(),
+            ),
+        ),
+        shape=(n_cells, n_groups * n_lineages),
+    )
+
+    if not isinstance(X, (np.ndarray, spmatrix)) and kwargs.get("n_jobs", None) not in (
+        None,
+        1,
+    ):
+        # file handles cannot be shared with other processes
+        kwargs["backend"] = "threading"
+    res = parallelize(
+        _grouped_correlation_chunks,
+        np.arange(0, n_genes, chunk_size),
+        as_array=False,
+        unit="chunk",
+        extractor=lambda res: list(chain.from_iterable(res)),
+        **kwargs,
+    )(X, G, GY, chunk_size)
+    sx, sxx, sxy = (
+        np.concatenate(r, axis=1) for r in zip(*res)
+    )  # groups x genes [x lineages]
+
+    n = np.asarray(G.sum(axis=0)).ravel()[:, None]  # groups x 1
+    sy, syy = _densify(G.T @ Y), _densify(G.T @ (Y ** 2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_bar, y_bar = sx / n, sy / n
+        x_var, y_var = sxx / n - x_bar ** 2, syy / n - y_bar ** 2
+        # treat the round-off errors of constant features as zero variance
+        x_var[x_var <= 4 * np.finfo(np.float64).eps * sxx / n] = 0
+        y_var[y_var <= 4 * np.finfo(np.float64).eps * syy / n] = 0
+        x_std, y_std = np.sqrt(x_var)[..., None], np.sqrt(y_var)[:, None, :]
+
+        n = n[..., None]
+        corr = (sxy - n * x_bar[..., None] * y_bar[:, None, :]) / (
+            (n - 1) * x_std * y_std
+        )
+        corr[np.broadcast_to((x_std == 0) | (y_std == 0), corr.shape)] = np.nan
+        pvals, ci_low, ci_high = _fischer_test(corr, n, confidence_level)
+
+    return pd.concat(
+        [
+            _correlation_frame(
+                corr[i], pvals[i], ci_low[i], ci_high[i], gene_names, Y_names
+            )
+            for i in range(n_groups)
+        ],
+        keys=groups.cat.categories,
+        names=[groups.name, None],
+    )
+
+
+def _fischer_test(
+    corr: np.ndarray, n: Union[int, np.ndarray], confidence_level: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the p-values and confidence intervals of correlations from ``n`` samples using Fisher transformation."""
+    # see: https://en.wikipedia.org/wiki/Pearson_correlation_coefficient#Using_the_Fisher_transformation
+    qh = confidence_level + (1 - confidence_level) / 2.0
+    mean, se = np.arctanh(corr), 1.0 / np.sqrt(n - 3)
+    z_score = (np.arctanh(corr) - np.arctanh(0)) * np.sqrt(n - 3)
+
+    z = norm.ppf(qh)
+    corr_ci_low = np.tanh(mean - z * se)
+    corr_ci_high = np.tanh(mean + z * se)
+    pvals = 2 * norm.cdf(-np.abs(z_score))
+
+    return pvals, corr_ci_low, corr_ci_high
+
+
 def _correlation_test_helper(
     X: Union[np.ndarray, spmatrix],
     Y: np.ndarray,
@@ -470,15 +833,21 @@ def _correlation_test_helper(
     """
 
     def perm_test_extractor(
-        res: Sequence[Tuple[np.ndarray, np.ndarray]]
+        res: Sequence[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        pvals, corr_bs = zip(*res)
+        pvals, smallest, largest, has_nan = zip(*res)
         pvals = np.sum(pvals, axis=0) / float(n_perms)
 
-        corr_bs = np.concatenate(corr_bs, axis=0)
-        corr_ci_low, corr_ci_high = np.quantile(corr_bs, q=ql, axis=0), np.quantile(
-            corr_bs, q=qh, axis=0
-        )
+        k = _n_smallest(ql, n_perms)
+        smallest = _update_smallest(None, np.concatenate(smallest, axis=0), k)
+        largest = _update_smallest(None, np.concatenate(largest, axis=0), k)
+        # the upper quantile is the negated lower quantile of the negated values
+        corr_ci_low = _quantile_from_smallest(smallest, q=ql, n=n_perms)
+        corr_ci_high = -_quantile_from_smallest(largest, q=ql, n=n_perms)
+
+        has_nan = np.any(has_nan, axis=0)
+        corr_ci_low[has_nan] = np.nan
+        corr_ci_high[has_nan] = np.nan
 
         return pvals, corr_ci_low, corr_ci_high
 
@@ -489,7 +858,6 @@ def _correlation_test_helper(
 
     n = X.shape[1]  # genes x cells
     ql = 1 - confidence_level - (1 - confidence_level) / 2.0
-    qh = confidence_level + (1 - confidence_level) / 2.0
 
     if issparse(X) and not isspmatrix_csr(X):
         X = csr_matrix(X)
@@ -497,14 +865,7 @@ def _correlation_test_helper(
     corr = _mat_mat_corr_sparse(X, Y) if issparse(X) else _mat_mat_corr_dense(X, Y)
 
     if method == TestMethod.FISCHER:
-        # see: https://en.wikipedia.org/wiki/Pearson_correlation_coefficient#Using_the_Fisher_transformation
-        mean, se = np.arctanh(corr), 1.0 / np.sqrt(n - 3)
-        z_score = (np.arctanh(corr) - np.arctanh(0)) * np.sqrt(n - 3)
-
-        z = norm.ppf(qh)
-        corr_ci_low = np.tanh(mean - z * se)
-        corr_ci_high = np.tanh(mean + z * se)
-        pvals = 2 * norm.cdf(-np.abs(z_score))
+        pvals, corr_ci_low, corr_ci_high = _fischer_test(corr, n, confidence_level)
 
     elif method == TestMethod.PERM_TEST:
         if not isinstance(n_perms, int):
@@ -521,7 +882,7 @@ def _correlation_test_helper(
             unit="permutation",
             extractor=perm_test_extractor,
             **kwargs,
-        )(corr, X, Y, seed=seed)
+        )(corr, X, Y, n_perms=n_perms, q=ql, seed=seed)
 
     else:
         raise NotImplementedError(method)
@@ -552,22 +913,22 @@ def _filter_cells(distances: spmatrix, rc_labels: Series, n_matches_min: int) ->
         )
 
     # retrieve knn graph
-    rows, cols = distances.nonzero()
-    cls = rc_labels.cat.categories
-    freqs_orig = np.array([np.sum(rc_labels == cl) for cl in cls])
-
-    # loop over cells and check whether they have neighbors from the same class
-    for cl in cls:
-        cells = np.where(rc_labels == cl)[0]
-        for cell in cells:
-            own_cl = rc_labels[cell]
-            neighbors = cols[rows == cell]
-            n_cls = rc_labels[neighbors]
-            n_matches = np.sum(np.in1d(n_cls, own_cl))
-            if n_matches < n_matches_min:
-                rc_labels[cell] = None
-
-    freqs_new = np.array([np.sum(rc_labels == cl) for cl in cls])
+    distances = csr_matrix(distances, copy=True)
+    distances.eliminate_zeros()
+    indptr, n_cls = distances.indptr, len(rc_labels.cat.categories)
+    codes = np.asarray(rc_labels.cat.codes, dtype=np.intp)
+    freqs_orig = np.bincount(codes[codes >= 0], minlength=n_cls)
+
+    # count the neighbors from the same class, row by row
+    own = np.repeat(codes, np.diff(indptr))
+    matches = ((codes[distances.indices] == own) & (own >= 0)).astype(np.intp)
+    n_matches = np.zeros(len(codes), dtype=np.intp)
+    nonempty = np.diff(indptr) > 0
+    if np.any(nonempty):
+        n_matches[nonempty] = np.add.reduceat(matches, indptr[:-1][nonempty])
+
+    codes = np.where(n_matches < n_matches_min, -1, codes)
+    freqs_new = np.bincount(codes[codes >= 0], minlength=n_cls)
 
     if np.any((freqs_new / freqs_orig) < 0.5):
         logg.warning(
@@ -575,15 +936,26 @@ def _filter_cells(distances: spmatrix, rc_labels: Series, n_matches_min: int) ->
             "increasing 'n_neighbors_filtering'. This filters out too many cells"
         )
 
-    return rc_labels
+    return Series(
+        pd.Categorical.from_codes(
+            codes,
+            categories=rc_labels.cat.categories,
+            ordered=rc_labels.cat.ordered,
+        ),
+        index=rc_labels.index,
+        name=rc_labels.name,
+    )
 
 
 def _cluster_X(
     X: Union[np.ndarray, spmatrix],
     n_clusters: int,
-    method: Literal["leiden", "kmeans"] = "leiden",
+    method: Literal["leiden", "kmeans", "minibatch_kmeans"] = "leiden",
     n_neighbors: int = 20,
     resolution: float = 1.0,
+    batch_size: int = 1024,
+    connectivities: Optional[spmatrix] = None,
+    n_jobs: Optional[int] = None,
 ) -> List[Any]:
     """
     Cluster the rows of the matrix X.
@@ -595,11 +967,18 @@ def _cluster_X(
     n_clusters
         Number of clusters to use.
     method
-        Method to use for clustering. Options are `'kmeans'`, `'leiden'`.
+        Method to use for clustering. Options are `'kmeans'`, `'minibatch_kmeans'`, `'leiden'`.
     n_neighbors
         If using a community-detection based clustering algorithm, number of neighbors for KNN construction.
     resolution
         Resolution parameter for `'leiden'` clustering.
+    batch_size
+        Size of the mini-batches for `'minibatch_kmeans'` clustering.
+    connectivities
+        Connectivities of shape ``n_samples x n_samples`` for `'leiden'` clustering. If `None`,
+        compute them from the KNN graph of ``X``.
+    n_jobs
+        Number of parallel jobs for the KNN search.
 
     Returns
     -------
@@ -613,19 +992,56 @@ def _cluster_X(
     if method == "kmeans":
         kmeans = KMeans(n_clusters=n_clusters).fit(X)
         labels = kmeans.labels_
+    elif method == "minibatch_kmeans":
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters, batch_size=batch_size, n_init=3
+        ).fit(X)
+        labels = kmeans.labels_
     elif method == "leiden":
-        adata_dummy = sc.AnnData(X=X)
-        sc.pp.neighbors(adata_dummy, use_rep="X", n_neighbors=n_neighbors)
-        sc.tl.leiden(adata_dummy, resolution=resolution)
+        if connectivities is None:
+            connectivities = _knn_connectivities(
+                X, n_neighbors=n_neighbors, n_jobs=n_jobs
+            )
+        elif connectivities.shape != (X.shape[0], X.shape[0]):
+            raise ValueError(
+                f"Expected `connectivities` to be of shape `{(X.shape[0], X.shape[0])}`, "
+                f"found `{connectivities.shape}`."
+            )
+        adata_dummy = sc.AnnData(X=np.empty((X.shape[0], 0)))
+        sc.tl.leiden(adata_dummy, resolution=resolution, adjacency=connectivities)
         labels = adata_dummy.obs[method]
     else:
         raise NotImplementedError(
-            f"Invalid method `{method}`. Valid options are `kmeans` or `leiden`."
+            f"Invalid method `{method}`. Valid options are `kmeans`, `minibatch_kmeans` or `leiden`."
         )
 
     return list(labels)
 
 
+def _knn_connectivities(
+    X: Union[np.ndarray, spmatrix], n_neighbors: int, n_jobs: Optional[int] = None
+) -> csr_matrix:
+    """Compute the same UMAP connectivities as :func:`scanpy.pp.neighbors`, using an exact, parallel KNN search."""
+    from umap.umap_ import fuzzy_simplicial_set
+
+    n_neighbors = min(n_neighbors, X.shape[0])
+    dists, ixs = (
+        NearestNeighbors(n_neighbors=n_neighbors, n_jobs=n_jobs).fit(X).kneighbors(X)
+    )
+    connectivities, _, _ = fuzzy_simplicial_set(
+        X,
+        n_neighbors,
+        None,
+        "euclidean",
+        knn_indices=ixs,
+        knn_dists=dists,
+        set_op_mix_ratio=1.0,
+        local_connectivity=1.0,
+    )
+
+    return connectivities.tocsr()
+
+
 def _eigengap(evals: np.ndarray, alpha: float) -> int:
     """
     Compute the eigengap among the top eigenvalues of a matrix.
@@ -713,30 +1129,25 @@ def _partition(
 
 def _connected(c: Union[spmatrix, np.ndarray]) -> bool:
     """Check whether the undirected graph encoded by c is connected."""
+    from scipy.sparse.csgraph import connected_components
 
-    import networkx as nx
-
-    G = nx.from_scipy_sparse_matrix(c) if issparse(c) else nx.from_numpy_array(c)
+    n_components = connected_components(
+        c, directed=True, connection="weak", return_labels=False
+    )
 
-    return nx.is_connected(G)
+    return n_components == 1
 
 
 def _irreducible(d: Union[spmatrix, np.ndarray]) -> bool:
-    """Check whether the unirected graph encoded by d is irreducible."""
-
-    import networkx as nx
+    """Check whether the directed graph encoded by d is irreducible, i.e. strongly connected."""
+    from scipy.sparse.csgraph import connected_components
 
     start = logg.debug("Checking the transition matrix for irreducibility")
 
-    G = nx.DiGraph(d) if not isinstance(d, nx.DiGraph) else d
-
-    try:
-        it = iter(nx.strongly_connected_components(G))
-        _ = next(it)
-        _ = next(it)
-        is_irreducible = False
-    except StopIteration:
-        is_irreducible = True
+    n_components = connected_components(
+        d, directed=True, connection="strong", return_labels=False
+    )
+    is_irreducible = n_components == 1
 
     if not is_irreducible:
         logg.warning("Transition matrix is not irreducible", time=start)
@@ -746,6 +1157,75 @@ def _irreducible(d: Union[spmatrix, np.ndarray]) -> bool:
     return is_irreducible
 
 
+def _densify(matrix: Union[np.ndarray, spmatrix, LinearOperator]) -> np.ndarray:
+    """Convert a matrix or a :class:`scipy.sparse.linalg.LinearOperator` to a dense array."""
+    if isinstance(matrix, LinearOperator):
+        return np.asarray(matrix.matmat(np.eye(matrix.shape[1], dtype=matrix.dtype)))
+    if issparse(matrix):
+        return matrix.toarray()
+    return np.asarray(matrix)
+
+
+def _estimate_cond_num(
+    matrix: Union[spmatrix, np.ndarray, LinearOperator],
+    n_dense: int = 2048,
+    n_vecs: int = 4,
+    maxiter: int = 500,
+    seed: int = 0,
+) -> float:
+    """
+    Estimate the condition number of a square matrix in the 2-norm.
+
+    Small matrices are handled exactly using :func:`numpy.linalg.cond`. For larger ones, the extremal singular
+    values are computed iteratively, using only matrix-vector products: the largest one using
+    :func:`scipy.sparse.linalg.svds` and the smallest one using :func:`scipy.sparse.linalg.lobpcg`
+    on :math:`A^T A`. Since the latter converges from above, the estimate is a lower bound.
+
+    Parameters
+    ----------
+    matrix
+        Square matrix or :class:`scipy.sparse.linalg.LinearOperator` of shape ``(n, n)``.
+    n_dense
+        Matrices with fewer rows are densified and the condition number is computed exactly.
+    n_vecs
+        Block size for :func:`scipy.sparse.linalg.lobpcg`.
+    maxiter
+        Maximum number of iterations for :func:`scipy.sparse.linalg.lobpcg`.
+    seed
+        Random seed for the initial block of vectors.
+
+    Returns
+    -------
+    float
+        The estimated condition number. If the matrix is exactly singular, return `inf`.
+    """
+    from scipy.sparse.linalg import svds, lobpcg, aslinearoperator
+
+    n = matrix.shape[0]
+    if n < max(n_dense, 5 * n_vecs):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return float(np.linalg.cond(_densify(matrix)))
+
+    if isinstance(matrix, LinearOperator):
+        op = matrix
+    else:
+        op = aslinearoperator(
+            matrix.tocsr() if issparse(matrix) else np.asarray(matrix)
+        )
+    sigma_max = svds(op, k=1, which="LM", return_singular_vectors=False)[0]
+
+    gram = op.H @ op
+    x0 = np.random.RandomState(seed).normal(size=(n, n_vecs))
+    with warnings.catch_warnings():
+        # `lobpcg` warns when not converged, the Rayleigh quotients are still an upper bound
+        warnings.simplefilter("ignore")
+        evals = lobpcg(gram, x0, largest=False, maxiter=maxiter, tol=1e-12)[0]
+    sigma_min = np.sqrt(max(np.min(evals), 0))
+
+    return float(sigma_max / sigma_min) if sigma_min > 0 else np.inf
+
+
 def _symmetric(
     matrix: Union[spmatrix, np.ndarray],
     ord: str = "fro",
@@ -753,19 +1233,41 @@ def _symmetric(
     only_check_sparsity_pattern: bool = False,
 ) -> bool:
     """Check whether the graph encoded by `matrix` is symmetric."""
+    if not issparse(matrix):
+        if only_check_sparsity_pattern:
+            return ((matrix != 0) == (matrix != 0).T).all()
+        return d_norm((matrix - matrix.T), ord=ord) < eps
+
+    matrix = csr_matrix(matrix)
+    if np.any(matrix.data == 0):
+        matrix = matrix.copy()
+        matrix.eliminate_zeros()
+
+    # the number of entries in each row and column must match
+    if not np.array_equal(
+        np.diff(matrix.indptr), np.bincount(matrix.indices, minlength=matrix.shape[0])
+    ):
+        return False
+
+    matrix_t = matrix.T.tocsr()
+    if not matrix.has_sorted_indices:
+        matrix = matrix.sorted_indices()
+    if not matrix_t.has_sorted_indices:
+        matrix_t = matrix_t.sorted_indices()
+    if not np.array_equal(matrix.indices, matrix_t.indices):
+        # structural asymmetry
+        return False
     if only_check_sparsity_pattern:
-        if issparse(matrix):
-            return len(((matrix != 0) - (matrix != 0).T).data) == 0
-        return ((matrix != 0) == (matrix != 0).T).all()
+        return True
 
-    if issparse(matrix):
-        return sparse_norm((matrix - matrix.T), ord=ord) < eps
-    return d_norm((matrix - matrix.T), ord=ord) < eps
+    if ord == "fro":
+        return d_norm(matrix.data - matrix_t.data) < eps
+    return sparse_norm((matrix - matrix_t), ord=ord) < eps
 
 
 def _normalize(
-    X: Union[np.ndarray, spmatrix],
-) -> Union[np.ndarray, spmatrix]:
+    X: Union[np.ndarray, spmatrix, LinearOperator],
+) -> Union[np.ndarray, spmatrix, LinearOperator]:
     """
     Row-normalizes an array to sum to 1.
 
@@ -776,10 +1278,13 @@ def _normalize(
 
     Returns
     -------
-    :class:`numpy.ndarray` or :class:`scipy.sparse.spmatrix`
+    :class:`numpy.ndarray`, :class:`scipy.sparse.spmatrix` or :class:`scipy.sparse.linalg.LinearOperator`
         The normalized array.
     """
 
+    if isinstance(X, LinearOperator):
+        return _normalize_operator(X)
+
     with np.errstate(divide="ignore"):
         if issparse(X):
             return X.multiply(csr_matrix(1.0 / np.abs(X).sum(1)))
@@ -1120,6 +1625,7 @@ def _fuzzy_to_discrete(
     remove_overlap: bool = True,
     raise_threshold: Optional[float] = 0.2,
     check_row_sums: bool = True,
+    return_codes: bool = False,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
     Map fuzzy clustering to discrete clustering.
@@ -1155,6 +1661,9 @@ def _fuzzy_to_discrete(
     check_row_sums
         Check whether rows in `a_fuzzy` sum to one. The one situation where we don't do this is when
         we have selected a couple of main states and we don't want to re-distribute probability mass.
+    return_codes
+        If `True`, return an integer array of shape `(n_samples,)` with the assigned cluster, or `-1` if
+        the sample is not assigned, instead of the boolean matrix.
 
     Returns
     -------
@@ -1189,34 +1698,71 @@ def _fuzzy_to_discrete(
     )
     logg.debug(f"Raising an exception if there are less than `{n_raise}` cells.")
 
-    # initially select `n_most_likely` samples per cluster
-    sample_assignment = {
-        cl: fuzzy_assignment.argpartition(-n_most_likely)[-n_most_likely:]
-        for cl, fuzzy_assignment in enumerate(a_fuzzy.T)
-    }
+    codes, critical_clusters = _fuzzy_to_codes(
+        a_fuzzy,
+        n_most_likely=n_most_likely,
+        remove_overlap=remove_overlap,
+        n_raise=n_raise if raise_threshold is not None else None,
+    )
+    if return_codes:
+        return codes, critical_clusters
 
-    # create the one-hot encoded discrete clustering
     a_discrete = np.zeros(
         a_fuzzy.shape, dtype=bool
     )  # don't use `zeros_like` - it also copies the dtype
-    for ix in range(n_clusters):
-        a_discrete[sample_assignment[ix], ix] = True
-
-    # handle samples assigned to more than one cluster
-    critical_samples = np.where(a_discrete.sum(1) > 1)[0]
-    for sample_ix in critical_samples:
-        if remove_overlap:
-            a_discrete[sample_ix, :] = _one_hot(n_clusters)
-        else:
-            candidate_ixs = np.where(a_discrete[sample_ix, :])[0]
-            most_likely_ix = candidate_ixs[
-                np.argmax(a_fuzzy[sample_ix, list(a_discrete[sample_ix, :])])
-            ]
-            a_discrete[sample_ix, :] = _one_hot(n_clusters, most_likely_ix)
+    mask = codes >= 0
+    a_discrete[mask, codes[mask]] = True
+
+    return a_discrete, critical_clusters
+
+
+def _fuzzy_to_codes(
+    a_fuzzy: np.ndarray,
+    n_most_likely: int,
+    remove_overlap: bool = True,
+    n_raise: Optional[int] = 1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Assign the most likely samples to clusters, see :func:`_fuzzy_to_discrete`.
+
+    Parameters
+    ----------
+    a_fuzzy
+        Array of shape `(n_samples x n_clusters)` representing a fuzzy clustering.
+    n_most_likely
+        Number of samples we want to assign to each cluster.
+    remove_overlap
+        If `True`, remove ambiguous samples. Otherwise, assign them to the most likely cluster.
+    n_raise
+        Minimum number of samples per cluster. If `None`, don't check it.
+
+    Returns
+    -------
+    Array of shape `(n_samples,)` with the assigned cluster or `-1` if the sample is not assigned and an array of
+    clusters with less than ``n_most_likely`` samples assigned.
+    """
+    n_samples, n_clusters = a_fuzzy.shape
+
+    # initially select `n_most_likely` samples per cluster
+    top = np.argpartition(a_fuzzy, -n_most_likely, axis=0)[-n_most_likely:]
+    counts = np.bincount(top.ravel(), minlength=n_samples)
+
+    # handle samples assigned to more than one cluster as an argmax over the memberships of selected clusters
+    rows = np.flatnonzero(counts)
+    pos = np.empty(n_samples, dtype=np.intp)
+    pos[rows] = np.arange(len(rows))
+    cols = np.arange(n_clusters)[None, :]
+    masked = np.full((len(rows), n_clusters), -np.inf)
+    masked[pos[top], cols] = a_fuzzy[top, cols]
+
+    codes = np.full(n_samples, -1, dtype=np.intp)
+    codes[rows] = np.argmax(masked, axis=1)
+    if remove_overlap:
+        codes[counts > 1] = -1
 
     # check how many samples this left for each cluster
-    n_samples_per_cluster = a_discrete.sum(0)
-    if raise_threshold is not None:
+    n_samples_per_cluster = np.bincount(codes[codes >= 0], minlength=n_clusters)
+    if n_raise is not None:
         if (n_samples_per_cluster < n_raise).any():
             min_samples = np.min(n_samples_per_cluster)
             raise ValueError(
@@ -1227,7 +1773,7 @@ def _fuzzy_to_discrete(
         raise ValueError("Assigned more samples than requested.")
     critical_clusters = np.where(n_samples_per_cluster < n_most_likely)[0]
 
-    return a_discrete, critical_clusters
+    return codes, critical_clusters
 
 
 def _series_from_one_hot_matrix(
@@ -1408,6 +1954,10 @@ def _calculate_absorption_time_moments(
     mean[trans_indices] = m
 
     if calculate_variance:
+        if isinstance(Q, LinearOperator):
+            raise NotImplementedError(
+                "Variance of time to absorption is not implemented for matrix-free transition matrices."
+            )
         logg.debug(
             "Calculating variance of mean time to absorption to any absorbing state"
         )
@@ -1492,7 +2042,16 @@ def _calculate_lineage_absorption_time_means(
         tmp_ixs[k] = np.arange(cnt, cnt + len(ix), dtype=np.int32)
         cnt += len(ix)
 
-    I = speye(Q.shape[0]) if issparse(Q) else np.eye(Q.shape)  # noqa
+    is_operator = isinstance(Q, LinearOperator)
+    if is_operator and "var" in lineages.values():
+        raise NotImplementedError(
+            "Variance of time to absorption is not implemented for matrix-free transition matrices."
+        )
+
+    if is_operator:
+        I = aslinearoperator(speye(Q.shape[0], dtype=Q.dtype))  # noqa
+    else:
+        I = speye(Q.shape[0]) if issparse(Q) else np.eye(Q.shape)  # noqa
     N_inv = I - Q
 
     logg.debug("Solving equation for `B`")
@@ -1510,9 +2069,11 @@ def _calculate_lineage_absorption_time_means(
         D_j_inv.data = 1.0 / D_j.data
 
         logg.debug(f"Calculating mean time to absorption to `{name!r}`")
-        m = _solve_lin_system(
-            D_j_inv @ N_inv @ D_j, np.ones(Q.shape[0]), **kwargs
-        ).squeeze()
+        if is_operator:
+            A = aslinearoperator(D_j_inv) * N_inv * aslinearoperator(D_j)
+        else:
+            A = D_j_inv @ N_inv @ D_j
+        m = _solve_lin_system(A, np.ones(Q.shape[0]), **kwargs).squeeze()
 
         mean = np.empty(n, dtype=np.float64)
         mean[:] = np.inf
@@ -16,6 +16,7 @@ from cellrank.tl._utils import (
 )
 from cellrank.tl._lineage import Lineage
 from cellrank.tl._linear_solver import _solve_lin_system
+from cellrank.tl._linear_operator import _restrict
 from cellrank.tl.estimators._utils import SafeGetter
 from cellrank.tl.estimators.mixins._utils import (
     BaseProtocol,
@@ -28,6 +29,7 @@ import numpy as np
 import pandas as pd
 from scipy.sparse import issparse, spmatrix
 from pandas.api.types import infer_dtype, is_categorical_dtype
+from scipy.sparse.linalg import LinearOperator
 
 
 class AbsProbsProtocol(BaseProtocol):  # noqa: D101
@@ -254,7 +256,8 @@ class AbsProbsMixin:
         start = logg.info("Computing absorption probabilities")
 
         # get the transition matrix
-        if not issparse(self.transition_matrix):
+        is_operator = isinstance(self.transition_matrix, LinearOperator)
+        if not issparse(self.transition_matrix) and not is_operator:
             logg.warning(
                 "Attempting to solve a potentially large linear system with dense transition matrix"
             )
@@ -276,14 +279,21 @@ class AbsProbsMixin:
             raise RuntimeError("Markov chain is irreducible.")
 
         # create Q (restriction transient-transient), S (restriction transient-recurrent)
-        q = self.transition_matrix[trans_indices, :][:, trans_indices]
-        s = self.transition_matrix[trans_indices, :][:, rec_indices]
-
-        # take individual solutions and piece them together to get absorption probabilities towards the classes
-        # fmt: off
-        macro_ix_helper = np.cumsum([0] + [len(indices) for indices in lookup_dict.values()])
-        s = np.concatenate([s[:, np.arange(a, b)].sum(axis=1) for a, b in _pairwise(macro_ix_helper)], axis=1)
-        # fmt: on
+        q = _restrict(self.transition_matrix, trans_indices, trans_indices)
+        if is_operator:
+            # only matrix-vector products are available, sum the columns of each class directly
+            classes = np.zeros((len(self), len(lookup_dict)), dtype=np.float64)
+            for col, indices in enumerate(lookup_dict.values()):
+                classes[indices, col] = 1.0
+            s = np.asarray(self.transition_matrix.matmat(classes))[trans_indices]
+        else:
+            s = self.transition_matrix[trans_indices, :][:, rec_indices]
+
+            # take individual solutions and piece them together to get absorption probabilities towards the classes
+            # fmt: off
+            macro_ix_helper = np.cumsum([0] + [len(indices) for indices in lookup_dict.values()])
+            s = np.concatenate([s[:, np.arange(a, b)].sum(axis=1) for a, b in _pairwise(macro_ix_helper)], axis=1)
+            # fmt: on
 
         abs_probs = self._compute_absorption_probabilities(
             q,
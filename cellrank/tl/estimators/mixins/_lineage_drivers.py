@@ -10,7 +10,13 @@ from anndata import Raw, AnnData
 from cellrank import logging as logg
 from cellrank._key import Key
 from cellrank.ul._docs import d, inject_docs
-from cellrank.tl._utils import RandomKeys, TestMethod, save_fig, _correlation_test
+from cellrank.tl._utils import (
+    RandomKeys,
+    TestMethod,
+    save_fig,
+    _correlation_test,
+    _grouped_correlation_test,
+)
 from cellrank.tl._colors import _create_categorical_colors
 from cellrank.tl._lineage import Lineage
 from cellrank.tl.estimators._utils import SafeGetter
@@ -39,6 +45,10 @@ class LinDriversProtocol(BaseProtocol):  # noqa: D101
     def eigendecomposition(self) -> Dict[str, Any]:  # noqa: D102
         ...
 
+    @property
+    def stationary_distribution(self) -> Optional[np.ndarray]:  # noqa: D102
+        ...
+
     @property
     def absorption_probabilities(self) -> Optional[Lineage]:  # noqa: D102
         ...
@@ -70,6 +80,8 @@ class LinDriversMixin(AbsProbsMixin):
         confidence_level: float = 0.95,
         n_perms: int = 1000,
         seed: Optional[int] = None,
+        chunk_size: Optional[int] = 1024,
+        per_cluster: bool = False,
         **kwargs: Any,
     ) -> pd.DataFrame:
         """
@@ -90,7 +102,8 @@ class LinDriversMixin(AbsProbsMixin):
         cluster_key
             Key from :attr:`anndata.AnnData.obs` to obtain cluster annotations. These are considered for ``clusters``.
         clusters
-            Restrict the correlations to these clusters.
+            Restrict the correlations to these clusters. If ``per_cluster = True``, only compute the drivers
+            for these clusters.
         layer
             Key from :attr:`anndata.AnnData.layers` from which to get the expression.
             If `None` or `'X'`, use :attr:`anndata.AnnData.X`.
@@ -102,6 +115,12 @@ class LinDriversMixin(AbsProbsMixin):
             Number of permutations to use when ``method = {tm.PERM_TEST!r}``.
         seed
             Random seed when ``method = {tm.PERM_TEST!r}``.
+        chunk_size
+            Number of genes whose expression is read at once, which bounds the memory usage, e.g. when
+            :attr:`adata` is backed by an `h5ad` file. If `None`, read all genes at once.
+        per_cluster
+            Whether to compute the drivers separately within each cluster in ``cluster_key`` in one pass.
+            Only available when ``method = {tm.FISCHER!r}``.
         %(parallel)s
 
         Returns
@@ -111,6 +130,9 @@ class LinDriversMixin(AbsProbsMixin):
         Also updates the following field:
 
             - :attr:`lineage_drivers` - the same :class:`pandas.DataFrame` as described above.
+
+        If ``per_cluster = True``, the :class:`pandas.DataFrame` is indexed by the clusters and the genes,
+        the q-values are computed within each cluster and :attr:`lineage_drivers` is not updated.
         """
 
         # check that lineage probs have been computed
@@ -125,10 +147,14 @@ class LinDriversMixin(AbsProbsMixin):
             logg.warning(
                 "There is only 1 lineage present. Using stationary distribution instead"
             )
-            stat_dist = self.eigendecomposition.get("stationary_dist", None)
+            eig = self.eigendecomposition
+            stat_dist = None if eig is None else eig.get("stationary_dist", None)
+            if stat_dist is None:
+                stat_dist = self.stationary_distribution
             if stat_dist is None:
                 raise RuntimeError(
-                    "No stationary distribution found in `.eigendecomposition['stationary_dist']`."
+                    "No stationary distribution found in `.eigendecomposition['stationary_dist']` "
+                    "or `.stationary_distribution`."
                 )
             abs_probs = Lineage(
                 stat_dist,
@@ -148,6 +174,16 @@ class LinDriversMixin(AbsProbsMixin):
         if not len(lineages):
             raise ValueError("No lineages have been selected.")
 
+        if per_cluster:
+            if method != TestMethod.FISCHER:
+                raise NotImplementedError(
+                    f"Method `{method}` is not yet implemented for `per_cluster=True`."
+                )
+            if cluster_key not in self.adata.obs.keys():
+                raise KeyError(
+                    f"Unable to find clusters in `adata.obs[{cluster_key!r}]`."
+                )
+
         # use `cluster_key` and clusters to subset the data
         if clusters is not None:
             if cluster_key not in self.adata.obs.keys():
@@ -165,11 +201,11 @@ class LinDriversMixin(AbsProbsMixin):
                     f"Clusters `{list(np.array(clusters)[cluster_mask])}` not found in "
                     f"`adata.obs[{cluster_key!r}]`."
                 )
+        if clusters is not None and not per_cluster:
             subset_mask = np.in1d(self.adata.obs[cluster_key], clusters)
-            adata_comp = self.adata[subset_mask]
             lin_probs = abs_probs[subset_mask, :]
         else:
-            adata_comp = self.adata
+            subset_mask = None
             lin_probs = abs_probs
 
         # check that the layer exists, and that use raw is only used with layer X
@@ -177,16 +213,17 @@ class LinDriversMixin(AbsProbsMixin):
             if use_raw and self.adata.raw is None:
                 logg.warning("No raw attribute set. Using `.X` instead")
                 use_raw = False
-            data = adata_comp.raw.X if use_raw else adata_comp.X
-            var_names = adata_comp.raw.var_names if use_raw else adata_comp.var_names
+            # don't subset the data here, the genes are read in chunks
+            data = self.adata.raw.X if use_raw else self.adata.X
+            var_names = self.adata.raw.var_names if use_raw else self.adata.var_names
         else:
             if layer not in self.adata.layers:
                 raise KeyError(f"Layer `{layer!r}` not found in `adata.layers`.")
             if use_raw:
                 logg.warning("If `use_raw=True`, layer must be `None`.")
                 use_raw = False
-            data = adata_comp.layers[layer]
-            var_names = adata_comp.var_names
+            data = self.adata.layers[layer]
+            var_names = self.adata.var_names
 
         start = logg.debug(
             f"Computing correlations for lineages `{sorted(lineages)}` restricted to clusters `{clusters}` in "
@@ -194,6 +231,23 @@ class LinDriversMixin(AbsProbsMixin):
         )
 
         lin_probs = lin_probs[lineages]
+        if per_cluster:
+            groups = self.adata.obs[cluster_key]
+            if clusters is not None:
+                groups = groups.cat.set_categories(clusters)
+            drivers = _grouped_correlation_test(
+                data,
+                lin_probs,
+                groups,
+                gene_names=var_names,
+                confidence_level=confidence_level,
+                chunk_size=chunk_size,
+                **kwargs,
+            )
+            logg.info("    Finish", time=start)
+
+            return drivers
+
         drivers = _correlation_test(
             data,
             lin_probs,
@@ -202,6 +256,8 @@ class LinDriversMixin(AbsProbsMixin):
             n_perms=n_perms,
             seed=seed,
             confidence_level=confidence_level,
+            cells=subset_mask,
+            chunk_size=chunk_size,
             **kwargs,
         )
         params = self._create_params()
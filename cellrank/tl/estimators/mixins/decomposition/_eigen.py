@@ -1,20 +1,23 @@
-from typing import Any, Dict, Tuple, Union, Mapping, Optional
+from typing import Any, Dict, List, Tuple, Union, Mapping, Optional, Sequence
 from typing_extensions import Literal
 
 from types import MappingProxyType
 from pathlib import Path
+from itertools import chain
 
 from anndata import AnnData
 from cellrank import logging as logg
 from cellrank._key import Key
 from cellrank.ul._docs import d
 from cellrank.tl._utils import save_fig, _eigengap
+from cellrank.ul._parallelize import parallelize
+from cellrank.tl._linear_solver import _solve_lin_system
 from cellrank.tl.estimators._utils import SafeGetter
 from cellrank.tl.estimators.mixins._utils import BaseProtocol, logger, shadow
 
 import numpy as np
 from scipy.sparse import issparse, spmatrix
-from scipy.sparse.linalg import eigs
+from scipy.sparse.linalg import LinearOperator, eigs
 
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
@@ -40,6 +43,7 @@ class EigenMixin:
         super().__init__(**kwargs)
 
         self._eigendecomposition = None
+        self._stationary_dist: Optional[np.ndarray] = None
 
     @property
     @d.get_summary(base="eigen")
@@ -62,6 +66,83 @@ class EigenMixin:
         """
         return self._eigendecomposition
 
+    @property
+    @d.get_summary(base="stationary_dist")
+    def stationary_distribution(self) -> Optional[np.ndarray]:
+        """Stationary distribution of :attr:`transition_matrix`, see :meth:`compute_stationary_distribution`."""
+        return self._stationary_dist
+
+    @d.dedent
+    def compute_stationary_distribution(
+        self: EigenProtocol,
+        method: Literal["linear", "power"] = "linear",
+        tol: float = 1e-10,
+        max_iter: int = 10_000,
+    ) -> None:
+        """
+        Compute stationary distribution of :attr:`transition_matrix`.
+
+        Unlike :meth:`compute_eigendecomposition`, only the dominant left eigenvector is computed. If the previously
+        computed distribution is still stationary for :attr:`transition_matrix`, it's reused.
+
+        Parameters
+        ----------
+        method
+            How to compute the stationary distribution. Valid options are:
+
+                - `'linear'` - fix the probability of one state and solve the remaining sparse linear system
+                  iteratively. If the solution is not accurate enough, e.g. for reducible Markov chains, it's refined
+                  by `'power'`. Matrix-free transition matrices always use `'power'`.
+                - `'power'` - power iteration with Aitken's extrapolation.
+        tol
+            Tolerance for the :math:`L_1` norm of the residual :math:`\\pi T - \\pi`.
+        max_iter
+            Maximum number of iterations of the power method.
+
+        Returns
+        -------
+        Nothing, just updates the following field:
+
+            - :attr:`stationary_distribution` - %(stationary_dist.summary)s
+
+        The convergence report is saved in :attr:`params`.
+        """
+        if method not in ("linear", "power"):
+            raise ValueError(
+                f"Invalid method `{method!r}`. Valid options are: `'linear'` or `'power'`."
+            )
+        if tol <= 0:
+            raise ValueError(f"Expected `tol` to be positive, found `{tol}`.")
+        if max_iter <= 0:
+            raise ValueError(f"Expected `max_iter` to be positive, found `{max_iter}`.")
+
+        tmat = self.transition_matrix
+        pi = self.stationary_distribution
+        if (
+            pi is not None
+            and pi.shape == (tmat.shape[0],)
+            and _residual(tmat, pi) <= tol
+        ):
+            logg.debug("Reusing the stationary distribution")
+            return
+
+        start = logg.info("Computing stationary distribution of the transition matrix")
+        pi, report = _stationary_distribution(
+            tmat, method=method, tol=tol, max_iter=max_iter
+        )
+        if not report["converged"]:
+            logg.warning(
+                f"Stationary distribution did not converge, residual is `{report['residual']:.4e}`"
+            )
+
+        self._stationary_dist = pi
+        self.params[f"stationary_distribution_{Key.backward(self.backward)}"] = report
+        logg.info(
+            f"Adding `.stationary_distribution`\n"
+            f"    Finish in `{report['n_iter']}` iteration(s), residual `{report['residual']:.4e}`",
+            time=start,
+        )
+
     @d.dedent
     def compute_eigendecomposition(
         self: EigenProtocol,
@@ -70,12 +151,18 @@ class EigenMixin:
         alpha: float = 1.0,
         only_evals: bool = False,
         ncv: Optional[int] = None,
+        n_jobs: Optional[int] = None,
+        backend: str = "loky",
     ) -> None:
         """
         Compute eigendecomposition of :attr:`transition_matrix`.
 
         Uses a sparse implementation, if possible, and only computes the top :math:`k` eigenvectors
-        to speed up the computation. Computes both left and right eigenvectors.
+        to speed up the computation. Computes both left and right eigenvectors. Matrix-free transition
+        matrices are only accessed through matrix-vector products.
+
+        If the eigenvectors from a previous call are still valid for :attr:`transition_matrix`, they are reused
+        if there are at least ``k`` of them, otherwise they are used to initialize the iterative solver.
 
         Parameters
         ----------
@@ -86,6 +173,11 @@ class EigenMixin:
             Whether to compute only eigenvalues.
         ncv
             Number of Lanczos vectors generated.
+        n_jobs
+            Number of parallel jobs. If `>1`, the left and right eigenvectors are computed concurrently.
+        backend
+            Which backend to use for parallelization. Since :func:`scipy.sparse.linalg.eigs` cannot run in
+            multiple threads at once, a process-based backend should be used.
 
         Returns
         -------
@@ -93,48 +185,50 @@ class EigenMixin:
 
             - :attr:`eigendecomposition` - %(eigen.summary)s
         """
-
-        def get_top_k_evals() -> np.ndarray:
-            return D[np.flip(np.argsort(D.real))][:k]
-
         start = logg.info("Computing eigendecomposition of the transition matrix")
 
-        if issparse(self.transition_matrix):
-            logg.debug(f"Computing top `{k}` eigenvalues of a sparse matrix")
-            D, V_l = eigs(self.transition_matrix.T, k=k, which=which, ncv=ncv)
-            if only_evals:
-                self._write_eigendecomposition(
-                    {
-                        "D": get_top_k_evals(),
-                        "eigengap": _eigengap(get_top_k_evals().real, alpha),
-                        "params": {"which": which, "k": k, "alpha": alpha},
-                    },
-                    time=start,
-                )
-                return
-            _, V_r = eigs(self.transition_matrix, k=k, which=which, ncv=ncv)
+        tmat = self.transition_matrix
+        cached = _reusable_eigendecomposition(self.eigendecomposition, tmat, which)
+        if cached is not None and len(cached[0]) >= k:
+            logg.debug(f"Reusing top `{k}` eigenvectors of the previous decomposition")
+            D, V_l, V_r = cached[0][:k], cached[1][:, :k], cached[2][:, :k]
         else:
-            logg.warning(
-                "This transition matrix is not sparse, computing full eigendecomposition"
-            )
-            D, V_l = np.linalg.eig(self.transition_matrix.T)
-            if only_evals:
-                self._write_eigendecomposition(
-                    {
-                        "D": get_top_k_evals(),
-                        "eigengap": _eigengap(D.real, alpha),
-                        "params": {"which": which, "k": k, "alpha": alpha},
-                    },
-                    time=start,
+            if cached is None:
+                v0 = {}
+            else:
+                logg.debug(
+                    f"Initializing the solver with top `{len(cached[0])}` eigenvectors of the previous decomposition"
                 )
-                return
-            _, V_r = np.linalg.eig(self.transition_matrix)
-
-        # Sort the eigenvalues and eigenvectors and take the real part
-        logg.debug("Sorting eigenvalues by their real part")
-        p = np.flip(np.argsort(D.real))
-        D, V_l, V_r = D[p], V_l[:, p], V_r[:, p]
-        e_gap = _eigengap(D.real, alpha)
+                v0 = {
+                    "left": _start_vector(cached[1]),
+                    "right": _start_vector(cached[2]),
+                }
+
+            logg.debug(f"Computing top `{k}` eigenvalues")
+            res = parallelize(
+                _eigs,
+                collection=["left"] if only_evals else ["left", "right"],
+                n_jobs=n_jobs,
+                backend=backend,
+                show_progress_bar=False,
+                as_array=False,
+                unit="eigenvectors",
+            )(tmat, k=k, which=which, ncv=ncv, v0=v0)
+            res = list(chain.from_iterable(res))
+
+            D, V_l = res[0]
+            V_r = None if only_evals else res[1][1]
+
+        if only_evals:
+            self._write_eigendecomposition(
+                {
+                    "D": D,
+                    "eigengap": _eigengap(D.real, alpha),
+                    "params": {"which": which, "k": k, "alpha": alpha},
+                },
+                time=start,
+            )
+            return
 
         pi = np.abs(V_l[:, 0].real)
         pi /= np.sum(pi)
@@ -145,7 +239,7 @@ class EigenMixin:
                 "stationary_dist": pi,
                 "V_l": V_l,
                 "V_r": V_r,
-                "eigengap": e_gap,
+                "eigengap": _eigengap(D.real, alpha),
                 "params": {"which": which, "k": k, "alpha": alpha},
             },
             time=start,
@@ -378,3 +472,233 @@ class EigenMixin:
         # fmt: on
 
         return sg.ok
+
+
+def _eigs(
+    sides: Sequence[str],
+    T: Union[np.ndarray, spmatrix, LinearOperator],
+    k: int,
+    which: Literal["LR", "LM"] = "LR",
+    ncv: Optional[int] = None,
+    v0: Mapping[str, np.ndarray] = MappingProxyType({}),
+    queue: Optional[Any] = None,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Compute the top eigenvalues and eigenvectors.
+
+    Parameters
+    ----------
+    sides
+        Whether to compute the `'left'` or the `'right'` eigenvectors, or both.
+    T
+        Transition matrix.
+    k
+        Number of eigenvectors.
+    which
+        Which eigenvalues to compute.
+    ncv
+        Number of Lanczos vectors generated.
+    v0
+        Starting vectors of the iterative solver for each of the ``sides``.
+    queue
+        Signalling queue in the parent process/thread used to update the progress bar.
+
+    Returns
+    -------
+    For each of the ``sides``, the eigenvalues and eigenvectors, sorted by the real part of the eigenvalues.
+    """
+    res = []
+    for side in sides:
+        A = T.T if side == "left" else T
+        if k >= T.shape[0] - 1 and not isinstance(A, LinearOperator):
+            # too many eigenvectors requested for the iterative solver
+            D, V = np.linalg.eig(A.A if issparse(A) else A)
+        else:
+            D, V = eigs(A, k=k, which=which, ncv=ncv, v0=v0.get(side, None))
+        p = np.flip(np.argsort(D.real))[:k]
+        res.append((D[p], V[:, p]))
+
+        if queue is not None:
+            queue.put(1)
+
+    if queue is not None:
+        queue.put(None)
+
+    return res
+
+
+def _reusable_eigendecomposition(
+    eig: Optional[Mapping[str, Any]],
+    T: Union[np.ndarray, spmatrix, LinearOperator],
+    which: Literal["LR", "LM"],
+    atol: float = 1e-8,
+) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Return the eigenvalues and the left and right eigenvectors of ``eig``, if they're still valid for ``T``."""
+    if eig is None or eig.get("V_l", None) is None or eig.get("V_r", None) is None:
+        return None
+    if eig.get("params", {}).get("which", None) != which:
+        return None
+
+    D, V_l, V_r = eig["D"], eig["V_l"], eig["V_r"]
+    if V_l.shape != V_r.shape or V_l.shape != (T.shape[0], len(D)):
+        return None
+    # the transition matrix might have been recomputed
+    if not np.allclose(T.T @ V_l, V_l * D, atol=atol) or not np.allclose(
+        T @ V_r, V_r * D, atol=atol
+    ):
+        return None
+
+    return D, V_l, V_r
+
+
+def _start_vector(V: np.ndarray) -> np.ndarray:
+    """Create a starting vector of the iterative solver from previously computed eigenvectors."""
+    v0 = np.sum(V.real, axis=1) + np.sum(V.imag, axis=1)
+    v0 /= np.linalg.norm(v0)
+    # random component to find the remaining eigenvectors
+    noise = np.random.RandomState(0).uniform(size=V.shape[0])
+
+    return v0 + noise / np.linalg.norm(noise)
+
+
+def _residual(T: Union[np.ndarray, spmatrix, LinearOperator], pi: np.ndarray) -> float:
+    """Compute the :math:`L_1` norm of :math:`\\pi T - \\pi`."""
+    return float(np.sum(np.abs(np.ravel(T.T @ pi) - pi)))
+
+
+def _stationary_distribution(
+    T: Union[np.ndarray, spmatrix, LinearOperator],
+    method: Literal["linear", "power"] = "linear",
+    tol: float = 1e-10,
+    max_iter: int = 10_000,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Compute the stationary distribution.
+
+    Parameters
+    ----------
+    T
+        Row-stochastic transition matrix.
+    method
+        Either `'linear'` or `'power'`.
+    tol
+        Tolerance for the :math:`L_1` norm of the residual.
+    max_iter
+        Maximum number of iterations of the power method.
+
+    Returns
+    -------
+    The stationary distribution and the convergence report.
+    """
+    x0 = None
+    if method == "linear" and not isinstance(T, LinearOperator):
+        x0 = _linear_stationary_distribution(T, tol=tol)
+        if x0 is not None:
+            residual = _residual(T, x0)
+            if residual <= tol:
+                return x0, {
+                    "method": "linear",
+                    "converged": True,
+                    "n_iter": 1,
+                    "residual": residual,
+                }
+        logg.debug(
+            "Unable to solve the linear system to the desired tolerance, refining it using power iteration"
+        )
+
+    return _power_stationary_distribution(T, tol=tol, max_iter=max_iter, x0=x0)
+
+
+def _linear_stationary_distribution(
+    T: Union[np.ndarray, spmatrix], tol: float = 1e-10
+) -> Optional[np.ndarray]:
+    """
+    Solve :math:`\\pi T = \\pi` as a non-singular linear system by fixing one of the states.
+
+    For :math:`\\pi_p = 1`, the remaining states solve :math:`(I - T_{-p, -p})^T x = T_{p, -p}^T`, which has a
+    unique solution for irreducible Markov chains.
+    """
+    # state with the largest incoming flux, which likely has large stationary probability
+    p = int(np.argmax(np.ravel(T.sum(0))))
+    keep = np.arange(T.shape[0]) != p
+    b = T[p, keep]
+    b = b.toarray() if issparse(b) else np.asarray(b)
+    b = np.reshape(b, (-1, 1))
+
+    try:
+        x = _solve_lin_system(
+            T[keep, :][:, keep].T,
+            b,
+            solver="gmres",
+            use_petsc=False,
+            tol=tol,
+            use_eye=True,
+            show_progress_bar=False,
+        )
+    except (np.linalg.LinAlgError, RuntimeError, ValueError) as e:
+        logg.debug(f"Unable to solve the linear system. Reason: `{e}`")
+        return None
+
+    pi = np.ones(T.shape[0])
+    pi[keep] = np.ravel(x)
+    if not np.all(np.isfinite(pi)):
+        return None
+    # clip round-off errors
+    pi = np.clip(pi, 0, None)
+
+    return pi / np.sum(pi)
+
+
+def _power_stationary_distribution(
+    T: Union[np.ndarray, spmatrix, LinearOperator],
+    tol: float,
+    max_iter: int,
+    x0: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Compute the stationary distribution using power iteration, accelerated using Aitken's extrapolation."""
+    n = T.shape[0]
+    TT = T.T
+    x = np.full(n, 1.0 / n) if x0 is None else x0
+    history = [x]
+    residual = np.inf
+
+    for i in range(1, max_iter + 1):
+        y = np.ravel(TT @ x)
+        y /= np.sum(y)
+        residual = float(np.sum(np.abs(y - x)))
+        x = y
+        if residual <= tol:
+            break
+
+        history = history[-2:] + [x]
+        if len(history) == 3:
+            z = _aitken(*history)
+            if z is not None:
+                z_residual = _residual(T, z)
+                if z_residual < residual:
+                    x, residual, history = z, z_residual, [z]
+                    if residual <= tol:
+                        break
+
+    return x, {
+        "method": "power" if x0 is None else "linear",
+        "converged": residual <= tol,
+        "n_iter": i + (x0 is not None),
+        "residual": residual,
+    }
+
+
+def _aitken(x0: np.ndarray, x1: np.ndarray, x2: np.ndarray) -> Optional[np.ndarray]:
+    """Extrapolate a sequence of distributions using Aitken's :math:`\\Delta^2` process."""
+    d1, d2 = x1 - x0, x2 - x1
+    denom = d2 - d1
+    mask = np.abs(denom) > EPS
+    z = x2.copy()
+    z[mask] -= d2[mask] ** 2 / denom[mask]
+
+    z = np.clip(z, 0, None)
+    total = np.sum(z)
+    if not np.isfinite(total) or total <= 0:
+        return None
+
+    return z / total
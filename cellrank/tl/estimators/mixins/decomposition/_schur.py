@@ -1,27 +1,53 @@
-from typing import Any, Dict, Tuple, Union, Mapping, Optional
+from typing import Any, Dict, List, Tuple, Union, Mapping, Optional, Sequence
 from typing_extensions import Literal
 
+import warnings
+from copy import copy
 from types import MappingProxyType
 from pathlib import Path
 from pygpcca import GPCCA
-from pygpcca._sorted_schur import _check_conj_split
+from pygpcca._gpcca import _cluster_by_isa
+from pygpcca._sorted_schur import _check_conj_split, sorted_brandts_schur
 
 from anndata import AnnData
 from cellrank import logging as logg
 from cellrank._key import Key
 from cellrank.ul._docs import d
 from cellrank.tl._utils import save_fig, _eigengap
+from cellrank.ul._parallelize import parallelize
 from cellrank.tl.estimators._utils import SafeGetter
 from cellrank.tl.estimators.mixins._utils import BaseProtocol, logger, shadow
 
 import numpy as np
-from scipy.sparse import issparse, spmatrix
+from scipy.linalg import svd
+from scipy.sparse import diags, issparse, spmatrix, csr_matrix
+from sklearn.cluster import MiniBatchKMeans
+from scipy.sparse.linalg import LinearOperator, eigs, aslinearoperator
 
 import matplotlib.pyplot as plt
 from seaborn import heatmap
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 EPS = np.finfo(np.float64).eps
+# above this number of cells, the Markov chain is coarsened into metacells by default
+_METACELLS_THRESHOLD = 1_000_000
+# number of cells used to assess the error of the coarsening
+_METACELLS_N_SAMPLES = 1000
+# attributes set by :meth:`pygpcca.GPCCA.optimize`
+_OPTIMIZE_ATTRS = (
+    "_m_opt",
+    "_chi",
+    "_rot_matrix",
+    "_crispness",
+    "_crispness_opt",
+    "_X",
+    "_R",
+    "_top_eigenvalues",
+    "_eigenvalues",
+    "_pi_coarse",
+    "_eta_coarse",
+    "_P_coarse",
+)
 
 
 class SchurProtocol(BaseProtocol):  # noqa: D101
@@ -61,7 +87,7 @@ class SchurMixin:
         real-valued, square matrix :math:`A`. It is given by :math:`A = Q R Q^T`, where :math:`Q` contains the
         real Schur vectors and :math:`R` is the Schur matrix. :math:`Q` is orthogonal and :math:`R` is quasi-upper
         triangular with 1x1 and 2x2 blocks on the diagonal.
-        If PETSc and SLEPc are installed, only the leading Schur vectors are computed.
+        For sparse matrices and `method='krylov'`, only the leading Schur vectors are computed.
         """
         return self._schur_vectors
 
@@ -93,6 +119,7 @@ class SchurMixin:
             - `'V_l'` - left eigenvectors (optional).
             - `'V_r'` - right eigenvectors (optional).
             - `'stationary_dist'` - stationary distribution of :attr:`transition_matrix`, if present.
+            - `'metacells'` - error of the metacell coarsening, if the Schur decomposition was computed using metacells.
         """
         return self._eigendecomposition
 
@@ -104,6 +131,7 @@ class SchurMixin:
         method: Literal["krylov", "brandts"] = "krylov",
         which: Literal["LR", "LM"] = "LR",
         alpha: float = 1.0,
+        n_metacells: Optional[Union[int, Literal["auto"]]] = "auto",
     ):
         """
         Compute Schur decomposition.
@@ -121,8 +149,17 @@ class SchurMixin:
                   large, sparse matrices.
                 - `'brandts'` - full sorted Schur decomposition of a dense matrix.
 
-            For benefits of each method, see :class:`pygpcca.GPCCA`.
+            For benefits of each method, see :class:`pygpcca.GPCCA`. If `'krylov'` is used for a sparse matrix,
+            but PETSc or SLEPc are not installed, or if the transition matrix is matrix-free, the decomposition
+            is obtained by Rayleigh-Ritz projection onto the dominant eigenvectors computed by
+            :func:`scipy.sparse.linalg.eigs`.
         %(eigen)s
+        n_metacells
+            Number of metacells into which to coarsen the Markov chain before computing the decomposition.
+            Cells with similar short-time dynamics are aggregated and the Schur vectors of the coarse-grained
+            transition matrix are lifted back to the cells. The error of the coarsening, estimated on a sample of
+            cells, is saved in :attr:`eigendecomposition` under `'metacells'`. If `'auto'`, coarsen only
+            for more than `1000000` cells, using `1` metacell per `100` cells. If `None`, don't coarsen.
 
         Returns
         -------
@@ -144,25 +181,86 @@ class SchurMixin:
                 f"Invalid method `{method!r}`. Valid options are:`'brandts'` or `'krylov'`."
             )
 
-        try:
-            import petsc4py
-            import slepc4py
-        except ImportError:
-            method = "brandts"
-            logg.warning(
-                f"Unable to import `petsc4py` or `slepc4py`. Using `method={method!r}`"
+        tmat = self.transition_matrix
+        eta = (
+            np.full(tmat.shape[0], 1.0 / tmat.shape[0])
+            if initial_distribution is None
+            else np.asarray(initial_distribution, dtype=np.float64)
+        )
+
+        n_cells = tmat.shape[0]
+        if n_metacells == "auto":
+            n_metacells = (
+                n_cells // 100
+                if n_cells > _METACELLS_THRESHOLD
+                and not isinstance(tmat, LinearOperator)
+                else None
             )
+        lift = None
+        if n_metacells is not None:
+            if isinstance(tmat, LinearOperator):
+                raise TypeError(
+                    "Coarsening into metacells requires an explicit transition matrix, "
+                    "found a matrix-free transition matrix."
+                )
+            if not (n_components < n_metacells < n_cells):
+                raise ValueError(
+                    f"Expected `n_metacells` to be in interval `({n_components}, {n_cells})`, "
+                    f"found `{n_metacells}`."
+                )
+            start = logg.info(
+                f"Coarsening the Markov chain into `{n_metacells}` metacells"
+            )
+            lift = _metacells(tmat, n_metacells)
+            tmat, eta = _coarsen(tmat, eta, lift)
+            logg.info("    Finish", time=start)
 
-        tmat = self.transition_matrix
-        if method == "brandts" and issparse(self.transition_matrix):
-            logg.warning("For `method='brandts'`, dense matrix is required. Densifying")
-            tmat = tmat.A
+        if isinstance(tmat, LinearOperator):
+            logg.debug(
+                "Computing Schur decomposition of a matrix-free transition matrix using Rayleigh-Ritz"
+            )
+            self._gpcca = None
+
+            def do_schur(m: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+                return _partial_schur(tmat, eta=eta, m=m, which=which)
+
+        else:
+            gpcca_cls = _GPCCA
+            if method == "krylov":
+                try:
+                    import petsc4py
+                    import slepc4py
+                except ImportError:
+                    if issparse(tmat):
+                        logg.debug(
+                            "Unable to import `petsc4py` or `slepc4py`. Using `scipy`'s Krylov solver"
+                        )
+                        gpcca_cls = _ScipyGPCCA
+                    else:
+                        method = "brandts"
+                        logg.warning(
+                            f"Unable to import `petsc4py` or `slepc4py`. Using `method={method!r}`"
+                        )
+
+            if method == "brandts" and issparse(tmat):
+                logg.warning(
+                    "For `method='brandts'`, dense matrix is required. Densifying"
+                )
+                tmat = tmat.A
+            self._gpcca = gpcca_cls(tmat, eta=eta, z=which, method=method, lift=lift)
+
+            def do_schur(m: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+                self._gpcca._do_schur_helper(m)
+                return (
+                    self._gpcca._p_X,
+                    self._gpcca._p_R,
+                    self._gpcca._p_eigenvalues,
+                )
 
-        self._gpcca = GPCCA(tmat, eta=initial_distribution, z=which, method=method)
         start = logg.info("Computing Schur decomposition")
 
         try:
-            self._gpcca._do_schur_helper(n_components)
+            X, R, evals = do_schur(n_components)
         except ValueError as e:
             if "will split complex conjugate eigenvalues" not in str(e):
                 raise
@@ -170,32 +268,39 @@ class SchurMixin:
                 f"Using `{n_components}` components would split a block of complex conjugate eigenvalues. "
                 f"Using `n_components={n_components + 1}`"
             )
-            self._gpcca._do_schur_helper(n_components + 1)
+            X, R, evals = do_schur(n_components + 1)
 
         self._invalid_n_states = np.array(
-            [
-                i
-                for i in range(2, len(self._gpcca._p_eigenvalues))
-                if _check_conj_split(self._gpcca._p_eigenvalues[:i])
-            ]
+            [i for i in range(2, len(evals)) if _check_conj_split(evals[:i])]
         )
         if len(self._invalid_n_states):
             logg.info(
                 f"When computing macrostates, choose a number of states NOT in `{list(self._invalid_n_states)}`"
             )
 
-        self._write_schur_decomposition(
-            {
-                "D": self._gpcca._p_eigenvalues,
-                "eigengap": _eigengap(self._gpcca._p_eigenvalues, alpha),
-                "params": {
-                    "which": which,
-                    "k": len(self._gpcca._p_eigenvalues),
-                    "alpha": alpha,
-                },
+        decomp = {
+            "D": evals,
+            "eigengap": _eigengap(evals, alpha),
+            "params": {
+                "which": which,
+                "k": len(evals),
+                "alpha": alpha,
             },
-            vectors=self._gpcca._p_X,
-            matrix=self._gpcca._p_R,
+        }
+        if lift is not None:
+            X = lift @ X
+            decomp["metacells"] = _metacells_error(
+                self.transition_matrix, lift=lift, coarse=tmat, X=X, R=R
+            )
+            logg.info(
+                f"Metacells have lumpability error `{decomp['metacells']['lumpability_error']:.4f}` "
+                f"and Schur residual `{decomp['metacells']['schur_residual']:.4f}`"
+            )
+
+        self._write_schur_decomposition(
+            decomp,
+            vectors=X,
+            matrix=R,
             params=self._create_params(),
             time=start,
         )
@@ -311,3 +416,361 @@ class SchurMixin:
         # fmt: on
 
         return sg.ok
+
+
+class _GPCCA(GPCCA):
+    """
+    :class:`pygpcca.GPCCA` which memoizes the optimized memberships for each number of macrostates.
+
+    The cache is tied to the current Schur decomposition and is cleared whenever it is recomputed.
+    If ``lift`` is specified, the transition matrix is defined over metacells and :meth:`_lift` maps
+    metacell-level quantities back to the cells.
+    """
+
+    def __init__(self, *args: Any, lift: Optional[spmatrix] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._cache: Dict[int, Tuple[Dict[str, Any], List[str]]] = {}
+        self._cache_X: Optional[np.ndarray] = None
+        self._lift_matrix = lift
+
+    def _lift(self, x: np.ndarray) -> np.ndarray:
+        return x if self._lift_matrix is None else self._lift_matrix @ x
+
+    def optimize(self, m: Union[int, Tuple[int, int], Dict[str, int]]) -> "_GPCCA":
+        """Optimize the memberships, reusing the cached result if ``m`` is an integer."""
+        if not isinstance(m, (int, np.integer)):
+            return super().optimize(m)
+
+        m = int(m)
+        self._validate_cache()
+        if m in self._cache:
+            attrs, msgs = self._cache[m]
+            for msg in msgs:
+                warnings.warn(msg)
+            self.__dict__.update(attrs)
+            return self
+
+        with warnings.catch_warnings(record=True) as ws:
+            warnings.simplefilter("always")
+            try:
+                super().optimize(m)
+            finally:
+                msgs = [str(w.message) for w in ws]
+        for msg in msgs:
+            warnings.warn(msg)
+
+        self._validate_cache()
+        self._cache[m] = (_snapshot(self), msgs)
+
+        return self
+
+    @d.dedent
+    def _sweep(
+        self,
+        m_min: int,
+        m_max: int,
+        n_jobs: Optional[int] = None,
+        backend: str = "loky",
+        show_progress_bar: bool = False,
+    ) -> List[float]:
+        """
+        Compute the *minChi* criterion and optimize the memberships for all numbers of macrostates in a range.
+
+        Parameters
+        ----------
+        m_min
+            Minimum number of macrostates.
+        m_max
+            Maximum number of macrostates.
+        %(parallel)s
+
+        Returns
+        -------
+        The *minChi* criterion for each number of macrostates in `[m_min, m_max]`.
+        """
+        if m_min >= m_max:
+            raise ValueError(
+                f"Expected `m_min` to be smaller than `m_max`, found `{m_min}` and `{m_max}`."
+            )
+        self._do_schur_helper(m_max)
+        self._validate_cache()
+        # computed only once, shared by all the copies
+        _ = self.stationary_probability
+
+        ms = range(m_min, m_max + 1)
+        todo = [
+            m
+            for m in ms
+            if m not in self._cache and not _check_conj_split(self._p_eigenvalues[:m])
+        ]
+        res = []
+        if len(todo):
+            res = parallelize(
+                _optimize_many,
+                collection=np.asarray(todo, dtype=int),
+                n_jobs=n_jobs,
+                backend=backend,
+                show_progress_bar=show_progress_bar,
+                as_array=False,
+                unit="macrostate",
+            )(self)
+        for m, attrs, msgs in (r for rs in res for r in rs):
+            if attrs is not None:
+                self._cache[m] = (attrs, msgs)
+
+        return [_cluster_by_isa(self._p_X[:, :m])[1] for m in ms]
+
+    def _validate_cache(self) -> None:
+        if self._cache_X is not self._p_X:
+            self._cache.clear()
+            self._cache_X = self._p_X
+
+
+class _ScipyGPCCA(_GPCCA):
+    """:class:`pygpcca.GPCCA` which computes the partial Schur decomposition using :mod:`scipy` instead of SLEPc."""
+
+    def _do_schur_helper(self, m: int) -> None:
+        if self._p_R is None or self._p_R.shape[1] < m:
+            self._p_X, self._p_R, self._p_eigenvalues = _partial_schur(
+                self._P, eta=self._eta, m=m, which=self._z
+            )
+        # checks the splitting of complex conjugate eigenvalues
+        super()._do_schur_helper(m)
+
+
+def _partial_schur(
+    T: Union[spmatrix, LinearOperator],
+    eta: np.ndarray,
+    m: int,
+    which: Literal["LR", "LM"] = "LR",
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute a partial, sorted Schur decomposition of a large transition matrix without SLEPc.
+
+    The dominant invariant subspace of the :math:`\\eta`-weighted matrix is spanned by its top eigenvectors,
+    which are orthonormalized. The small projected matrix is then decomposed as in :mod:`pygpcca`.
+
+    Parameters
+    ----------
+    T
+        Row-stochastic sparse or matrix-free transition matrix of shape `(n, n)`.
+    eta
+        Input distribution of shape `(n,)`.
+    m
+        Number of Schur vectors.
+    which
+        Which eigenvalues to select.
+
+    Returns
+    -------
+    The Schur vectors of shape `(n, m)`, the Schur matrix of shape `(m, m)` and the `m` eigenvalues.
+    """
+    n = T.shape[0]
+    if eta.shape != (n,):
+        raise ValueError(
+            f"Expected `initial_distribution` to be of shape `{(n,)}`, found `{eta.shape}`."
+        )
+    if not np.all(eta > EPS):
+        raise ValueError("Expected `initial_distribution` to be strictly positive.")
+    eta = eta / np.sum(eta)
+    sqrt_eta = np.sqrt(eta)
+
+    if isinstance(T, LinearOperator):
+        T_bar = (
+            aslinearoperator(diags(sqrt_eta))
+            * T
+            * aslinearoperator(diags(1.0 / sqrt_eta))
+        )
+    else:
+        T_bar = (diags(sqrt_eta) @ T @ diags(1.0 / sqrt_eta)).tocsr()
+    # compute one more eigenvector to be able to detect splitting of complex conjugate pairs
+    k = min(m + 1, n - 2)
+    # fixed starting vector for reproducibility
+    v0 = np.random.RandomState(0).uniform(size=n)
+    _, V = eigs(T_bar, k=k, which=which, v0=v0)
+
+    # orthonormal basis of the invariant subspace, real and imaginary parts span the same real subspace
+    U, sigma, _ = svd(np.hstack([V.real, V.imag]), full_matrices=False)
+    Q = U[:, sigma > sigma[0] * np.sqrt(EPS)]
+    if Q.shape[1] < m:
+        raise ValueError(
+            f"Unable to find an invariant subspace of dimension `{m}`, found only `{Q.shape[1]}`."
+        )
+
+    R, Z, evals = sorted_brandts_schur(
+        Q.T @ np.asarray(T_bar @ Q), k=Q.shape[1], z=which
+    )
+    if _check_conj_split(evals[:m]):
+        raise ValueError(f"Using `m={m}` will split complex conjugate eigenvalues.")
+
+    X = (Q @ Z[:, :m]) / sqrt_eta[:, None]
+    # the first Schur vector is constant, up to a sign
+    X *= np.sign(np.sum(X[:, 0]))
+    X[:, 0] = 1.0
+
+    return X, R[:m, :m], evals[:m]
+
+
+def _snapshot(g: GPCCA) -> Dict[str, Any]:
+    return {attr: getattr(g, attr) for attr in _OPTIMIZE_ATTRS}
+
+
+def _optimize_many(
+    ms: Sequence[int], g: _GPCCA, queue: Optional[Any] = None
+) -> List[Tuple[int, Optional[Dict[str, Any]], List[str]]]:
+    res = []
+    for m in ms:
+        m = int(m)
+        # the cache of the copy is shared, bypass it
+        gc = copy(g)
+        with warnings.catch_warnings(record=True) as ws:
+            warnings.simplefilter("always")
+            try:
+                GPCCA.optimize(gc, m)
+                res.append((m, _snapshot(gc), [str(w.message) for w in ws]))
+            except ValueError:
+                # not cached, the error will be raised once this number of states is requested
+                res.append((m, None, []))
+        if queue is not None:
+            queue.put(1)
+
+    if queue is not None:
+        queue.put(None)
+
+    return res
+
+
+def _metacells(
+    T: Union[np.ndarray, spmatrix],
+    n_metacells: int,
+    n_steps: int = 3,
+    n_comps: int = 32,
+    seed: int = 0,
+) -> csr_matrix:
+    """
+    Aggregate cells with similar short-time dynamics into metacells.
+
+    Rows of :math:`T^s` are embedded using a random projection and clustered using
+    :class:`sklearn.cluster.MiniBatchKMeans`. Cells whose transition probabilities after `s` steps are similar,
+    and hence approximately lumpable, end up in the same metacell.
+
+    Parameters
+    ----------
+    T
+        Transition matrix of shape `(n, n)`.
+    n_metacells
+        Number of metacells.
+    n_steps
+        Number of steps `s`.
+    n_comps
+        Dimension of the random projection.
+    seed
+        Random seed.
+
+    Returns
+    -------
+    Assignment matrix of shape `(n, n_metacells)` with exactly one `1` per row.
+    """
+    n = T.shape[0]
+    X = np.random.RandomState(seed).standard_normal((n, n_comps))
+    for _ in range(n_steps):
+        X = T @ X
+
+    labels = MiniBatchKMeans(
+        n_clusters=n_metacells, n_init=1, random_state=seed
+    ).fit_predict(np.asarray(X))
+    # empty clusters are removed
+    _, labels = np.unique(labels, return_inverse=True)
+
+    return csr_matrix(
+        (np.ones(n), (np.arange(n), labels)), shape=(n, np.max(labels) + 1)
+    )
+
+
+def _coarsen(
+    T: Union[np.ndarray, spmatrix], eta: np.ndarray, lift: spmatrix
+) -> Tuple[csr_matrix, np.ndarray]:
+    """
+    Coarse-grain the transition matrix onto the metacells.
+
+    Parameters
+    ----------
+    T
+        Transition matrix of shape `(n, n)`.
+    eta
+        Input distribution of shape `(n,)`.
+    lift
+        Assignment matrix :math:`P` of shape `(n, k)`.
+
+    Returns
+    -------
+    The row-stochastic matrix :math:`(P^T D P)^{-1} P^T D T P` of shape `(k, k)`, with :math:`D` having ``eta``
+    on its diagonal, and the coarse-grained input distribution :math:`P^T \\eta`.
+    """
+    if eta.shape != (T.shape[0],):
+        raise ValueError(
+            f"Expected `initial_distribution` to be of shape `{(T.shape[0],)}`, found `{eta.shape}`."
+        )
+    eta_coarse = lift.T @ eta
+    T_coarse = lift.T @ (diags(eta) @ T @ lift)
+
+    return csr_matrix(diags(1.0 / eta_coarse) @ T_coarse), eta_coarse
+
+
+def _metacells_error(
+    T: Union[np.ndarray, spmatrix],
+    lift: spmatrix,
+    coarse: spmatrix,
+    X: np.ndarray,
+    R: np.ndarray,
+    n_samples: int = _METACELLS_N_SAMPLES,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """
+    Estimate the error of the metacell coarsening on a sample of cells.
+
+    Parameters
+    ----------
+    T
+        Transition matrix of shape `(n, n)`.
+    lift
+        Assignment matrix of shape `(n, k)`.
+    coarse
+        Coarse-grained transition matrix of shape `(k, k)`.
+    X
+        Lifted Schur vectors of shape `(n, m)`.
+    R
+        Schur matrix of shape `(m, m)`.
+    n_samples
+        Number of cells to sample.
+    seed
+        Random seed.
+
+    Returns
+    -------
+    Dictionary with the following keys:
+
+        - `'lumpability_error'` - mean total variation distance between the transitions of the sampled cells into
+          the metacells and the transitions of their metacells.
+        - `'schur_residual'` - relative residual :math:`\\|T X - X R\\|_F / \\|X\\|_F` of the lifted Schur vectors
+          on the sampled cells.
+    """
+
+    def dense(x: Union[np.ndarray, spmatrix]) -> np.ndarray:
+        return x.toarray() if issparse(x) else np.asarray(x)
+
+    n = T.shape[0]
+    ixs = np.sort(
+        np.random.RandomState(seed).choice(n, size=min(n, n_samples), replace=False)
+    )
+    rows = T[ixs]
+    labels = lift[ixs].indices
+
+    lump = 0.5 * np.abs(dense(rows @ lift) - dense(coarse[labels])).sum(1)
+    residual = np.linalg.norm(dense(rows @ X) - X[ixs] @ R) / np.linalg.norm(X[ixs])
+
+    return {
+        "n_metacells": int(lift.shape[1]),
+        "lumpability_error": float(np.mean(lump)),
+        "schur_residual": float(residual),
+    }
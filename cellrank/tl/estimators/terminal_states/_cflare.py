@@ -60,16 +60,18 @@ class CFLARE(TermStatesEstimator, LinDriversMixin, EigenMixin):
         self,
         use: Optional[Union[int, Sequence[int]]] = None,
         percentile: Optional[int] = 98,
-        method: Literal["leiden", "means"] = "leiden",
+        method: Literal["leiden", "kmeans", "minibatch_kmeans"] = "leiden",
         cluster_key: Optional[str] = None,
         n_clusters_kmeans: Optional[int] = None,
-        n_neighbors: int = 20,
+        n_neighbors: Optional[int] = 20,
         resolution: float = 0.1,
         n_matches_min: int = 0,
         n_neighbors_filtering: int = 15,
         basis: Optional[str] = None,
         n_comps: int = 5,
         scale: Optional[bool] = None,
+        batch_size: int = 1024,
+        n_jobs: Optional[int] = None,
     ) -> None:
         """
         Find approximate recurrent classes of the Markov chain.
@@ -89,6 +91,7 @@ class CFLARE(TermStatesEstimator, LinDriversMixin, EigenMixin):
             Method to be used for clustering. Valid option are:
 
                 - `'kmeans'` - :class:`sklearn.cluster.KMeans`.
+                - `'minibatch_kmeans'` - :class:`sklearn.cluster.MiniBatchKMeans`.
                 - `'leiden'` - :func:`scanpy.tl.leiden`.
         cluster_key
             Key in :attr:`anndata.AnnData.obs` in order to associate names and colors with :attr:`terminal_states`.
@@ -97,6 +100,8 @@ class CFLARE(TermStatesEstimator, LinDriversMixin, EigenMixin):
         n_neighbors
             Number of neighbors in a KNN graph. This is the :math:`K` parameter for that,
             the number of neighbors for each cell. Only used when ``method = 'leiden'``.
+            If `None`, use the connectivities in :attr:`anndata.AnnData.obsp`, restricted to the retained cells,
+            instead of computing the KNN graph of the features.
         resolution
             Resolution parameter for :func:`scanpy.tl.leiden`. Should be chosen relatively small.
         n_matches_min
@@ -112,6 +117,10 @@ class CFLARE(TermStatesEstimator, LinDriversMixin, EigenMixin):
             Number of embedding components to be use when ``basis != None``.
         scale
             Scale the values to z-scores. If `None`, scale the values if ``basis != None``.
+        batch_size
+            Size of the mini-batches. Only used when ``method = 'minibatch_kmeans'``.
+        %(n_jobs)s
+            Only used for the KNN search when ``method = 'leiden'`` and ``n_neighbors != None``.
 
         Returns
         -------
@@ -124,9 +133,9 @@ class CFLARE(TermStatesEstimator, LinDriversMixin, EigenMixin):
         def convert_use(
             use: Optional[Union[int, Sequence[int], np.ndarray]]
         ) -> List[int]:
-            if method not in ["kmeans", "leiden"]:
+            if method not in ["kmeans", "minibatch_kmeans", "leiden"]:
                 raise ValueError(
-                    f"Invalid method `{method!r}`. Valid options are `leiden` or `kmeans`."
+                    f"Invalid method `{method!r}`. Valid options are `leiden`, `kmeans` or `minibatch_kmeans`."
                 )
 
             if use is None:
@@ -188,7 +197,7 @@ class CFLARE(TermStatesEstimator, LinDriversMixin, EigenMixin):
             X = zscore(X, axis=0)
 
         # cluster X
-        if method == "kmeans" and n_clusters_kmeans is None:
+        if method in ("kmeans", "minibatch_kmeans") and n_clusters_kmeans is None:
             n_clusters_kmeans = len(use) + (percentile is None)
             if X.shape[0] < n_clusters_kmeans:
                 raise ValueError(
@@ -198,12 +207,22 @@ class CFLARE(TermStatesEstimator, LinDriversMixin, EigenMixin):
 
         # fmt: off
         logg.debug(f"Using `{use}` eigenvectors, basis `{basis!r}` and method `{method!r}` for clustering")
+        connectivities = None
+        if method == "leiden" and n_neighbors is None:
+            connectivities = _get_connectivities(self.adata)
+            if connectivities is None:
+                raise KeyError("Unable to find connectivities. Compute them first as `scanpy.pp.neighbors()`.")
+            if percentile is not None:
+                connectivities = connectivities[ixs][:, ixs]
         clusters = _cluster_X(
             X,
             method=method,
             n_clusters=n_clusters_kmeans,
             n_neighbors=n_neighbors,
             resolution=resolution,
+            batch_size=batch_size,
+            connectivities=connectivities,
+            n_jobs=n_jobs,
         )
 
         # fill in the labels in case we filtered out cells before
@@ -11,12 +11,7 @@ from cellrank import logging as logg
 from cellrank._key import Key
 from cellrank.tl._enum import ModeEnum
 from cellrank.ul._docs import d
-from cellrank.tl._utils import (
-    save_fig,
-    _eigengap,
-    _fuzzy_to_discrete,
-    _series_from_one_hot_matrix,
-)
+from cellrank.tl._utils import save_fig, _eigengap, _fuzzy_to_discrete
 from cellrank.tl._colors import _get_black_or_white, _create_categorical_colors
 from cellrank.tl._lineage import Lineage
 from cellrank.tl.estimators._utils import SafeGetter
@@ -31,6 +26,7 @@ import numpy as np
 import pandas as pd
 from scipy.sparse import spmatrix
 from pandas.api.types import infer_dtype, is_categorical_dtype
+from scipy.sparse.linalg import LinearOperator
 
 import matplotlib.pyplot as plt
 from matplotlib.axes import Axes
@@ -133,11 +129,18 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
         n_states: Optional[Union[int, Sequence[int]]] = None,
         n_cells: Optional[int] = 30,
         cluster_key: Optional[str] = None,
+        n_jobs: Optional[int] = None,
+        backend: str = "loky",
+        show_progress_bar: bool = False,
         **kwargs: Any,
     ) -> None:
         """
         Compute the macrostates.
 
+        If ``n_states`` is a :class:`typing.Sequence`, the memberships for all numbers of macrostates in the interval
+        are optimized in parallel. The optimized memberships are cached until the Schur decomposition changes,
+        so switching between already computed numbers of macrostates is fast.
+
         Parameters
         ----------
         n_states
@@ -146,6 +149,7 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
         %(n_cells)s
         cluster_key
             If a key to cluster labels is given, names and colors of the states will be associated with the clusters.
+        %(parallel)s
         kwargs
             Keyword arguments for :meth:`compute_schur`.
 
@@ -163,7 +167,17 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
             - :attr:`eigendecomposition` - %(eigen.summary)s
         """
 
-        n_states = self._n_states(n_states)
+        if n_states != 1 and isinstance(self.transition_matrix, LinearOperator):
+            raise TypeError(
+                "Computing macrostates requires an explicit transition matrix, "
+                "found a matrix-free transition matrix."
+            )
+        n_states = self._n_states(
+            n_states,
+            n_jobs=n_jobs,
+            backend=backend,
+            show_progress_bar=show_progress_bar,
+        )
         if n_states == 1:
             self._compute_one_macrostate(
                 n_cells=n_cells,
@@ -198,7 +212,7 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
             self._gpcca = self._gpcca.optimize(m=n_states + 1)
 
         self._set_macrostates(
-            memberships=self._gpcca.memberships,
+            memberships=self._gpcca._lift(self._gpcca.memberships),
             n_cells=n_cells,
             cluster_key=cluster_key,
             params=self._create_params(),
@@ -418,9 +432,6 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
         if n_states is None:
             self.compute_eigendecomposition()
             n_states = self.eigendecomposition["eigengap"] + 1
-        if isinstance(n_states, int) and n_states == 1:
-            self.compute_eigendecomposition()
-
         self.compute_macrostates(n_states=n_states, cluster_key=cluster_key, **kwargs)
 
         return self
@@ -767,7 +778,13 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
         if not show:
             return ax
 
-    def _n_states(self, n_states: Optional[Union[int, Sequence[int]]]) -> int:
+    def _n_states(
+        self,
+        n_states: Optional[Union[int, Sequence[int]]],
+        n_jobs: Optional[int] = None,
+        backend: str = "loky",
+        show_progress_bar: bool = False,
+    ) -> int:
         if n_states is None:
             if self.eigendecomposition is None:
                 raise RuntimeError(
@@ -805,7 +822,15 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
 
         logg.info(f"Calculating minChi criterion in interval `[{minn}, {maxx}]`")
 
-        return int(np.arange(minn, maxx + 1)[np.argmax(self._gpcca.minChi(minn, maxx))])
+        minchi = self._gpcca._sweep(
+            minn,
+            maxx,
+            n_jobs=n_jobs,
+            backend=backend,
+            show_progress_bar=show_progress_bar,
+        )
+
+        return int(np.arange(minn, maxx + 1)[np.argmax(minchi)])
 
     def _create_states(
         self,
@@ -817,18 +842,23 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
         if n_cells <= 0:
             raise ValueError(f"Expected `n_cells` to be positive, found `{n_cells}`.")
 
-        discrete, not_enough_cells = _fuzzy_to_discrete(
+        codes, not_enough_cells = _fuzzy_to_discrete(
             a_fuzzy=probs,
             n_most_likely=n_cells,
             remove_overlap=False,
             raise_threshold=0.2,
             check_row_sums=check_row_sums,
+            return_codes=True,
         )
 
-        states = _series_from_one_hot_matrix(
-            membership=discrete,
+        names = (
+            list(probs.names)
+            if isinstance(probs, Lineage)
+            else [str(i) for i in range(probs.shape[1])]
+        )
+        states = pd.Series(
+            pd.Categorical.from_codes(codes, categories=names),
             index=self.adata.obs_names,
-            names=probs.names if isinstance(probs, Lineage) else None,
         )
 
         return (states, not_enough_cells) if return_not_enough_cells else states
@@ -859,8 +889,8 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
         ):
             stationary_dist = eig["stationary_dist"]
         else:
-            self.compute_eigendecomposition(only_evals=False, which="LR")
-            stationary_dist = self.eigendecomposition["stationary_dist"]
+            self.compute_stationary_distribution()
+            stationary_dist = self.stationary_distribution
 
         self._set_macrostates(
             memberships=stationary_dist[:, None],
@@ -975,7 +1005,7 @@ class GPCCA(TermStatesEstimator, LinDriversMixin, SchurMixin, EigenMixin):
                 dists["coarse_stat_dist"] = pd.Series(stat_dist, index=names)
 
             key = Key.obsm.schur_vectors(self.backward)
-            self._set("_schur_vectors", obj=self.adata.obsm, key=key, value=g._p_X, shadow_only=True)
+            self._set("_schur_vectors", obj=self.adata.obsm, key=key, value=g._lift(g._p_X), shadow_only=True)
             key = Key.uns.schur_matrix(self.backward)
             self._set("_schur_matrix", obj=self.adata.uns, key=key, value=g._p_R, shadow_only=True)
             self._set("_coarse_tmat", value=tmat, shadow_only=True)
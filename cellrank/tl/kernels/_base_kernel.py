@@ -12,11 +12,11 @@ from typing import (
     Sequence,
 )
 
-import warnings
 from abc import ABC, abstractmethod
 from copy import copy
 from pathlib import Path
 from functools import reduce
+from collections import OrderedDict
 
 import scvelo as scv
 from anndata import AnnData
@@ -29,16 +29,32 @@ from cellrank.tl._utils import (
     _symmetric,
     _get_neighs,
     _irreducible,
+    _estimate_cond_num,
 )
 from scvelo.plotting.utils import default_size, plot_outline
 from cellrank.tl._mixins._io import IOMixin
-from cellrank.tl.kernels._utils import _get_basis, _filter_kwargs
+from cellrank.tl.kernels._cache import _cache_load, _cache_save, _get_cachedir
+from cellrank.tl.kernels._utils import (
+    _get_basis,
+    _fingerprint,
+    _filter_kwargs,
+    _union_pattern,
+    _project_embedding,
+    _fused_weighted_sum,
+)
+from cellrank.tl._linear_operator import (
+    SparsePlusLowRank,
+    _product,
+    _row_sums,
+    _weighted_sum,
+)
 from cellrank.tl.kernels._tmat_flow import FlowPlotter
 from cellrank.tl.kernels._random_walk import RandomWalk
 
 import numpy as np
 from scipy.sparse import spdiags, issparse, spmatrix, csr_matrix, isspmatrix_csr
 from pandas.api.types import infer_dtype, is_numeric_dtype
+from scipy.sparse.linalg import LinearOperator
 from pandas.core.dtypes.common import is_categorical_dtype
 
 import matplotlib.pyplot as plt
@@ -60,6 +76,9 @@ _RTOL = 1e-12
 _n_dec = 2
 _dtype = np.float64
 _cond_num_tolerance = 1e-15
+# results of the KNN graph checks, keyed by the fingerprint of the graph
+_graph_checks: "OrderedDict[str, Dict[str, bool]]" = OrderedDict()
+_graph_checks_maxsize = 32
 Indices_t = Optional[
     Union[Sequence[str], Dict[str, Union[str, Sequence[str], Tuple[float, float]]]]
 ]
@@ -82,25 +101,35 @@ class KernelExpression(IOMixin, ABC):
         self._params = {}
         self._normalize = True
         self._parent = None
+        self._term = None
+        self._flow_plotter = None
 
     def __init_subclass__(cls, **kwargs: Any):
         super().__init_subclass__()
 
     @property
-    def condition_number(self) -> Optional[int]:
-        """Condition number of the transition matrix."""
+    def condition_number(self) -> Optional[float]:
+        """Estimated condition number of the transition matrix."""
         return self._cond_num
 
     @property
-    def transition_matrix(self) -> Union[np.ndarray, spmatrix]:
+    def transition_matrix(self) -> Union[np.ndarray, spmatrix, LinearOperator]:
         """
         Return row-normalized transition matrix.
 
-        If not present, it is computed iff all underlying kernels have been initialized.
+        If not present, it is computed iff all underlying kernels have been initialized. Can also be
+        a :class:`scipy.sparse.linalg.LinearOperator`, such as :class:`cellrank.tl.SparsePlusLowRank`.
         """
 
-        if self._parent is None and self._transition_matrix is None:
-            self.compute_transition_matrix()
+        if self._transition_matrix is None:
+            if self._parent is None:
+                self.compute_transition_matrix()
+            elif getattr(self, "_term", None) is not None:
+                # the expression was evaluated as part of its parent
+                weight, mats = self._term
+                self._transition_matrix = (
+                    weight * _product(mats) if len(mats) else weight
+                )
 
         return self._transition_matrix
 
@@ -139,7 +168,9 @@ class KernelExpression(IOMixin, ABC):
         )
 
     @transition_matrix.setter
-    def transition_matrix(self, value: Union[np.ndarray, spmatrix]) -> None:
+    def transition_matrix(
+        self, value: Union[np.ndarray, spmatrix, LinearOperator]
+    ) -> None:
         """
         Set a new value of the transition matrix.
 
@@ -153,7 +184,11 @@ class KernelExpression(IOMixin, ABC):
         None
             Nothing, just updates the :attr:`transition_matrix` and optionally normalizes it.
         """
-        should_norm = ~np.isclose(value.sum(1), 1.0, rtol=_RTOL).all()
+        should_norm = ~np.isclose(_row_sums(value), 1.0, rtol=_RTOL).all()
+        # the condition number is cached per transition matrix
+        self._cond_num = None
+        self._term = None
+        self._flow_plotter = None
 
         if self._parent is None:
             self._transition_matrix = _normalize(value) if should_norm else value
@@ -213,6 +248,10 @@ class KernelExpression(IOMixin, ABC):
             **self.adata.uns.get(f"{key}_params", {}),
             **{"params": self.params},
         }
+        if isinstance(self.transition_matrix, LinearOperator):
+            raise TypeError(
+                "Unable to write a matrix-free transition matrix to `adata.obsp`."
+            )
         self.adata.obsp[key] = self.transition_matrix
 
     @abstractmethod
@@ -222,12 +261,9 @@ class KernelExpression(IOMixin, ABC):
     def _maybe_compute_cond_num(self) -> None:
         """Optionally compute condition number."""
         if self._compute_cond_num and self._cond_num is None:
-            logg.debug("Computing condition number")
-            self._cond_num = np.linalg.cond(
-                self._transition_matrix.toarray()
-                if issparse(self._transition_matrix)
-                else self._transition_matrix
-            )
+            start = logg.debug("Estimating condition number")
+            self._cond_num = _estimate_cond_num(self._transition_matrix)
+            logg.debug("    Finish", time=start)
             if self._cond_num > _cond_num_tolerance:
                 logg.warning(
                     f"Transition matrix may be ill-conditioned, its condition number is `{self._cond_num:.2e}`"
@@ -258,10 +294,10 @@ class KernelExpression(IOMixin, ABC):
 
     def compute_projection(
         self,
-        basis: str = "umap",
+        basis: Union[str, Sequence[str]] = "umap",
         key_added: Optional[str] = None,
         copy: bool = False,
-    ) -> Optional[np.ndarray]:
+    ) -> Optional[Union[np.ndarray, Dict[str, np.ndarray]]]:
         """
         Compute a projection of the transition matrix in the embedding.
 
@@ -273,7 +309,9 @@ class KernelExpression(IOMixin, ABC):
         Parameters
         ----------
         basis
-            Basis in :attr:`anndata.AnnData.obsm` for which to compute the projection.
+            Basis in :attr:`anndata.AnnData.obsm` for which to compute the projection. Can also be a sequence
+            of bases, in which case the transition probabilities along the KNN graph are only extracted once
+            and shared across all bases.
         key_added
             If not `None` and ``copy = False``, save the result to :attr:`anndata.AnnData.obsm` ``['{key_added}']``.
             Otherwise, save the result to `'T_fwd_{basis}'` or `T_bwd_{basis}`, depending on the direction.
@@ -282,7 +320,8 @@ class KernelExpression(IOMixin, ABC):
 
         Returns
         -------
-        If ``copy=True``, the projection array of shape `(n_cells, n_components)`.
+        If ``copy=True``, the projection array of shape `(n_cells, n_components)` or, if multiple bases were
+        specified, a :class:`dict` mapping each basis to its projection.
         Otherwise, it modifies :attr:`anndata.AnnData.obsm` with a key based on ``key_added``.
         """
         # modified from: https://github.com/theislab/scvelo/blob/master/scvelo/tools/velocity_embedding.py
@@ -301,50 +340,43 @@ class KernelExpression(IOMixin, ABC):
                     "only works for kNN based kernels."
                 )
 
-        start = logg.info(f"Projecting transition matrix onto `{basis}`")
-        emb = _get_basis(self.adata, basis)
-        T_emb = np.empty_like(emb)
+        bases = [basis] if isinstance(basis, str) else list(basis)
+        embs = {b: _get_basis(self.adata, b) for b in bases}
 
+        start = logg.info(f"Projecting transition matrix onto `{', '.join(bases)}`")
         conn = self.kernels[0]._conn
+        if not isspmatrix_csr(conn):
+            conn = csr_matrix(conn)
 
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            for row_id, row in enumerate(self.transition_matrix):
-                conn_idxs = conn[row_id, :].indices
-
-                dX = emb[conn_idxs] - emb[row_id, None]
-
-                if np.any(np.isnan(dX)):
-                    T_emb[row_id, :] = np.nan
-                else:
-                    probs = row[:, conn_idxs]
-                    if issparse(probs):
-                        probs = probs.A.squeeze()
-
-                    dX /= np.linalg.norm(dX, axis=1)[:, None]
-                    dX = np.nan_to_num(dX)
-                    T_emb[row_id, :] = probs.dot(dX) - dX.sum(0) / dX.shape[0]
-
-        T_emb /= 3 * quiver_autoscale(np.nan_to_num(emb), T_emb)
+        T_embs = {}
+        for (b, emb), T_emb in zip(
+            embs.items(),
+            _project_embedding(self.transition_matrix, conn, list(embs.values())),
+        ):
+            T_emb /= 3 * quiver_autoscale(np.nan_to_num(emb), T_emb)
+            T_embs[b] = T_emb
 
         if copy:
-            return T_emb
+            return T_embs[basis] if isinstance(basis, str) else T_embs
 
         key = Key.uns.kernel(self.backward, key=key_added)
         ukey = f"{key}_params"
 
-        embs = self.adata.uns.get(ukey, {}).get("embeddings", [])
-        if basis not in embs:
-            embs = list(embs) + [basis]
+        embs = list(self.adata.uns.get(ukey, {}).get("embeddings", []))
+        if any(b not in embs for b in bases):
+            embs += [b for b in bases if b not in embs]
             self.adata.uns[ukey] = self.adata.uns.get(ukey, {})
             self.adata.uns[ukey]["embeddings"] = embs
 
-        key = key + "_" + basis
+        keys = []
+        for b, T_emb in T_embs.items():
+            keys.append(f"{key}_{b}")
+            self.adata.obsm[keys[-1]] = T_emb
+
         logg.info(
-            f"Adding `adata.obsm[{key!r}]`\n    Finish",
+            f"Adding {', '.join(f'`adata.obsm[{k!r}]`' for k in keys)}\n    Finish",
             time=start,
         )
-        self.adata.obsm[key] = T_emb
 
     @d.dedent
     def plot_random_walks(
@@ -582,7 +614,13 @@ class KernelExpression(IOMixin, ABC):
                 "Compute transition matrix first as `.compute_transition_matrix()`."
             )
 
-        fp = FlowPlotter(self.adata, self.transition_matrix, cluster_key, time_key)
+        # the flow between all clusters is computed once and reused for other source clusters
+        fp = getattr(self, "_flow_plotter", None)
+        if fp is None or not fp._is_valid(
+            self.adata, self.transition_matrix, cluster_key, time_key
+        ):
+            fp = FlowPlotter(self.adata, self.transition_matrix, cluster_key, time_key)
+            self._flow_plotter = fp
         fp = fp.prepare(cluster, clusters, time_points)
 
         ax = fp.plot(
@@ -940,6 +978,10 @@ class Kernel(UnaryKernelExpression, ABC):
     on other functions which have computed a similarity based on two input arguments. The role of the kernels defined
     here is to add directionality to these symmetric similarity relations or to transform them.
 
+    If ``cellrank.settings.kernel_cache = True``, kernels which support it store the computed transition matrices in
+    ``cellrank.settings.cachedir`` and load them in subsequent sessions, as long as the inputs and parameters match.
+    The size of the cache is bounded by ``cellrank.settings.kernel_cache_max_size`` bytes.
+
     Parameters
     ----------
     %(adata)s
@@ -996,20 +1038,86 @@ class Kernel(UnaryKernelExpression, ABC):
             self.adata, mode="connectivities", key=conn_key
         ).astype(_dtype)
 
+        # the same graph is usually shared by multiple kernels, check it only once
+        key = _fingerprint(self._conn)
         check_connectivity = kwargs.pop("check_connectivity", False)
         if check_connectivity:
             start = logg.debug("Checking the KNN graph for connectedness")
-            if not _connected(self._conn):
+            if not _check_graph(key, _connected, self._conn):
                 logg.warning("KNN graph is not connected", time=start)
             else:
                 logg.debug("KNN graph is connected", time=start)
 
         start = logg.debug("Checking the KNN graph for symmetry")
-        if not _symmetric(self._conn):
+        if not _check_graph(key, _symmetric, self._conn):
             logg.warning("KNN graph is not symmetric", time=start)
         else:
             logg.debug("KNN graph is symmetric", time=start)
 
+    def _cache_inputs(self) -> Optional[Tuple[Any, ...]]:
+        """
+        Return the data from which the transition matrix is computed.
+
+        Used to fingerprint the kernel for the persistent cache, see :attr:`cellrank.settings` ``.kernel_cache``.
+        If `None`, the transition matrix is never cached on disk.
+        """
+        return None
+
+    def _cache_extras(self) -> Dict[str, Any]:
+        """Return additional attributes which are cached alongside the transition matrix."""
+        return {}
+
+    def _reuse_cache(
+        self,
+        expected_params: Dict[str, Any],
+        *,
+        time: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> bool:
+        """
+        Reuse the transition matrix computed in memory or in a previous session.
+
+        Parameters
+        ----------
+        expected_params
+            Parameters of the transition matrix.
+        time
+            Start time used for logging.
+        kwargs
+            Parameters which update ``expected_params`` when fingerprinting the kernel for the persistent cache,
+            e.g. to include ones which are not saved in :attr:`params` or to ignore ones which don't affect the result.
+
+        Returns
+        -------
+        Whether the transition matrix has been restored.
+        """
+        self._cache_key = None
+        if super()._reuse_cache(expected_params, time=time):
+            return True
+
+        inputs = self._cache_inputs()
+        if inputs is None or _get_cachedir() is None:
+            return False
+
+        key = _fingerprint(
+            type(self).__name__, self.backward, inputs, {**expected_params, **kwargs}
+        )
+        data = _cache_load(key)
+        if data is None:
+            # will be written once the transition matrix is computed
+            self._cache_key = key
+            return False
+
+        logg.debug(f"Loading transition matrix from the cache entry `{key}`")
+        for attr, value in data["extras"].items():
+            setattr(self, attr, value)
+        self._params = data["params"]
+        self.transition_matrix = data["transition_matrix"]
+        self._maybe_compute_cond_num()
+        logg.info("    Finish", time=time)
+
+        return True
+
     def _density_normalize(
         self, other: Union[np.ndarray, spmatrix]
     ) -> Union[np.ndarray, spmatrix]:
@@ -1061,7 +1169,14 @@ class Kernel(UnaryKernelExpression, ABC):
                 f"found `{matrix.shape}`."
             )
 
-        matrix = matrix.astype(_dtype)
+        is_operator = isinstance(matrix, LinearOperator)
+        if is_operator and density_normalize:
+            raise ValueError(
+                "Density normalization is not supported for matrix-free transition matrices."
+            )
+
+        if not is_operator or isinstance(matrix, SparsePlusLowRank):
+            matrix = matrix.astype(_dtype)
         if issparse(matrix) and not isspmatrix_csr(matrix):
             matrix = csr_matrix(matrix)
 
@@ -1070,21 +1185,45 @@ class Kernel(UnaryKernelExpression, ABC):
             matrix = self._density_normalize(matrix)
 
         # check for zero-rows
-        problematic_indices = np.where(np.array(matrix.sum(1)).flatten() == 0)[0]
+        problematic_indices = np.where(_row_sums(matrix) == 0)[0]
         if len(problematic_indices):
             logg.warning(
                 f"Detected `{len(problematic_indices)}` absorbing states in the transition matrix. "
                 f"This matrix won't be irreducible"
             )
-            matrix[problematic_indices, problematic_indices] = 1.0
+            if is_operator:
+                eye = csr_matrix(
+                    (
+                        np.ones(len(problematic_indices), dtype=_dtype),
+                        (problematic_indices, problematic_indices),
+                    ),
+                    shape=matrix.shape,
+                )
+                matrix = _weighted_sum([matrix, eye], [1.0, 1.0])
+            else:
+                matrix[problematic_indices, problematic_indices] = 1.0
 
         if check_irreducibility:
-            _irreducible(matrix)
+            if is_operator:
+                logg.warning(
+                    "Unable to check irreducibility of a matrix-free transition matrix"
+                )
+            else:
+                _irreducible(matrix)
 
         # setting this property automatically row-normalizes
         self.transition_matrix = matrix
         self._maybe_compute_cond_num()
 
+        key, self._cache_key = getattr(self, "_cache_key", None), None
+        if key is not None:
+            _cache_save(
+                key,
+                params=self._params,
+                transition_matrix=self._transition_matrix,
+                extras=self._cache_extras(),
+            )
+
 
 @d.dedent
 class Constant(Kernel):
@@ -1202,6 +1341,10 @@ class SimpleNaryExpression(NaryKernelExpression):
     def __init__(self, kexprs: List[KernelExpression], op_name: str, fn: Callable):
         super().__init__(kexprs, op_name=op_name)
         self._fn = fn
+        # products of transition matrices and the union sparsity pattern of the summands,
+        # keyed by the fingerprints of their inputs
+        self._memo = {}
+        self._pattern = None
 
     def compute_transition_matrix(self, *args, **kwargs) -> "SimpleNaryExpression":
         """Compute and combine the transition matrices."""
@@ -1211,19 +1354,36 @@ class SimpleNaryExpression(NaryKernelExpression):
         elif isinstance(self, KernelAdaptiveAdd):
             self._maybe_recalculate_constants(ConstantMatrix)
 
-        for kexpr in self:
-            if kexpr._transition_matrix is None:
-                if isinstance(kexpr, Kernel):
-                    raise RuntimeError(
-                        f"Kernel `{kexpr}` is uninitialized. "
-                        f"Compute its transition matrix first as `.compute_transition_matrix()`."
-                    )
-                kexpr.compute_transition_matrix()
-            elif isinstance(kexpr, Kernel):
-                logg.debug(_LOG_USING_CACHE)
-
-        self.transition_matrix = csr_matrix(
-            self._fn([kexpr.transition_matrix for kexpr in self])
+        terms = [_get_term(kexpr) for kexpr in self]
+        if isinstance(self, KernelMul):
+            terms = [
+                (np.prod([w for w, _ in terms]), [m for _, ms in terms for m in ms])
+            ]
+
+        memo, new_memo, values = getattr(self, "_memo", {}), {}, []
+        for weight, mats in terms:
+            key = tuple(_fingerprint(m) for m in mats)
+            if len(mats) > 1:
+                new_memo[key] = memo[key] if key in memo else _product(mats)
+                mats = [new_memo[key]]
+            values.append((key, weight, mats[0] if len(mats) else None))
+        self._memo = new_memo
+
+        if any(m is None for _, _, m in values):
+            tmat = self._fn([w if m is None else w * m for _, w, m in values])
+        elif any(isinstance(m, LinearOperator) for _, _, m in values):
+            tmat = _weighted_sum([m for _, _, m in values], [w for _, w, _ in values])
+        else:
+            mats = [m if isspmatrix_csr(m) else csr_matrix(m) for _, _, m in values]
+            key = tuple(k for k, _, _ in values)
+            pattern = getattr(self, "_pattern", None)
+            if pattern is None or pattern[0] != key:
+                self._pattern = pattern = (key, _union_pattern(mats))
+            tmat = _fused_weighted_sum(
+                mats, [w for _, w, _ in values], pattern=pattern[1]
+            )
+        self.transition_matrix = (
+            tmat if isinstance(tmat, LinearOperator) else csr_matrix(tmat)
         )
 
         # only the top level expression and kernels will have condition number computed
@@ -1232,6 +1392,12 @@ class SimpleNaryExpression(NaryKernelExpression):
 
         return self
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # memoized values are cheap to recompute and can be large
+        return {
+            k: v for k, v in self.__dict__.items() if k not in ("_memo", "_pattern")
+        }
+
     @d.dedent
     def copy(self) -> "SimpleNaryExpression":
         """%(copy)s"""  # noqa: D400, D401
@@ -1380,5 +1546,88 @@ def _is_bin_mult(
     return None
 
 
+def _check_graph(
+    key: str, fn: Callable[[spmatrix], bool], conn: Union[np.ndarray, spmatrix]
+) -> bool:
+    """
+    Check a property of a graph, reusing the previously computed result.
+
+    Parameters
+    ----------
+    key
+        Fingerprint of ``conn``.
+    fn
+        Function which checks the property.
+    conn
+        The graph.
+
+    Returns
+    -------
+    The value of ``fn(conn)``.
+    """
+    checks = _graph_checks.setdefault(key, {})
+    _graph_checks.move_to_end(key)
+    while len(_graph_checks) > _graph_checks_maxsize:
+        _graph_checks.popitem(last=False)
+
+    if fn.__name__ not in checks:
+        checks[fn.__name__] = fn(conn)
+    else:
+        logg.debug("Using cached result")
+
+    return checks[fn.__name__]
+
+
+def _get_term(
+    k: KernelExpression,
+) -> Tuple[float, List[Union[np.ndarray, spmatrix]]]:
+    """
+    Get the weight and the transition matrices of a factor in a kernel expression.
+
+    Multiplications which don't need to be normalized are not materialized, their transition matrix
+    is only computed when accessed.
+
+    Parameters
+    ----------
+    k
+        Kernel expression.
+
+    Returns
+    -------
+    float, list
+        The weight and the transition matrices whose product, scaled by the weight, is the value of ``k``.
+
+    Raises
+    ------
+    RuntimeError
+        If a kernel's transition matrix has not been computed.
+    """
+    if isinstance(k, Constant):
+        return k.transition_matrix, []
+    if isinstance(k, ConstantMatrix):
+        return k._value, [k._mat_scaler]
+    if isinstance(k, KernelMul) and not k._normalize:
+        weight, mats = 1.0, []
+        for kexpr in k:
+            w, ms = _get_term(kexpr)
+            weight *= w
+            mats.extend(ms)
+        # the transition matrix is only materialized when accessed
+        k._transition_matrix, k._term = None, (weight, mats)
+        return weight, mats
+
+    if k._transition_matrix is None:
+        if isinstance(k, Kernel):
+            raise RuntimeError(
+                f"Kernel `{k}` is uninitialized. "
+                f"Compute its transition matrix first as `.compute_transition_matrix()`."
+            )
+        k.compute_transition_matrix()
+    elif isinstance(k, Kernel):
+        logg.debug(_LOG_USING_CACHE)
+
+    return 1.0, [k.transition_matrix]
+
+
 def _is_adaptive_type(k: KernelExpression) -> bool:
     return isinstance(k, Kernel) and not isinstance(k, (Constant, ConstantMatrix))
@@ -0,0 +1,106 @@
+from typing import Any, Dict, Optional
+
+import os
+import pickle
+from pathlib import Path
+
+from cellrank import logging as logg
+
+_CACHE_SUBDIR = "cellrank_kernels"
+_EXT = ".pickle"
+
+
+def _get_cachedir() -> Optional[Path]:
+    """Return the directory of the persistent cache or `None`, if it's disabled."""
+    from cellrank import settings
+
+    if not settings.kernel_cache:
+        return None
+
+    return Path(settings.cachedir) / _CACHE_SUBDIR
+
+
+def _cache_load(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Load an entry from the persistent cache.
+
+    Parameters
+    ----------
+    key
+        Key of the entry, see :func:`cellrank.tl.kernels._utils._fingerprint`.
+
+    Returns
+    -------
+    The cached values or `None`, if caching is disabled or the entry does not exist.
+    """
+    cachedir = _get_cachedir()
+    if cachedir is None:
+        return None
+
+    fname = cachedir / f"{key}{_EXT}"
+    try:
+        with open(fname, "rb") as fin:
+            res = pickle.load(fin)
+        # mark as recently used
+        os.utime(fname)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError) as e:
+        logg.debug(f"Unable to load cache entry `{fname}`. Reason: `{e}`")
+        return None
+
+    return res
+
+
+def _cache_save(key: str, **kwargs: Any) -> None:
+    """
+    Save an entry to the persistent cache and evict the least recently used entries.
+
+    Parameters
+    ----------
+    key
+        Key of the entry, see :func:`cellrank.tl.kernels._utils._fingerprint`.
+    kwargs
+        Values to save.
+
+    Returns
+    -------
+    Nothing, just writes the entry, if caching is enabled.
+    """
+    from cellrank import settings
+
+    cachedir = _get_cachedir()
+    if cachedir is None:
+        return
+
+    cachedir.mkdir(parents=True, exist_ok=True)
+    fname = cachedir / f"{key}{_EXT}"
+    tmp = cachedir / f"{key}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fout:
+        pickle.dump(kwargs, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    # atomic, in case multiple processes share the cache
+    os.replace(tmp, fname)
+    logg.debug(f"Saving transition matrix to `{fname}`")
+
+    _evict(cachedir, max_size=settings.kernel_cache_max_size)
+
+
+def _evict(cachedir: Path, max_size: int) -> None:
+    """Remove the least recently used entries until the cache is at most ``max_size`` bytes large."""
+    files = []
+    for fname in cachedir.glob(f"*{_EXT}"):
+        try:
+            stat = fname.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, fname))
+
+    total = 0
+    for _, size, fname in sorted(files, key=lambda f: f[0], reverse=True):
+        total += size
+        if total > max_size:
+            logg.debug(f"Evicting `{fname}` from cache")
+            try:
+                fname.unlink()
+            except FileNotFoundError:
+                pass
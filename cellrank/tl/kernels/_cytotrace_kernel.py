@@ -1,4 +1,4 @@
-from typing import Any
+from typing import Any, Tuple, Union
 from typing_extensions import Literal
 
 from enum import auto
@@ -8,12 +8,11 @@ from cellrank import logging as logg
 from cellrank._key import Key
 from cellrank.tl._enum import ModeEnum
 from cellrank.ul._docs import d, inject_docs
-from cellrank.tl._utils import _correlation_test_helper
 from cellrank.tl.kernels._pseudotime_kernel import PseudotimeKernel
 
 import numpy as np
 from scipy.stats import gmean, hmean
-from scipy.sparse import issparse
+from scipy.sparse import issparse, spmatrix, csc_matrix, csr_matrix
 
 
 class CytoTRACEAggregation(ModeEnum):  # noqa: D101
@@ -47,8 +46,6 @@ class CytoTRACEKernel(PseudotimeKernel):
     %(cond_num)s
     check_connectivity
         Check whether the underlying KNN graph is connected.
-    top_n
-        Number of genes used to compute the CytoTRACE score    
     kwargs
         Keyword arguments for :class:`cellrank.tl.kernels.PseudotimeKernel`.
 
@@ -91,9 +88,10 @@ class CytoTRACEKernel(PseudotimeKernel):
             "mean", "median", "hmean", "gmean"
         ] = CytoTRACEAggregation.MEAN,
         use_raw: bool = False,
+        top_n: int = 200,
+        chunk_size: int = 4096,
         compute_cond_num: bool = False,
         check_connectivity: bool = False,
-        top_n: int = 200,
         **kwargs: Any,
     ):
         super().__init__(
@@ -105,6 +103,8 @@ class CytoTRACEKernel(PseudotimeKernel):
             layer=layer,
             aggregation=aggregation,
             use_raw=use_raw,
+            top_n=top_n,
+            chunk_size=chunk_size,
             **kwargs,
         )
         self._time_key = Key.cytotrace("pseudotime")  # quirk or PT kernel
@@ -117,9 +117,17 @@ class CytoTRACEKernel(PseudotimeKernel):
             "mean", "median", "hmean", "gmean"
         ] = CytoTRACEAggregation.MEAN,
         use_raw: bool = True,
+        top_n: int = 200,
+        chunk_size: int = 4096,
         **kwargs: Any,
     ) -> None:
-        self.compute_cytotrace(layer=layer, aggregation=aggregation, use_raw=use_raw)
+        self.compute_cytotrace(
+            layer=layer,
+            aggregation=aggregation,
+            use_raw=use_raw,
+            top_n=top_n,
+            chunk_size=chunk_size,
+        )
 
         super()._read_from_adata(time_key=time_key, **kwargs)
 
@@ -132,6 +140,8 @@ class CytoTRACEKernel(PseudotimeKernel):
             "mean", "median", "hmean", "gmean"
         ] = CytoTRACEAggregation.MEAN,
         use_raw: bool = False,
+        top_n: int = 200,
+        chunk_size: int = 4096,
     ) -> None:
         """
         Re-implementation of the CytoTRACE algorithm :cite:`gulati:20` to estimate cellular plasticity.
@@ -157,6 +167,11 @@ class CytoTRACEKernel(PseudotimeKernel):
         use_raw
             Whether to use the :attr:`anndata.AnnData.raw` to compute the number of genes expressed per cell
             (#genes/cell) and the correlation of gene expression across cells with #genes/cell.
+        top_n
+            Number of the top-correlating genes used to compute the CytoTRACE score.
+        chunk_size
+            Number of cells processed at once. The expression matrices are never densified as a whole, only the
+            chunks, which also allows :attr:`anndata.AnnData.X` to be backed.
 
         Returns
         -------
@@ -203,44 +218,36 @@ class CytoTRACEKernel(PseudotimeKernel):
             msg += ". Consider using more than `10000` genes"
         start = logg.info(msg)
 
-        # compute number of expressed genes per cell
+        # compute number of expressed genes per cell and correlate all genes with it
         logg.debug(
-            f"Computing number of genes expressed per cell with `use_raw={use_raw}`"
+            f"Computing number of genes expressed per cell with `use_raw={use_raw}` and correlating all genes with it"
+        )
+        num_exp_genes, gene_corr = _gene_correlation(
+            adata_mraw.X, chunk_size=chunk_size
         )
-        num_exp_genes = np.array((adata_mraw.X > 0).sum(axis=1)).reshape(-1)
         self.adata.obs[Key.cytotrace("num_exp_genes")] = num_exp_genes
-
-        # fmt: off
-        # compute correlation with all genes
-        logg.debug("Correlating all genes with number of genes expressed per cell")
-        gene_corr, _, _, _ = _correlation_test_helper(adata_mraw.X.T, num_exp_genes[:, None])
+        self.adata.var[Key.cytotrace("gene_corr")] = gene_corr
 
         # annotate the top top_n genes in terms of correlation
-        logg.debug(f"Finding the top {top_n} most correlated genes")
-        self.adata.var[Key.cytotrace("gene_corr")] = gene_corr
-        top_N = self.adata.var.sort_values(by=Key.cytotrace("gene_corr"), ascending=False).index[:top_n]
-        self.adata.var[Key.cytotrace("correlates")] = False
-        self.adata.var.loc[top_N, Key.cytotrace("correlates")] = True
-
-        # compute mean/median over top top_n genes, aggregate over genes and shift to [0, 1] range
-        logg.debug(f"Aggregating imputed gene expression using aggregation `{aggregation}` in layer `{layer}`")
-        corr_mask = self.adata.var[Key.cytotrace("correlates")]
-        imputed_exp = self.adata[:, corr_mask].X if layer == "X" else self.adata[:, corr_mask].layers[layer]
-        if issparse(imputed_exp):
-            imputed_exp = imputed_exp.A
-
-        # aggregate across the top top_n genes
-        if aggregation == CytoTRACEAggregation.MEAN:
-            cytotrace_score = np.mean(imputed_exp, axis=1)
-        elif aggregation == CytoTRACEAggregation.MEDIAN:
-            cytotrace_score = np.median(imputed_exp, axis=1)
-        elif aggregation == CytoTRACEAggregation.GMEAN:
-            cytotrace_score = gmean(imputed_exp, axis=1)
-        elif aggregation == CytoTRACEAggregation.HMEAN:
-            cytotrace_score = hmean(imputed_exp, axis=1)
-        else:
-            raise NotImplementedError(f"Aggregation method `{aggregation}` is not yet implemented.")
-        # fmt: on
+        logg.debug(f"Finding the top `{top_n}` most correlated genes")
+        # `NaN` correlations (constant genes) are selected last
+        top_ixs = np.argsort(-np.nan_to_num(gene_corr, nan=-np.inf), kind="stable")[
+            :top_n
+        ]
+        corr_mask = np.zeros(self.adata.n_vars, dtype=bool)
+        corr_mask[top_ixs] = True
+        self.adata.var[Key.cytotrace("correlates")] = corr_mask
+
+        # aggregate over the top top_n genes and shift to [0, 1] range
+        logg.debug(
+            f"Aggregating imputed gene expression using aggregation `{aggregation}` in layer `{layer}`"
+        )
+        cytotrace_score = _aggregate(
+            self.adata.X if layer == "X" else self.adata.layers[layer],
+            np.where(corr_mask)[0],
+            aggregation=aggregation,
+            chunk_size=chunk_size,
+        )
 
         # scale to 0-1 range
         cytotrace_score -= np.min(cytotrace_score)
@@ -265,3 +272,110 @@ class CytoTRACEKernel(PseudotimeKernel):
             f"    Finish",
             time=start,
         )
+
+
+def _chunks(n_obs: int, chunk_size: int):
+    for start in range(0, n_obs, chunk_size):
+        yield start, min(start + chunk_size, n_obs)
+
+
+def _gene_correlation(
+    X: Union[np.ndarray, spmatrix], chunk_size: int = 4096
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the expressed genes per cell and correlate each gene with it.
+
+    Parameters
+    ----------
+    X
+        Expression matrix of shape `(n_cells, n_genes)`, possibly backed.
+    chunk_size
+        Number of cells processed at once.
+
+    Returns
+    -------
+    The number of expressed genes per cell and the Pearson correlation of each gene with it.
+    """
+    n_obs, n_vars = X.shape
+    num_exp_genes = np.empty(n_obs, dtype=np.int64)
+    # sufficient statistics of the genes, the number of expressed genes and their products
+    sx, sxx, sxy = np.zeros(n_vars), np.zeros(n_vars), np.zeros(n_vars)
+
+    for start, end in _chunks(n_obs, chunk_size):
+        chunk = X[start:end]
+        if issparse(chunk):
+            chunk = csr_matrix(chunk, dtype=np.float64)
+            expressed = np.concatenate([[0], np.cumsum(chunk.data > 0)])
+            y = expressed[chunk.indptr[1:]] - expressed[chunk.indptr[:-1]]
+            sx += np.asarray(chunk.sum(axis=0)).ravel()
+            sxx += np.asarray(chunk.power(2).sum(axis=0)).ravel()
+            sxy += chunk.T @ y
+        else:
+            chunk = np.asarray(chunk, dtype=np.float64)
+            y = np.sum(chunk > 0, axis=1)
+            sx += chunk.sum(axis=0)
+            sxx += np.einsum("ij,ij->j", chunk, chunk)
+            sxy += chunk.T @ y
+        num_exp_genes[start:end] = y
+
+    y = num_exp_genes.astype(np.float64)
+    sy, syy = y.sum(), y @ y
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = (n_obs * sxy - sx * sy) / np.sqrt(
+            (n_obs * sxx - sx ** 2) * (n_obs * syy - sy ** 2)
+        )
+
+    return num_exp_genes, np.clip(corr, -1.0, 1.0)
+
+
+def _aggregate(
+    X: Union[np.ndarray, spmatrix],
+    ixs: np.ndarray,
+    aggregation: CytoTRACEAggregation,
+    chunk_size: int = 4096,
+) -> np.ndarray:
+    """
+    Aggregate the expression of selected genes in each cell.
+
+    Parameters
+    ----------
+    X
+        Expression matrix of shape `(n_cells, n_genes)`, possibly backed.
+    ixs
+        Indices of the genes to aggregate.
+    aggregation
+        How to aggregate the expression.
+    chunk_size
+        Number of cells processed at once.
+
+    Returns
+    -------
+    The aggregated expression of shape `(n_cells,)`.
+    """
+    if aggregation == CytoTRACEAggregation.MEAN:
+        fn = np.mean
+    elif aggregation == CytoTRACEAggregation.MEDIAN:
+        fn = np.median
+    elif aggregation == CytoTRACEAggregation.GMEAN:
+        fn = gmean
+    elif aggregation == CytoTRACEAggregation.HMEAN:
+        fn = hmean
+    else:
+        raise NotImplementedError(
+            f"Aggregation method `{aggregation}` is not yet implemented."
+        )
+
+    res = np.empty(X.shape[0], dtype=np.float64)
+    for start, end in _chunks(X.shape[0], chunk_size):
+        chunk = X[start:end]
+        if issparse(chunk):
+            chunk = csc_matrix(chunk)[:, ixs]
+            if aggregation == CytoTRACEAggregation.MEAN:
+                res[start:end] = np.asarray(chunk.mean(axis=1)).ravel()
+                continue
+            chunk = chunk.toarray()
+        else:
+            chunk = np.asarray(chunk)[:, ixs]
+        res[start:end] = fn(chunk, axis=1)
+
+    return res
@@ -1,5 +1,5 @@
 """Experimental time kernel module."""
-from typing import Any, Dict, Tuple, Mapping, Optional
+from typing import Any, Dict, List, Tuple, Mapping, Optional, Sequence
 
 from abc import ABC
 from copy import copy
@@ -10,12 +10,13 @@ from cellrank.tl._enum import ModeEnum
 from cellrank.ul._docs import d
 from cellrank.tl._utils import _normalize
 from cellrank.tl.kernels import Kernel
-from cellrank.tl.kernels._utils import _ensure_numeric_ordered
+from cellrank.tl.kernels._utils import _sparsify_rows, _ensure_numeric_ordered
 from cellrank.tl.kernels._base_kernel import AnnData
 
 import numpy as np
 import pandas as pd
-from scipy.sparse import bmat, spdiags
+from scipy.sparse import eye as speye
+from scipy.sparse import csr_matrix
 
 from matplotlib.colors import Normalize, to_hex
 from matplotlib.pyplot import get_cmap
@@ -141,7 +142,36 @@ class TransportMapKernel(ExperimentalTimeKernel, ABC):
         last_time_point: LastTimePoint = LastTimePoint.DIAGONAL,
         conn_kwargs: Mapping[str, Any] = MappingProxyType({}),
         normalize: bool = True,
+        top_k: Optional[int] = None,
+        mass: Optional[float] = None,
+        implicit_uniform: bool = False,
     ) -> AnnData:
+        """
+        Stitch the transport maps into one transition matrix.
+
+        Parameters
+        ----------
+        tmaps
+            Transport maps for consecutive time pairs.
+        last_time_point
+            How to define transitions within the last time point.
+        conn_kwargs
+            Keyword arguments for :func:`scanpy.pp.neighbors`, when using ``last_time_point = 'connectivities'``.
+        normalize
+            Whether to row-normalize the transport maps.
+        top_k
+            Number of the largest values to keep in each row of the transport maps.
+        mass
+            Fraction of each row's mass to keep in the transport maps.
+        implicit_uniform
+            Whether to leave the rows of the last time point empty when using ``last_time_point = 'uniform'``,
+            so that the uniform transitions can be represented as a low-rank term.
+
+        Returns
+        -------
+        The transition matrix in :attr:`anndata.AnnData.X`, ordered as :attr:`adata`, and the transport maps'
+        :attr:`anndata.AnnData.obs`.
+        """
         from cellrank.tl.kernels import ConnectivityKernel
 
         conn_kwargs = dict(conn_kwargs)
@@ -149,27 +179,28 @@ class TransportMapKernel(ExperimentalTimeKernel, ABC):
         _ = conn_kwargs.pop("key_added", None)
         density_normalize = conn_kwargs.pop("density_normalize", True)
 
-        blocks = [[None] * (len(tmaps) + 1) for _ in range(len(tmaps) + 1)]
-        nrows, ncols = 0, 0
-        obs_names, obs = [], []
-
-        for i, tmap in enumerate(tmaps.values()):
-            blocks[i][i + 1] = _normalize(tmap.X) if normalize else tmap.X
-            nrows += tmap.n_obs
-            ncols += tmap.n_vars
-            obs_names.extend(tmap.obs_names)
+        # `None` marks the implicit uniform block
+        blocks: List[Tuple[pd.Index, pd.Index, Optional[csr_matrix]]] = []
+        obs = []
+        for tmap in tmaps.values():
+            X = _normalize(tmap.X) if normalize else tmap.X
+            if top_k is not None or mass is not None:
+                X = _sparsify_rows(X, top_k=top_k, mass=mass)
+                if normalize:
+                    X = _normalize(X)
+            blocks.append((tmap.obs_names, tmap.var_names, csr_matrix(X)))
             obs.append(tmap.obs)
-        obs_names.extend(tmap.var_names)
 
-        n = self.adata.n_obs - nrows
+        last_names = tmap.var_names
+        n = len(last_names)
         if last_time_point == LastTimePoint.DIAGONAL:
-            blocks[-1][-1] = spdiags([1] * n, 0, n, n)
+            block = speye(n, format="csr")
         elif last_time_point == LastTimePoint.UNIFORM:
-            blocks[-1][-1] = np.ones((n, n)) / float(n)
+            block = csr_matrix((n, n)) if implicit_uniform else None
         elif last_time_point == LastTimePoint.CONNECTIVITIES:
-            adata_subset = self.adata[tmap.var_names].copy()
+            adata_subset = self.adata[last_names].copy()
             sc.pp.neighbors(adata_subset, **conn_kwargs)
-            blocks[-1][-1] = (
+            block = csr_matrix(
                 ConnectivityKernel(adata_subset)
                 .compute_transition_matrix(density_normalize)
                 .transition_matrix
@@ -178,27 +209,82 @@ class TransportMapKernel(ExperimentalTimeKernel, ABC):
             raise NotImplementedError(
                 f"Last time point mode `{last_time_point}` is not yet implemented."
             )
-
-        # prevent the last block from disappearing
-        n = blocks[0][1].shape[0]
-        blocks[0][0] = spdiags([], 0, n, n)
-
-        tmp = AnnData(bmat(blocks, format="csr"))
-        tmp.obs_names = obs_names
-        tmp.var_names = obs_names
-        tmp = tmp[self.adata.obs_names, :][:, self.adata.obs_names]
-
-        tmp.obs = pd.merge(
-            tmp.obs,
-            pd.concat(obs),
-            left_index=True,
-            right_index=True,
-            how="left",
+        blocks.append((last_names, last_names, block))
+
+        obs_names = self.adata.obs_names
+        tmat = _stitch_blocks(
+            [
+                (obs_names.get_indexer(rows), obs_names.get_indexer(cols), block)
+                for rows, cols, block in blocks
+            ],
+            n_obs=self.adata.n_obs,
         )
 
-        return tmp
+        return AnnData(
+            tmat,
+            obs=pd.concat(obs).reindex(obs_names),
+            var=pd.DataFrame(index=obs_names),
+            dtype=tmat.dtype,
+        )
 
     @property
     def transport_maps(self) -> Optional[Dict[Tuple[float, float], AnnData]]:
         """Transport maps for consecutive time pairs."""
         return self._tmaps
+
+
+def _stitch_blocks(
+    blocks: Sequence[Tuple[np.ndarray, np.ndarray, Optional[csr_matrix]]],
+    n_obs: int,
+) -> csr_matrix:
+    """
+    Assemble blocks into one CSR matrix, directly in the target order.
+
+    Parameters
+    ----------
+    blocks
+        Row positions, column positions and the block. Each row position must be present in exactly one block.
+        `None` denotes a uniform block, which is written without being materialized.
+    n_obs
+        Number of rows and columns of the final matrix.
+
+    Returns
+    -------
+    The stitched matrix.
+    """
+    row_nnz = np.full(n_obs, -1, dtype=np.int64)
+    for rixs, cixs, block in blocks:
+        if np.any(rixs < 0) or np.any(cixs < 0):
+            raise ValueError(
+                "Unable to find all cells of the transport maps in `adata.obs_names`."
+            )
+        row_nnz[rixs] = len(cixs) if block is None else np.diff(block.indptr)
+    if np.any(row_nnz < 0):
+        raise ValueError(
+            f"Expected transport maps to cover all cells, `{np.sum(row_nnz < 0)}` are missing."
+        )
+
+    indptr = np.zeros(n_obs + 1, dtype=np.int64)
+    np.cumsum(row_nnz, out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int64)
+    data = np.empty(indptr[-1], dtype=np.float64)
+
+    for rixs, cixs, block in blocks:
+        if block is None:
+            cixs = np.sort(cixs)
+            for start in indptr[rixs]:
+                indices[start : start + len(cixs)] = cixs
+                data[start : start + len(cixs)] = 1.0 / len(cixs)
+            continue
+
+        local_rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        dest = (
+            indptr[rixs][local_rows] + np.arange(block.nnz) - block.indptr[local_rows]
+        )
+        indices[dest] = cixs[block.indices]
+        data[dest] = block.data
+
+    tmat = csr_matrix((data, indices, indptr), shape=(n_obs, n_obs))
+    tmat.sort_indices()
+
+    return tmat
@@ -7,10 +7,12 @@ from cellrank import logging as logg
 from cellrank._key import Key
 from cellrank.ul._docs import d
 from cellrank.ul._utils import _read_graph_data
+from cellrank.tl._linear_operator import _row_sums
 from cellrank.tl.kernels._base_kernel import _RTOL, Kernel, KernelExpression
 
 import numpy as np
 from scipy.sparse import spmatrix, csr_matrix
+from scipy.sparse.linalg import LinearOperator
 
 
 @d.dedent
@@ -23,6 +25,7 @@ class PrecomputedKernel(Kernel):
     transition_matrix
         Row-normalized transition matrix or a key in :attr:`anndata.AnnData.obsp`.
         or a :class:`cellrank.tl.kernels.KernelExpression` with a precomputed transition matrix.
+        Can also be a :class:`scipy.sparse.linalg.LinearOperator`, such as :class:`cellrank.tl.SparsePlusLowRank`.
         If `None`, try to determine the key based on ``backward``.
     %(adata)s
         If `None`, a temporary placeholder object is created.
@@ -35,7 +38,7 @@ class PrecomputedKernel(Kernel):
     def __init__(
         self,
         transition_matrix: Optional[
-            Union[np.ndarray, spmatrix, KernelExpression, str]
+            Union[np.ndarray, spmatrix, LinearOperator, KernelExpression, str]
         ] = None,
         adata: Optional[AnnData] = None,
         backward: bool = False,
@@ -74,10 +77,10 @@ class PrecomputedKernel(Kernel):
             adata = transition_matrix.adata
             transition_matrix = transition_matrix.transition_matrix
 
-        if not isinstance(transition_matrix, (np.ndarray, spmatrix)):
+        if not isinstance(transition_matrix, (np.ndarray, spmatrix, LinearOperator)):
             raise TypeError(
-                f"Expected transition matrix to be of type `numpy.ndarray` or `scipy.sparse.spmatrix`, "
-                f"found `{type(transition_matrix).__name__}`."
+                f"Expected transition matrix to be of type `numpy.ndarray`, `scipy.sparse.spmatrix` "
+                f"or `scipy.sparse.linalg.LinearOperator`, found `{type(transition_matrix).__name__}`."
             )
 
         if transition_matrix.shape[0] != transition_matrix.shape[1]:
@@ -85,7 +88,7 @@ class PrecomputedKernel(Kernel):
                 f"Expected transition matrix to be square, found `{transition_matrix.shape}`."
             )
 
-        if not np.allclose(np.sum(transition_matrix, axis=1), 1.0, rtol=_RTOL):
+        if not np.allclose(_row_sums(transition_matrix), 1.0, rtol=_RTOL):
             raise ValueError("Not a valid transition matrix, not all rows sum to 1.")
 
         if adata is None:
@@ -98,7 +101,11 @@ class PrecomputedKernel(Kernel):
             adata, backward=backward, compute_cond_num=compute_cond_num, **kwargs
         )
 
-        self._transition_matrix = csr_matrix(transition_matrix)
+        self._transition_matrix = (
+            transition_matrix
+            if isinstance(transition_matrix, LinearOperator)
+            else csr_matrix(transition_matrix)
+        )
         self._maybe_compute_cond_num()
         self._params = params
         self._origin = origin
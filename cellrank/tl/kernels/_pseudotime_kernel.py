@@ -1,4 +1,4 @@
-from typing import Any, Union, Callable, Optional
+from typing import Any, Tuple, Union, Callable, Optional
 from typing_extensions import Literal
 
 from copy import copy
@@ -176,6 +176,9 @@ class PseudotimeKernel(Kernel):
 
         return self
 
+    def _cache_inputs(self) -> Tuple[Any, ...]:
+        return self._conn, self._pseudotime
+
     @property
     def pseudotime(self) -> np.array:
         """Pseudotemporal ordering of cells."""
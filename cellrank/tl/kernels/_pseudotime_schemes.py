@@ -6,7 +6,9 @@ from cellrank.ul._docs import d
 from cellrank.ul._parallelize import parallelize
 
 import numpy as np
+from numba import njit
 from scipy.sparse import csr_matrix
+from numba.extending import is_jitted
 
 
 class ThresholdSchemeABC(ABC):
@@ -39,6 +41,27 @@ class ThresholdSchemeABC(ABC):
         Array of shape ``(n_neighbors,)`` containing the biased connectivities.
         """
 
+    def _bias_knn_vectorized(
+        self, conn: csr_matrix, pseudotime: np.ndarray, **kwargs: Any
+    ) -> Optional[np.ndarray]:
+        """
+        Bias all connectivities at once, operating directly on the CSR structure.
+
+        Parameters
+        ----------
+        conn
+            Connectivities in CSR format.
+        pseudotime
+            Pseudotemporal ordering of cells.
+        kwargs
+            Keyword arguments for :meth:`__call__`.
+
+        Returns
+        -------
+        The biased :attr:`scipy.sparse.csr_matrix.data` or `None`, if the scheme is not vectorized.
+        """
+        return None
+
     def _bias_knn_helper(
         self,
         ixs: np.ndarray,
@@ -46,33 +69,32 @@ class ThresholdSchemeABC(ABC):
         pseudotime: np.ndarray,
         queue=None,
         **kwargs: Any,
-    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-
-        indices, indptr, data = [], [], []
+    ) -> np.ndarray:
+        indptr, indices = conn.indptr, conn.indices
+        data = np.empty(indptr[ixs[-1] + 1] - indptr[ixs[0]], dtype=np.float64)
+        offset = indptr[ixs[0]]
 
         for i in ixs:
-            row = conn[i]
+            start, end = indptr[i], indptr[i + 1]
             biased_row = self(
-                pseudotime[i], pseudotime[row.indices], row.data, **kwargs
+                pseudotime[i],
+                pseudotime[indices[start:end]],
+                conn.data[start:end],
+                **kwargs,
             )
-            if np.shape(biased_row) != row.data.shape:
+            if np.shape(biased_row) != (end - start,):
                 raise ValueError(
-                    f"Expected row of shape `{row.data.shape}`, found `{np.shape(biased_row)}`."
+                    f"Expected row of shape `{(end - start,)}`, found `{np.shape(biased_row)}`."
                 )
-
-            data.extend(biased_row)
-            indices.extend(row.indices)
-            indptr.append(conn.indptr[i])
+            data[start - offset : end - offset] = biased_row
 
             if queue is not None:
                 queue.put(1)
 
-        if i == conn.shape[0] - 1:
-            indptr.append(conn.indptr[-1])
         if queue is not None:
             queue.put(None)
 
-        return np.array(data), np.array(indices), np.array(indptr)
+        return data
 
     @d.dedent
     def bias_knn(
@@ -99,19 +121,24 @@ class ThresholdSchemeABC(ABC):
         -------
         The biased connectivities.
         """
-        res = parallelize(
-            self._bias_knn_helper,
-            np.arange(conn.shape[0]),
-            as_array=False,
-            unit="cell",
-            n_jobs=n_jobs,
-            backend=backend,
-            show_progress_bar=show_progress_bar,
-        )(conn, pseudotime, **kwargs)
-        data, indices, indptr = zip(*res)
+        conn = csr_matrix(conn)
+        pseudotime = np.asarray(pseudotime, dtype=np.float64)
+
+        data = self._bias_knn_vectorized(conn, pseudotime, **kwargs)
+        if data is None:
+            data = parallelize(
+                self._bias_knn_helper,
+                np.arange(conn.shape[0]),
+                as_array=False,
+                unit="cell",
+                n_jobs=n_jobs,
+                backend=backend,
+                show_progress_bar=show_progress_bar,
+            )(conn, pseudotime, **kwargs)
+            data = np.concatenate(data)
 
         conn = csr_matrix(
-            (np.concatenate(data), np.concatenate(indices), np.concatenate(indptr))
+            (data, conn.indices.copy(), conn.indptr.copy()), shape=conn.shape
         )
         conn.eliminate_zeros()
 
@@ -181,6 +208,46 @@ class HardThresholdScheme(ThresholdSchemeABC):
 
         return biased_conn
 
+    def _bias_knn_vectorized(
+        self, conn: csr_matrix, pseudotime: np.ndarray, frac_to_keep: float = 0.3
+    ) -> np.ndarray:
+        if not (0 <= frac_to_keep <= 1):
+            raise ValueError(
+                f"Expected `frac_to_keep` to be in `[0, 1]`, found `{frac_to_keep}`."
+            )
+
+        n_neighs = np.diff(conn.indptr)
+        rows = np.repeat(np.arange(conn.shape[0]), n_neighs)
+        k_thresh = np.clip(np.floor(n_neighs * frac_to_keep).astype(np.int64), 0, 30)
+
+        # segmented argsort, descending by connectivity (ties are broken by the position in the row)
+        positions = np.arange(conn.nnz)
+        order = np.lexsort((-positions, -conn.data, rows))
+        rank = np.empty_like(positions)
+        rank[order] = positions - conn.indptr[rows]
+
+        keep = (rank < k_thresh[rows]) | (pseudotime[rows] <= pseudotime[conn.indices])
+        data = np.where(keep, conn.data, 0.0).astype(conn.data.dtype, copy=False)
+
+        # ties at the cutoff are broken by `np.argsort` in `__call__`, recompute such rows to stay consistent
+        sorted_data = conn.data[order]
+        cut = conn.indptr[:-1] + k_thresh
+        (ties,) = np.nonzero(
+            (k_thresh > 0)
+            & (k_thresh < n_neighs)
+            & (sorted_data[cut - 1] == sorted_data[np.minimum(cut, conn.nnz - 1)])
+        )
+        for i in ties:
+            start, end = conn.indptr[i], conn.indptr[i + 1]
+            data[start:end] = self(
+                pseudotime[i],
+                pseudotime[conn.indices[start:end]],
+                conn.data[start:end],
+                frac_to_keep=frac_to_keep,
+            )
+
+        return data
+
 
 class SoftThresholdScheme(ThresholdSchemeABC):
     """
@@ -226,6 +293,22 @@ class SoftThresholdScheme(ThresholdSchemeABC):
 
         return neigh_conn * weights
 
+    def _bias_knn_vectorized(
+        self,
+        conn: csr_matrix,
+        pseudotime: np.ndarray,
+        b: float = 10.0,
+        nu: float = 0.5,
+    ) -> np.ndarray:
+        rows = np.repeat(np.arange(conn.shape[0]), np.diff(conn.indptr))
+        dt = pseudotime[rows] - pseudotime[conn.indices]
+
+        weights = np.ones_like(conn.data, dtype=np.float64)
+        past = dt > 0
+        weights[past] = 2.0 / ((1.0 + np.exp(b * dt[past])) ** (1.0 / nu))
+
+        return conn.data * weights.astype(conn.data.dtype, copy=False)
+
 
 class CustomThresholdScheme(ThresholdSchemeABC):
     """
@@ -268,3 +351,39 @@ class CustomThresholdScheme(ThresholdSchemeABC):
         %(pt_scheme.returns)s
         """  # noqa: D400
         return self._callback(cell_pseudotime, neigh_pseudotime, neigh_conn, **kwargs)
+
+    def _bias_knn_vectorized(
+        self, conn: csr_matrix, pseudotime: np.ndarray, **kwargs: Any
+    ) -> Optional[np.ndarray]:
+        # keyword arguments can't be passed to a jitted function from within `numba`
+        if kwargs or not is_jitted(self._callback):
+            return None
+
+        return _bias_knn_jitted(
+            self._callback,
+            conn.indptr,
+            conn.indices,
+            conn.data.astype(np.float64),
+            pseudotime,
+        )
+
+
+@njit(nogil=True)
+def _bias_knn_jitted(
+    callback: Callable[[float, np.ndarray, np.ndarray], np.ndarray],
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    data: np.ndarray,
+    pseudotime: np.ndarray,
+) -> np.ndarray:
+    res = np.empty_like(data)
+    for i in range(len(indptr) - 1):
+        start, end = indptr[i], indptr[i + 1]
+        biased_row = callback(
+            pseudotime[i], pseudotime[indices[start:end]], data[start:end]
+        )
+        if biased_row.shape != (end - start,):
+            raise ValueError("Expected row of shape `(n_neighbors,)`.")
+        res[start:end] = biased_row
+
+    return res
@@ -1,19 +1,73 @@
-from typing import Any, List, Union, Optional, Sequence
+from typing import Any, List, Tuple, Union, Iterator, Optional, Sequence
 
+from functools import reduce
 from itertools import chain
+from dataclasses import dataclass
 
 from cellrank import logging as logg
 from cellrank.ul._docs import d
 from cellrank.ul._parallelize import parallelize
+from cellrank.tl.kernels._utils import jit_kwargs
 
 import numpy as np
-from scipy.sparse import issparse, spmatrix
+from numba import njit
+from scipy.sparse import spmatrix, csr_matrix
+from scipy.sparse.linalg import LinearOperator
+
+# walkers with the same seed are simulated together, independently of how they're split among the jobs
+_BATCH_SIZE = 1024
+
+
+@dataclass
+class RandomWalkStats:
+    """
+    Statistics of random walks, aggregated without storing the visited states.
+
+    Attributes
+    ----------
+    n_sims
+        Number of simulated random walks.
+    visits
+        Array of shape ``(n_cells,)`` containing how many times each cell has been visited, including the starts.
+    edges
+        Matrix of shape ``(n_cells, n_cells)`` containing how many times each transition has been traversed.
+    hits
+        Array of shape ``(n_cells,)`` containing how many random walks have stopped in each cell.
+    hitting_times
+        Array of shape ``(max_iter + 1,)`` containing how many random walks have stopped after each number of steps.
+    """
+
+    n_sims: int
+    visits: np.ndarray
+    edges: csr_matrix
+    hits: np.ndarray
+    hitting_times: np.ndarray
+
+    @property
+    def hitting_probabilities(self) -> np.ndarray:
+        """Empirical probabilities of stopping in each cell."""
+        return self.hits / self.n_sims
+
+    def __add__(self, other: "RandomWalkStats") -> "RandomWalkStats":
+        if not isinstance(other, RandomWalkStats):
+            return NotImplemented
+        return RandomWalkStats(
+            n_sims=self.n_sims + other.n_sims,
+            visits=self.visits + other.visits,
+            edges=self.edges + other.edges,
+            hits=self.hits + other.hits,
+            hitting_times=self.hitting_times + other.hitting_times,
+        )
 
 
 class RandomWalk:
     """
     Class that simulates a random walk on a Markov chain.
 
+    All walkers are advanced at once and the next states are sampled directly from the rows of the transition
+    matrix in CSR format, i.e. each step of a walker takes :math:`O(\\log d)` time, where :math:`d` is the number
+    of non-zero transition probabilities of its current state.
+
     Parameters
     ----------
     transition_matrix
@@ -30,6 +84,11 @@ class RandomWalk:
         start_ixs: Optional[Sequence[int]] = None,
         stop_ixs: Optional[Sequence[int]] = None,
     ):
+        if isinstance(transition_matrix, LinearOperator):
+            raise TypeError(
+                "Simulating random walks requires an explicit transition matrix, "
+                "found a matrix-free transition matrix."
+            )
         if transition_matrix.ndim != 2 or (
             transition_matrix.shape[0] != transition_matrix.shape[1]
         ):
@@ -37,10 +96,16 @@ class RandomWalk:
         if not np.allclose(transition_matrix.sum(1), 1.0):
             raise ValueError("Transition matrix is not row-stochastic.")
 
-        self._tmat = transition_matrix
-        self._ixs = np.arange(self._tmat.shape[0])
-        self._is_sparse = issparse(self._tmat)
-        self._stop_ixs = set([] if stop_ixs is None or not len(stop_ixs) else stop_ixs)
+        tmat = csr_matrix(transition_matrix)
+        self._ixs = np.arange(tmat.shape[0])
+        self._indptr = tmat.indptr.astype(np.int64)
+        self._indices = tmat.indices.astype(np.int64)
+        self._cumsum = _row_cumsum(self._indptr, tmat.data.astype(np.float64))
+
+        self._stop_mask = np.zeros(len(self._ixs), dtype=bool)
+        if stop_ixs is not None and len(stop_ixs):
+            self._stop_mask[np.asarray(stop_ixs)] = True
+
         self._starting_dist = (
             np.ones_like(self._ixs)
             if start_ixs is None
@@ -52,15 +117,8 @@ class RandomWalk:
         self._starting_dist = self._starting_dist.astype(np.float64) / np.sum(
             self._starting_dist
         )
-
-    def _should_stop(self, ix: int) -> bool:
-        return ix in self._stop_ixs
-
-    def _sample(self, ix: int, *, rs: np.random.RandomState) -> int:
-        return rs.choice(
-            self._ixs,
-            p=self._tmat[ix].A.squeeze() if self._is_sparse else self._tmat[ix],
-        )
+        self._starting_cumsum = np.cumsum(self._starting_dist)
+        self._starting_cumsum[-1] = 1.0
 
     def _max_iter(self, max_iter: Union[int, float]) -> int:
         if isinstance(max_iter, float):
@@ -71,6 +129,99 @@ class RandomWalk:
             )
         return max_iter
 
+    def _walk(
+        self,
+        batch: int,
+        walkers: np.ndarray,
+        max_iter: int,
+        seed: Optional[int] = None,
+        successive_hits: int = 0,
+    ) -> Iterator[Tuple[int, np.ndarray, np.ndarray, Optional[np.ndarray], np.ndarray]]:
+        """
+        Advance walkers of one batch in lockstep.
+
+        Parameters
+        ----------
+        batch
+            Index of the batch, used for seeding.
+        walkers
+            Positions of the walkers within the batch.
+        max_iter
+            Maximum number of steps.
+        seed
+            Random seed.
+        successive_hits
+            Number of successive hits in the ``stop_ixs`` required to stop prematurely.
+
+        Yields
+        ------
+        The step, indices into ``walkers`` which are still active, their current states, positions of the traversed
+        edges in the CSR transition matrix and a mask whether they've stopped at this step. The 0th step contains
+        the starting states and no edges.
+        """
+        rng = np.random.default_rng(None if seed is None else [seed, batch])
+        u = rng.random(_BATCH_SIZE)[walkers]
+        active = np.arange(len(walkers))
+        states = np.searchsorted(self._starting_cumsum, u, side="right")
+        states = np.minimum(states, len(self._ixs) - 1)
+        cnt = np.full(len(walkers), -1, dtype=np.int64)
+
+        yield 0, active, states, None, np.zeros(len(walkers), dtype=bool)
+
+        for step in range(1, max_iter + 1):
+            # always draw for the whole batch, so that the walks don't depend on which walkers are simulated
+            u = rng.random(_BATCH_SIZE)[walkers[active]]
+            edges = _sample_next(self._indptr, self._cumsum, states, u)
+            states = self._indices[edges]
+            cnt = np.where(self._stop_mask[states], cnt + 1, -1)
+            stopped = cnt >= successive_hits
+
+            yield step, active, states, edges, stopped
+
+            if np.any(stopped):
+                active, states, cnt = (
+                    active[~stopped],
+                    states[~stopped],
+                    cnt[~stopped],
+                )
+                if not len(active):
+                    break
+
+    def _simulate(
+        self,
+        sims: np.ndarray,
+        max_iter: int,
+        seed: Optional[int] = None,
+        successive_hits: int = 0,
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Simulate walks ``sims``, batch by batch, yielding the simulation indices and their visited states."""
+        for batch, batch_sims in _batches(sims):
+            walkers = batch_sims % _BATCH_SIZE
+
+            paths = np.empty((max_iter + 1, len(walkers)), dtype=self._ixs.dtype)
+            lengths = np.full(len(walkers), max_iter + 1, dtype=np.int64)
+            for step, active, states, _, stopped in self._walk(
+                batch,
+                walkers,
+                max_iter=max_iter,
+                seed=seed,
+                successive_hits=successive_hits,
+            ):
+                paths[step, active] = states
+                lengths[active[stopped]] = step + 1
+
+            yield batch_sims, [paths[:n, i] for i, n in enumerate(lengths)]
+
+    def _validate(
+        self, max_iter: Union[int, float], successive_hits: int
+    ) -> Tuple[int, int]:
+        max_iter = self._max_iter(max_iter)
+        if successive_hits < 0:
+            raise ValueError(
+                f"Expected number of successive hits to be positive, found `{successive_hits}`."
+            )
+        return max_iter, successive_hits
+
     @d.get_sections(base="rw_sim", sections=["Parameters"])
     def simulate_one(
         self,
@@ -96,24 +247,15 @@ class RandomWalk:
         Array of shape ``(max_iter + 1,)`` of states that have been visited. If ``stop_ixs`` was specified, the array
         may have smaller shape.
         """
-        max_iter = self._max_iter(max_iter)
-        if successive_hits < 0:
-            raise ValueError(
-                f"Expected number of successive hits to be positive, found `{successive_hits}`."
-            )
-
-        rs = np.random.RandomState(seed)
-        ix = rs.choice(self._ixs, p=self._starting_dist)
-        sim, cnt = [ix], -1
-
-        for _ in range(max_iter):
-            ix = self._sample(ix, rs=rs)
-            sim.append(ix)
-            cnt = (cnt + 1) if self._should_stop(ix) else -1
-            if cnt >= successive_hits:
-                break
+        max_iter, successive_hits = self._validate(max_iter, successive_hits)
+        ((_, (sim,)),) = self._simulate(
+            np.array([0]),
+            max_iter=max_iter,
+            seed=seed,
+            successive_hits=successive_hits,
+        )
 
-        return np.array(sim)
+        return sim
 
     def _simulate_many(
         self,
@@ -124,15 +266,13 @@ class RandomWalk:
         queue: Optional[Any] = None,
     ) -> List[np.ndarray]:
         res = []
-        for s in sims:
-            sim = self.simulate_one(
-                max_iter=max_iter,
-                seed=None if seed is None else seed + s,
-                successive_hits=successive_hits,
-            )
-            res.append(sim)
+        for _, batch_res in self._simulate(
+            sims, max_iter=max_iter, seed=seed, successive_hits=successive_hits
+        ):
+            res.extend(batch_res)
             if queue is not None:
-                queue.put(1)
+                for _ in batch_res:
+                    queue.put(1)
 
         if queue is not None:
             queue.put(None)
@@ -153,6 +293,8 @@ class RandomWalk:
         """
         Simulate many random walks.
 
+        The walks are reproducible for a given ``seed``, regardless of ``n_jobs``.
+
         Parameters
         ----------
         n_sims
@@ -169,7 +311,7 @@ class RandomWalk:
             raise ValueError(
                 f"Expected number of simulations to be positive, found `{n_sims}`."
             )
-        max_iter = self._max_iter(max_iter)
+        max_iter, successive_hits = self._validate(max_iter, successive_hits)
         start = logg.info(
             f"Simulating `{n_sims}` random walks of maximum length `{max_iter}`"
         )
@@ -188,3 +330,151 @@ class RandomWalk:
         logg.info("    Finish", time=start)
 
         return simss
+
+    def _simulate_stats(
+        self,
+        sims: np.ndarray,
+        max_iter: int,
+        seed: Optional[int] = None,
+        successive_hits: int = 0,
+        queue: Optional[Any] = None,
+    ) -> RandomWalkStats:
+        n = len(self._ixs)
+        visits = np.zeros(n, dtype=np.int64)
+        edges = np.zeros(len(self._indices), dtype=np.int64)
+        hits = np.zeros(n, dtype=np.int64)
+        hitting_times = np.zeros(max_iter + 1, dtype=np.int64)
+
+        for batch, batch_sims in _batches(sims):
+            for step, _, states, traversed, stopped in self._walk(
+                batch,
+                batch_sims % _BATCH_SIZE,
+                max_iter=max_iter,
+                seed=seed,
+                successive_hits=successive_hits,
+            ):
+                _count(visits, states)
+                if traversed is not None:
+                    _count(edges, traversed)
+                if np.any(stopped):
+                    _count(hits, states[stopped])
+                    hitting_times[step] += np.sum(stopped)
+            if queue is not None:
+                for _ in batch_sims:
+                    queue.put(1)
+
+        if queue is not None:
+            queue.put(None)
+
+        return RandomWalkStats(
+            n_sims=len(sims),
+            visits=visits,
+            edges=csr_matrix((edges, self._indices, self._indptr), shape=(n, n)),
+            hits=hits,
+            hitting_times=hitting_times,
+        )
+
+    @d.dedent
+    def simulate_stats(
+        self,
+        n_sims: int,
+        max_iter: Union[int, float] = 0.25,
+        seed: Optional[int] = None,
+        successive_hits: int = 0,
+        n_jobs: Optional[int] = None,
+        backend: str = "loky",
+        show_progress_bar: bool = True,
+    ) -> RandomWalkStats:
+        """
+        Simulate many random walks and aggregate their statistics.
+
+        Unlike :meth:`simulate_many`, the visited states are not stored, so the memory doesn't grow with ``n_sims``.
+        For the same ``seed``, the random walks are the same as in :meth:`simulate_many`.
+
+        Parameters
+        ----------
+        n_sims
+            Number of random walks to simulate.
+        %(rw_sim.params)s
+        %(parallel)s
+
+        Returns
+        -------
+        The aggregated statistics.
+        """
+        if n_sims <= 0:
+            raise ValueError(
+                f"Expected number of simulations to be positive, found `{n_sims}`."
+            )
+        max_iter, successive_hits = self._validate(max_iter, successive_hits)
+        start = logg.info(
+            f"Simulating `{n_sims}` random walks of maximum length `{max_iter}`"
+        )
+
+        stats = parallelize(
+            self._simulate_stats,
+            collection=np.arange(n_sims),
+            n_jobs=n_jobs,
+            backend=backend,
+            show_progress_bar=show_progress_bar,
+            as_array=False,
+            unit="sim",
+        )(max_iter=max_iter, seed=seed, successive_hits=successive_hits)
+        stats = reduce(lambda a, b: a + b, stats)
+
+        logg.info("    Finish", time=start)
+
+        return stats
+
+
+def _batches(sims: np.ndarray) -> Iterator[Tuple[int, np.ndarray]]:
+    """Group simulation indices by the batch they belong to."""
+    batches = sims // _BATCH_SIZE
+    for batch in np.unique(batches):
+        yield batch, sims[batches == batch]
+
+
+@njit(**jit_kwargs)
+def _row_cumsum(indptr: np.ndarray, data: np.ndarray) -> np.ndarray:
+    """Cumulative sums of the rows of a CSR matrix, normalized to end with `1`."""
+    res = np.empty_like(data)
+    for i in range(len(indptr) - 1):
+        start, end = indptr[i], indptr[i + 1]
+        acc = 0.0
+        for j in range(start, end):
+            acc += data[j]
+            res[j] = acc
+        for j in range(start, end):
+            res[j] /= acc
+        if end > start:
+            res[end - 1] = 1.0
+
+    return res
+
+
+@njit(**jit_kwargs)
+def _sample_next(
+    indptr: np.ndarray,
+    cumsum: np.ndarray,
+    states: np.ndarray,
+    u: np.ndarray,
+) -> np.ndarray:
+    """
+    Sample the next states by binary search of uniform numbers ``u`` in the cumulative sums of the rows.
+
+    Returns the positions of the traversed edges in the CSR transition matrix.
+    """
+    res = np.empty_like(states)
+    for k in range(len(states)):
+        start, end = indptr[states[k]], indptr[states[k] + 1]
+        j = start + np.searchsorted(cumsum[start:end], u[k], side="right")
+        res[k] = min(j, end - 1)
+
+    return res
+
+
+@njit(**jit_kwargs)
+def _count(counts: np.ndarray, ixs: np.ndarray) -> None:
+    """Increment ``counts`` at ``ixs``, in place."""
+    for ix in ixs:
+        counts[ix] += 1
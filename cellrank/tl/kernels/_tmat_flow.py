@@ -1,6 +1,5 @@
 from typing import Any, List, Tuple, Union, Mapping, Optional, Sequence
 
-from functools import lru_cache
 from dataclasses import dataclass
 from statsmodels.nonparametric.smoothers_lowess import lowess
 
@@ -14,9 +13,10 @@ from cellrank.tl.kernels._utils import _ensure_numeric_ordered
 import numpy as np
 import pandas as pd
 from scipy.stats import logistic
-from scipy.sparse import issparse, spmatrix
+from scipy.sparse import spmatrix, csr_matrix
 from pandas.api.types import infer_dtype
 from scipy.interpolate import interp1d
+from scipy.sparse.linalg import LinearOperator
 from pandas.core.dtypes.common import is_categorical_dtype
 
 import matplotlib.pyplot as plt
@@ -55,7 +55,7 @@ class FlowPlotter:
     def __init__(
         self,
         adata: AnnData,
-        tmat: Union[np.ndarray, spmatrix],
+        tmat: Union[np.ndarray, spmatrix, LinearOperator],
         cluster_key: str,
         time_key: str,
     ):
@@ -79,6 +79,14 @@ class FlowPlotter:
             )
         self._adata.obs[self._tkey] = _ensure_numeric_ordered(self._adata, self._tkey)
 
+        # clusters and time points of the selected cells, see `prepare`
+        self._categories = self.clusters.cat.categories
+        self._times = self.time.cat.categories
+        self._cluster_codes = self.clusters.cat.codes.values.copy()
+        self._time_codes = self.time.cat.codes.values.copy()
+        # flow between all (time point, cluster) groups, computed once
+        self._joint_flow: Optional[csr_matrix] = None
+
     def prepare(
         self,
         cluster: str,
@@ -88,6 +96,8 @@ class FlowPlotter:
         """
         Prepare itself for plotting by computing flow and contingency matrix.
 
+        The flow between all clusters is computed only once, preparing for another ``cluster`` reuses it.
+
         Parameters
         ----------
         cluster
@@ -101,17 +111,16 @@ class FlowPlotter:
         -------
         Returns self and modifies internal internal attributes.
         """
+        mask = np.ones(self._adata.n_obs, dtype=bool)
         if clusters is None:
             self._clusters = self.clusters.cat.categories
         else:
             clusters = _unique_order_preserving([cluster] + list(clusters))
             mask = self.clusters.isin(clusters).values
-
-            self._adata = self._adata[mask]
-            if not self._adata.n_obs:
+            if not np.any(mask):
                 raise ValueError("No valid clusters have been selected.")
-            self._tmat = self._tmat[mask, :][:, mask]
-            self._clusters = [c for c in clusters if c in self.clusters.cat.categories]
+            present = self._present(self._cluster_codes[mask], self.clusters)
+            self._clusters = [c for c in clusters if c in present]
 
         if cluster not in self._clusters:
             raise ValueError(f"Invalid source cluster `{cluster!r}`.")
@@ -128,16 +137,14 @@ class FlowPlotter:
                     f"Expected at least `2` time points, found `{len(time_points)}`."
                 )
 
-            mask = self.time.isin(time_points)
-
-            self._adata = self._adata[mask]
-            if not self._adata.n_obs:
+            mask &= self.time.isin(time_points).values
+            if not np.any(mask):
                 raise ValueError("No valid time points have been selected.")
-            self._tmat = self._tmat[mask, :][:, mask]
 
-        time_points = list(
-            zip(self.time.cat.categories[:-1], self.time.cat.categories[1:])
-        )
+        # only the clusters and time points of the selected cells are used
+        self._categories = self._present(self._cluster_codes[mask], self.clusters)
+        self._times = self._present(self._time_codes[mask], self.time)
+        time_points = list(zip(self._times[:-1], self._times[1:]))
 
         logg.info(
             f"Computing flow from `{cluster}` into `{len(self._clusters) - 1}` cluster(s) "
@@ -149,6 +156,44 @@ class FlowPlotter:
 
         return self
 
+    def compute_flow_tensor(
+        self, time_points: Sequence[Tuple[Numeric_t, Numeric_t]]
+    ) -> np.ndarray:
+        """
+        Compute outgoing flow between all clusters at once.
+
+        For time points :math:`t_1` and :math:`t_2`, the flow is :math:`C_{t_1}^T T C_{t_2}`, where :math:`T` is the
+        transition matrix and :math:`C_t` is the sparse one-hot matrix of clusters of cells at time point :math:`t`.
+
+        Parameters
+        ----------
+        time_points
+            Time point pairs for which to calculate the flow.
+
+        Returns
+        -------
+        Array of shape ``(n_time_points, n_clusters, n_clusters)``. The element `[i, j, k]` is the fraction of the
+        outgoing flow of the `j`-th cluster at the 1st time point of the `i`-th pair that goes into the `k`-th cluster
+        at the 2nd time point.
+        """
+        joint = self._compute_joint_flow()
+        n_clusters = len(self.clusters.cat.categories)
+        cixs = self.clusters.cat.categories.get_indexer(self._categories)
+        tixs = self.time.cat.categories.get_indexer(
+            [t for tps in time_points for t in tps]
+        )
+        if np.any(tixs < 0):
+            raise ValueError(f"Invalid time points `{list(time_points)}`.")
+
+        flow = np.zeros((len(time_points), len(cixs), len(cixs)), dtype=np.float64)
+        for i, (t1, t2) in enumerate(zip(tixs[::2], tixs[1::2])):
+            flow[i] = joint[t1 * n_clusters + cixs, :][:, t2 * n_clusters + cixs].A
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            flow /= flow.sum(-1, keepdims=True)
+
+        return np.nan_to_num(flow, nan=0.0, copy=False)
+
     def compute_flow(
         self,
         time_points: Sequence[Tuple[Numeric_t, Numeric_t]],
@@ -170,52 +215,43 @@ class FlowPlotter:
         a dataframe of shape ``(n_time_points * n_clusters, n_clusters)`` otherwise.
         The dataframe's index is a multi-index and the 1st level corresponds to time, the 2nd level to source clusters.
         """
-
-        def default_helper(t1: Numeric_t, t2: Numeric_t) -> pd.DataFrame:
-            subset, row_cls, col_cls = self._get_time_subset(t1, t2)
-
-            df = pd.DataFrame(subset.A if issparse(subset) else subset)
-            df = df.groupby(row_cls).sum().T.groupby(col_cls).sum().T
-
-            res = pd.DataFrame(np.zeros((n, n)), index=categories, columns=categories)
-            res.loc[df.index, df.columns] = df
-            res.fillna(0, inplace=True)
-
-            return res
-
-        def cluster_helper(t1: Numeric_t, t2: Numeric_t) -> pd.DataFrame:
-            subset, row_cls, col_cls = self._get_time_subset(t1, t2, cluster=cluster)
-
-            df = pd.DataFrame(subset.A if issparse(subset) else subset).sum(0)
-            df = df.groupby(col_cls).sum()
-            df = pd.DataFrame([df], index=[cluster], columns=df.index)
-
-            res = pd.DataFrame(np.zeros((1, n)), index=[cluster], columns=categories)
-            res.loc[df.index, df.columns] = df
-            res.fillna(0, inplace=True)
-
-            return res
-
-        categories = self.clusters.cat.categories
-        n = len(categories)
-        callback = cluster_helper if cluster is not None else default_helper
-        flows, times = [], []
-
-        for t1, t2 in time_points:
-            flow = callback(t1, t2)
-            times.extend([t1] * len(flow))
-            flows.append(flow)
-
-        flow = pd.concat(flows)
-        flow.set_index([times, flow.index], inplace=True)
-        flow /= flow.sum(1).values[:, None]
-        flow.fillna(0, inplace=True)
-
-        return flow
+        categories = self._categories
+        flow = self.compute_flow_tensor(time_points)
+        sources = list(categories)
+        if cluster is not None:
+            ix = categories.get_loc(cluster)
+            flow, sources = flow[:, ix : ix + 1], [cluster]
+
+        index = pd.MultiIndex.from_product([[t1 for t1, _ in time_points], sources])
+        return pd.DataFrame(
+            flow.reshape(-1, len(categories)), index=index, columns=categories
+        )
 
     def compute_contingency_matrix(self) -> pd.DataFrame:
         """Row-normalized contingency matrix of shape ``(n_clusters, n_time_points)``."""
-        cmat = pd.crosstab(self.clusters, self.time)
+        n_clusters = len(self.clusters.cat.categories)
+        n_times = len(self.time.cat.categories)
+        valid = (self._cluster_codes >= 0) & (self._time_codes >= 0)
+        counts = np.bincount(
+            self._cluster_codes[valid] * n_times + self._time_codes[valid],
+            minlength=n_clusters * n_times,
+        ).reshape(n_clusters, n_times)
+        counts = counts[
+            np.ix_(
+                self.clusters.cat.categories.get_indexer(self._categories),
+                self.time.cat.categories.get_indexer(self._times),
+            )
+        ]
+
+        cmat = pd.DataFrame(
+            counts,
+            index=pd.CategoricalIndex(
+                self._categories, categories=self._categories, name=self._ckey
+            ),
+            columns=pd.CategoricalIndex(
+                self._times, categories=self._times, ordered=True, name=self._tkey
+            ),
+        )
         return (cmat / cmat.sum(0).values[None, :]).fillna(0)
 
     @d.get_sections(base="flow", sections=["Parameters"])
@@ -280,19 +316,64 @@ class FlowPlotter:
             self._flow = flow
             self._cmat = cmat
 
-    def _get_time_subset(
-        self, t1: Numeric_t, t2: Numeric_t, cluster: Optional[str] = None
-    ) -> Tuple[Union[np.ndarray, spmatrix], pd.Series, pd.Series]:
-        if cluster is None:
-            row_ixs = np.where(self.time == t1)[0]
+    def _compute_joint_flow(self) -> csr_matrix:
+        if self._joint_flow is not None:
+            return self._joint_flow
+
+        n_clusters = len(self.clusters.cat.categories)
+        n_groups = len(self.time.cat.categories) * n_clusters
+        valid = (self._cluster_codes >= 0) & (self._time_codes >= 0)
+        groups = self._time_codes[valid] * n_clusters + self._cluster_codes[valid]
+        onehot = csr_matrix(
+            (np.ones(len(groups)), (np.where(valid)[0], groups)),
+            shape=(self._adata.n_obs, n_groups),
+        )
+
+        if isinstance(self._tmat, LinearOperator):
+            joint = np.hstack(
+                [
+                    onehot.T @ self._tmat.matmat(onehot[:, ixs].A)
+                    for ixs in np.array_split(
+                        np.arange(n_groups), max(1, n_groups // 64)
+                    )
+                ]
+            )
         else:
-            row_ixs = np.where((self.time == t1) & (self.clusters == cluster))[0]
+            joint = onehot.T @ self._tmat @ onehot
+        self._joint_flow = csr_matrix(joint)
+
+        return self._joint_flow
 
-        col_ixs = np.where(self.time == t2)[0]
-        row_cls = self.clusters.values[row_ixs]
-        col_cls = self.clusters.values[col_ixs]
+    def _is_valid(
+        self,
+        adata: AnnData,
+        tmat: Union[np.ndarray, spmatrix, LinearOperator],
+        cluster_key: str,
+        time_key: str,
+    ) -> bool:
+        """Whether the flow computed by this object can be reused for the current state of ``adata``."""
+        if adata is not self._adata or tmat is not self._tmat:
+            return False
+        if (cluster_key, time_key) != (self._ckey, self._tkey):
+            return False
+        if cluster_key not in adata.obs or time_key not in adata.obs:
+            return False
+        clusters, time = adata.obs[cluster_key], adata.obs[time_key]
+        return (
+            is_categorical_dtype(clusters)
+            and is_categorical_dtype(time)
+            and time.cat.ordered
+            and np.array_equal(clusters.cat.codes.values, self._cluster_codes)
+            and np.array_equal(time.cat.codes.values, self._time_codes)
+        )
 
-        return self._tmat[row_ixs, :][:, col_ixs], row_cls, col_cls
+    @staticmethod
+    def _present(codes: np.ndarray, values: pd.Series) -> pd.Index:
+        """Categories of ``values`` which are present in ``codes``, in the categories' order."""
+        categories = values.cat.categories
+        present = np.zeros(len(categories), dtype=bool)
+        present[codes[codes >= 0]] = True
+        return categories[present]
 
     def _remove_min_clusters(self, min_flow: float) -> None:
         logg.debug("Removing clusters with no incoming flow edges")
@@ -555,18 +636,15 @@ class FlowPlotter:
         return self._adata.obs[self._tkey]
 
     @property
-    @lru_cache(1)
     def cmap(self) -> Mapping[str, Any]:
         """Colormap for :attr:`clusters`."""
-        return dict(
-            zip(
-                self.clusters.cat.categories,
-                self._adata.uns.get(
-                    f"{self._ckey}_colors",
-                    _create_categorical_colors(len(self.clusters.cat.categories)),
-                ),
+        categories = self.clusters.cat.categories
+        colors = self._adata.uns.get(f"{self._ckey}_colors", None)
+        if colors is None:
+            return dict(
+                zip(self._categories, _create_categorical_colors(len(self._categories)))
             )
-        )
+        return dict(zip(categories, colors))
 
 
 def _lcdf(
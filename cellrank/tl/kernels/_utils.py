@@ -1,5 +1,6 @@
-from typing import Tuple, Callable, Optional
+from typing import Any, List, Tuple, Union, Callable, Optional, Sequence
 
+import hashlib
 from inspect import signature
 
 from anndata import AnnData
@@ -7,9 +8,10 @@ from cellrank import logging as logg
 
 import numpy as np
 import pandas as pd
-from numba import njit, prange
-from scipy.sparse import csr_matrix
+from numba import njit, typed, prange
+from scipy.sparse import issparse, spmatrix, csr_matrix, isspmatrix_csr
 from pandas.api.types import infer_dtype
+from scipy.sparse.linalg import LinearOperator
 from pandas.core.dtypes.common import is_numeric_dtype, is_categorical_dtype
 
 jit_kwargs = {"nogil": True, "cache": True, "fastmath": True}
@@ -240,6 +242,200 @@ def _calculate_starts(indptr: np.ndarray, ixs) -> np.ndarray:
     return np.hstack((np.array([0], dtype=starts.dtype), starts))
 
 
+@njit(**jit_kwargs)
+def _csr_union_pattern(
+    indptrs, indices, positions, n_cols: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the union of sparsity patterns of CSR matrices.
+
+    Parameters
+    ----------
+    indptrs
+        List of `indptr` arrays of the matrices.
+    indices
+        List of `indices` arrays of the matrices.
+    positions
+        List of arrays of the same shape as ``indices``. Will be filled with the positions of
+        the matrices' entries within the union pattern.
+    n_cols
+        Number of columns.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`, :class:`numpy.ndarray`
+        The `indptr` and `indices` of the union, in canonical format.
+    """
+    n_rows, max_nnz = len(indptrs[0]) - 1, 0
+    for ixs in indices:
+        max_nnz += len(ixs)
+
+    out_indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    out_indices = np.empty(max_nnz, dtype=np.int64)
+    pos = np.full(n_cols, -1, dtype=np.int64)
+
+    nnz = 0
+    for i in range(n_rows):
+        start = nnz
+        for j in range(len(indptrs)):
+            ixs = indices[j]
+            for p in range(indptrs[j][i], indptrs[j][i + 1]):
+                c = ixs[p]
+                if pos[c] < 0:
+                    pos[c] = 0
+                    out_indices[nnz] = c
+                    nnz += 1
+        out_indices[start:nnz].sort()
+        for p in range(start, nnz):
+            pos[out_indices[p]] = p
+        for j in range(len(indptrs)):
+            ixs, poss = indices[j], positions[j]
+            for p in range(indptrs[j][i], indptrs[j][i + 1]):
+                poss[p] = pos[ixs[p]]
+        for p in range(start, nnz):
+            pos[out_indices[p]] = -1
+        out_indptr[i + 1] = nnz
+
+    return out_indptr, out_indices[:nnz].copy()
+
+
+@njit(**jit_kwargs)
+def _csr_weighted_data(positions, data, weights: np.ndarray, nnz: int) -> np.ndarray:
+    res = np.zeros(nnz, dtype=np.float64)
+    for j in range(len(data)):
+        w, poss, vals = weights[j], positions[j], data[j]
+        for p in range(len(vals)):
+            res[poss[p]] += w * vals[p]
+
+    return res
+
+
+def _to_typed_list(
+    arrs: Sequence[np.ndarray], dtype: Optional[np.dtype] = None
+) -> typed.List:
+    # numba requires all arrays in a list to have the same dtype
+    dtype = np.result_type(*arrs) if dtype is None else dtype
+    return typed.List([np.ascontiguousarray(a, dtype=dtype) for a in arrs])
+
+
+def _union_pattern(
+    mats: Sequence[csr_matrix],
+) -> Tuple[np.ndarray, np.ndarray, typed.List]:
+    """
+    Align CSR matrices of the same shape to the union of their sparsity patterns.
+
+    Parameters
+    ----------
+    mats
+        Matrices in CSR format.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`, :class:`numpy.ndarray`, :class:`numba.typed.List`
+        The `indptr` and `indices` of the union and for each matrix, the positions of its entries in the union.
+    """
+    positions = typed.List([np.empty(m.nnz, dtype=np.int64) for m in mats])
+    indptr, indices = _csr_union_pattern(
+        _to_typed_list([m.indptr for m in mats], dtype=np.int64),
+        _to_typed_list([m.indices for m in mats], dtype=np.int64),
+        positions,
+        mats[0].shape[1],
+    )
+
+    return indptr, indices, positions
+
+
+def _fused_weighted_sum(
+    mats: Sequence[Union[np.ndarray, spmatrix]],
+    weights: Sequence[float],
+    pattern: Optional[Tuple[np.ndarray, np.ndarray, typed.List]] = None,
+) -> csr_matrix:
+    """
+    Compute ``sum(w * m for w, m in zip(weights, mats))`` without creating intermediate matrices.
+
+    Parameters
+    ----------
+    mats
+        Matrices of the same shape. Dense matrices are converted to :class:`scipy.sparse.csr_matrix`.
+    weights
+        Weight of each matrix.
+    pattern
+        Union of the sparsity patterns of ``mats``, as returned by :func:`_union_pattern`. If `None`, compute it.
+
+    Returns
+    -------
+    :class:`scipy.sparse.csr_matrix`
+        The weighted sum, whose sparsity pattern is the union of the patterns of ``mats``.
+    """
+    mats = [m if isspmatrix_csr(m) else csr_matrix(m) for m in mats]
+    if pattern is None:
+        pattern = _union_pattern(mats)
+    indptr, indices, positions = pattern
+
+    data = _csr_weighted_data(
+        positions,
+        _to_typed_list([m.data for m in mats], dtype=np.float64),
+        np.asarray(weights, dtype=np.float64),
+        len(indices),
+    )
+    # the pattern can be shared among multiple calls
+    res = csr_matrix((data, indices.copy(), indptr.copy()), shape=mats[0].shape)
+    res.eliminate_zeros()
+
+    return res
+
+
+def _update_hash(h: "hashlib._Hash", obj: Any) -> None:
+    from cellrank.tl._linear_operator import SparsePlusLowRank
+
+    if isinstance(obj, SparsePlusLowRank):
+        h.update(b"splr")
+        for o in (obj.sparse, obj.U, obj.V):
+            _update_hash(h, o)
+    elif isinstance(obj, LinearOperator):
+        # the contents are not accessible
+        h.update(f"{type(obj).__name__}:{id(obj)}".encode())
+    elif issparse(obj):
+        obj = obj if isspmatrix_csr(obj) else obj.tocsr()
+        h.update(f"csr{obj.shape}".encode())
+        for arr in (obj.indptr, obj.indices, obj.data):
+            _update_hash(h, arr)
+    elif isinstance(obj, np.ndarray) and obj.dtype != object:
+        h.update(f"{obj.dtype}{obj.shape}".encode())
+        h.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, dict):
+        for k in sorted(obj.keys(), key=str):
+            _update_hash(h, k)
+            _update_hash(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for o in obj:
+            _update_hash(h, o)
+    else:
+        h.update(f"{type(obj).__name__}:{obj!r}".encode())
+
+
+def _fingerprint(*objs: Any) -> str:
+    """
+    Compute a fingerprint of arrays, sparse matrices and parameters.
+
+    Parameters
+    ----------
+    objs
+        Objects to fingerprint. Arrays, sparse matrices and :class:`cellrank.tl.SparsePlusLowRank` are hashed by
+        their contents, other linear operators by their identity and other objects by their :func:`repr`.
+
+    Returns
+    -------
+    The hexadecimal digest.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    for obj in objs:
+        _update_hash(h, obj)
+
+    return h.hexdigest()
+
+
 def _get_basis(adata: AnnData, basis: str) -> np.ndarray:
     try:
         return adata.obsm[f"X_{basis}"]
@@ -252,6 +448,160 @@ def _get_basis(adata: AnnData, basis: str) -> np.ndarray:
             ) from None
 
 
+@njit(nogil=True, cache=True)
+def _project_embedding_csr(
+    indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray, emb: np.ndarray
+) -> np.ndarray:
+    # no `fastmath`, since NaNs in the embedding need to be detected
+    n_cells, n_comps = emb.shape
+    res = np.zeros((n_cells, n_comps), dtype=np.float64)
+
+    for i in range(n_cells):
+        start, end = indptr[i], indptr[i + 1]
+        if start == end:
+            # cells without any neighbors are undefined
+            res[i] = np.nan
+            continue
+
+        for j in range(start, end):
+            c = indices[j]
+            sq_norm = 0.0
+            for k in range(n_comps):
+                sq_norm += (emb[c, k] - emb[i, k]) ** 2
+            if np.isnan(sq_norm):
+                res[i] = np.nan
+                break
+            if sq_norm == 0:
+                continue
+
+            w = weights[j] / np.sqrt(sq_norm)
+            for k in range(n_comps):
+                res[i, k] += w * (emb[c, k] - emb[i, k])
+
+    return res
+
+
+def _project_embedding(
+    tmat: Union[np.ndarray, spmatrix], conn: csr_matrix, embs: Sequence[np.ndarray]
+) -> List[np.ndarray]:
+    """
+    Project a transition matrix onto embeddings.
+
+    The transition probabilities along the edges of the KNN graph are extracted only once and the
+    embeddings are processed row by row, without materializing the per-edge displacements.
+
+    Parameters
+    ----------
+    tmat
+        Transition matrix of shape ``(n_cells, n_cells)``.
+    conn
+        KNN connectivities of shape ``(n_cells, n_cells)`` in CSR format.
+    embs
+        Embeddings of shape ``(n_cells, n_components)``.
+
+    Returns
+    -------
+    :class:`list`
+        Unscaled projections of shape ``(n_cells, n_components)``, one for each embedding. Cells with a `NaN`
+        in their (or their neighbors') coordinates are set to `NaN`.
+    """
+    n_cells = conn.shape[0]
+    degree = np.diff(conn.indptr)
+    rows = np.repeat(np.arange(n_cells), degree)
+
+    probs = np.asarray(tmat[rows, conn.indices], dtype=np.float64).ravel()
+    weights = probs - 1.0 / degree[rows]
+    del rows, probs
+
+    indptr = np.ascontiguousarray(conn.indptr)
+    indices = np.ascontiguousarray(conn.indices)
+
+    return [
+        _project_embedding_csr(
+            indptr, indices, weights, np.ascontiguousarray(emb, dtype=np.float64)
+        )
+        for emb in embs
+    ]
+
+
+def _row_max(X: csr_matrix) -> np.ndarray:
+    """
+    Compute the maximum of the stored values in each non-empty row.
+
+    Parameters
+    ----------
+    X
+        Matrix in CSR format.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        The maxima of shape ``(n_nonempty_rows,)``.
+    """
+    nonempty = np.diff(X.indptr) > 0
+    if not np.any(nonempty):
+        return np.empty((0,), dtype=X.dtype)
+
+    return np.maximum.reduceat(X.data, X.indptr[:-1][nonempty])
+
+
+def _sparsify_rows(
+    X: Union[np.ndarray, spmatrix],
+    top_k: Optional[int] = None,
+    mass: Optional[float] = None,
+) -> csr_matrix:
+    """
+    Keep only the largest values in each row.
+
+    Parameters
+    ----------
+    X
+        Non-negative matrix of shape ``(n, m)``.
+    top_k
+        Number of the largest values to keep in each row. If `None`, don't restrict the number of values.
+    mass
+        Keep the fewest largest values whose sum is at least ``mass`` fraction of the row sum.
+        If `None`, don't restrict the mass.
+
+    Returns
+    -------
+    :class:`scipy.sparse.csr_matrix`
+        The sparsified matrix of shape ``(n, m)``. Rows are not re-normalized.
+    """
+    if top_k is not None and top_k < 1:
+        raise ValueError(f"Expected `top_k` to be positive, found `{top_k}`.")
+    if mass is not None and not (0 < mass <= 1):
+        raise ValueError(f"Expected `mass` to be in `(0, 1]`, found `{mass}`.")
+
+    X = csr_matrix(X, dtype=np.float64)
+    X.eliminate_zeros()
+    if (top_k is None and mass is None) or not X.nnz:
+        return X
+
+    rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+    order = np.lexsort((-X.data, rows))
+    # position of each value within its row, when sorted in descending order
+    rank = np.empty_like(order)
+    rank[order] = np.arange(X.nnz) - X.indptr[rows]
+
+    keep = np.ones(X.nnz, dtype=bool)
+    if top_k is not None:
+        keep &= rank < top_k
+    if mass is not None:
+        sorted_data = X.data[order]
+        # mass of the values preceding the current one in its sorted row
+        excl_cumsum = np.cumsum(sorted_data) - sorted_data
+        before = np.empty_like(excl_cumsum)
+        before[order] = excl_cumsum - excl_cumsum[X.indptr[rows[order]]]
+        row_totals = np.asarray(X.sum(axis=1)).ravel()
+        keep &= before < mass * row_totals[rows]
+
+    X.data[~keep] = 0
+    X.eliminate_zeros()
+
+    return X
+
+
 def _ensure_numeric_ordered(adata: AnnData, key: str) -> pd.Series:
     if key not in adata.obs.keys():
         raise KeyError(f"Unable to find data in `adata.obs[{key!r}]`.")
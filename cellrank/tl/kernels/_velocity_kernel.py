@@ -1,4 +1,4 @@
-from typing import Any, Union, Callable, Iterable, Optional
+from typing import Any, Dict, Tuple, Union, Callable, Iterable, Optional
 from typing_extensions import Literal
 
 from copy import copy
@@ -235,7 +235,14 @@ class VelocityKernel(Kernel):
         params = {"softmax_scale": softmax_scale, "mode": mode, "seed": seed, "scheme": str(scheme)}
         if self.backward:
             params["bwd_mode"] = backward_mode
-        if self._reuse_cache(params, time=start):
+        # the seed and the number of samples only matter when sampling the velocities
+        sampled = mode in (VelocityMode.MONTE_CARLO, VelocityMode.SAMPLING)
+        if self._reuse_cache(
+            params,
+            time=start,
+            seed=seed if sampled else None,
+            n_samples=n_samples if sampled else None,
+        ):
             return self
 
         # compute first and second order moments to model the distribution of the velocity vector
@@ -297,15 +304,21 @@ class VelocityKernel(Kernel):
             backend=backend,
             **kwargs,
         )
+        self._logits = cmat
         self._compute_transition_matrix(
             tmat, density_normalize=False, check_irreducibility=check_irreducibility
         )
-        self._logits = cmat
 
         logg.info("    Finish", time=start)
 
         return self
 
+    def _cache_inputs(self) -> Tuple[Any, ...]:
+        return self._conn, self._velocity, self._gene_expression
+
+    def _cache_extras(self) -> Dict[str, Any]:
+        return {"_logits": self._logits}
+
     @property
     def logits(self) -> csr_matrix:
         """Array of shape ``(n_cells, n_cells)`` containing the logits."""
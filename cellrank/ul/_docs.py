@@ -147,8 +147,8 @@ scheme
     :meth:`cellrank.tl.kernels.SimilaritySchemeABC.__call__`."""
 _cond_num = """\
 compute_cond_num
-    Whether to compute condition number of the transition matrix. Note that this might be costly,
-    since it does not use sparse implementation."""
+    Whether to compute condition number of the transition matrix. For large matrices, the condition number
+    is estimated iteratively and is a lower bound of the true value."""
 _soft_scheme_fmt = """\
 b
     The growth rate of generalized logistic function.{}
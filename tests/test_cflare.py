@@ -6,6 +6,7 @@ from _helpers import assert_estimators_equal
 
 import cellrank as cr
 from anndata import AnnData
+from cellrank.tl import _utils
 from cellrank._key import Key
 from cellrank.tl.kernels import VelocityKernel, ConnectivityKernel
 
@@ -72,6 +73,45 @@ class TestCFLARE:
         assert Key.obs.probs(key) in mc.adata.obs
         assert Key.uns.colors(key) in mc.adata.uns
 
+    def test_compute_approx_minibatch_kmeans(self, adata_large: AnnData):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        terminal_kernel = 0.8 * vk + 0.2 * ck
+
+        mc = cr.tl.estimators.CFLARE(terminal_kernel)
+        mc.compute_eigendecomposition(k=5)
+        mc.compute_terminal_states(use=2, method="minibatch_kmeans", batch_size=64)
+
+        assert is_categorical_dtype(mc.terminal_states)
+        assert len(mc.terminal_states.cat.categories) == 2
+
+    def test_compute_approx_reuse_connectivities(self, adata_large: AnnData, mocker):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        terminal_kernel = 0.8 * vk + 0.2 * ck
+
+        mc = cr.tl.estimators.CFLARE(terminal_kernel)
+        mc.compute_eigendecomposition(k=5)
+        spy = mocker.spy(_utils, "_knn_connectivities")
+        mc.compute_terminal_states(use=2, method="leiden", n_neighbors=None)
+
+        assert spy.call_count == 0
+        assert is_categorical_dtype(mc.terminal_states)
+        assert mc.terminal_states.notnull().sum() > 0
+
+    def test_compute_approx_leiden_n_jobs(self, adata_large: AnnData):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        terminal_kernel = 0.8 * vk + 0.2 * ck
+
+        mc = cr.tl.estimators.CFLARE(terminal_kernel)
+        mc.compute_eigendecomposition(k=5)
+        mc.compute_terminal_states(use=2, method="leiden")
+        expected = mc.terminal_states.copy()
+        mc.compute_terminal_states(use=2, method="leiden", n_jobs=2)
+
+        pd.testing.assert_series_equal(mc.terminal_states, expected)
+
     def test_rename_terminal_states_no_terminal_states(self, adata_large: AnnData):
         vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
         ck = ConnectivityKernel(adata_large).compute_transition_matrix()
@@ -5,6 +5,7 @@ import pytest
 import scanpy as sc
 import cellrank.external as cre
 from anndata import AnnData
+from cellrank.tl import SparsePlusLowRank
 from cellrank.tl.kernels import ConnectivityKernel
 from cellrank.external.kernels._utils import MarkerGenes
 from cellrank.external.kernels._wot_kernel import LastTimePoint
@@ -268,6 +269,47 @@ class TestWOTKernel:
         assert isinstance(ok.transport_maps[12.0, 35.0], AnnData)
         assert ok.transport_maps[12.0, 35.0].X.dtype == np.float64
 
+    @pytest.mark.parametrize("backend", ["loky", "threading"])
+    def test_parallel(self, adata_large: AnnData, backend: str):
+        adata_large.obs["time"] = np.repeat(
+            np.arange(4.0), np.ceil(adata_large.n_obs / 4)
+        )[: adata_large.n_obs]
+        ok1 = cre.kernels.WOTKernel(adata_large, time_key="time")
+        ok1 = ok1.compute_transition_matrix(cost_matrices="X_pca", threshold=None)
+        ok2 = cre.kernels.WOTKernel(adata_large, time_key="time")
+        ok2 = ok2.compute_transition_matrix(
+            cost_matrices="X_pca", threshold=None, n_jobs=2, backend=backend
+        )
+
+        assert list(ok1.transport_maps.keys()) == list(ok2.transport_maps.keys())
+        np.testing.assert_allclose(ok1.transition_matrix.A, ok2.transition_matrix.A)
+
+    def test_lazy_cost_matrices(self):
+        from cellrank.external.kernels._wot_kernel import _compute_tmaps_helper
+
+        class OTModel:
+            def compute_transport_map(self, t1, t2, cost_matrix):
+                return AnnData(cost_matrix)
+
+        n_created = []
+
+        def cost_matrix(size: int):
+            n_created.append(size)
+            return np.ones((size, size))
+
+        tpairs = [(0.0, 1.0), (1.0, 2.0)]
+        cost_matrices = {
+            (0.0, 1.0): lambda: cost_matrix(2),
+            (1.0, 2.0): np.zeros((3, 3)),
+        }
+
+        assert not n_created
+        res = _compute_tmaps_helper(np.arange(2), OTModel(), tpairs, cost_matrices)
+
+        assert n_created == [2]
+        np.testing.assert_array_equal(res[0.0, 1.0].X, np.ones((2, 2)))
+        np.testing.assert_array_equal(res[1.0, 2.0].X, np.zeros((3, 3)))
+
     @pytest.mark.parametrize("threshold", [None, 90, 100, "auto"])
     def test_threshold(self, adata_large, threshold: Optional[Union[int, str]]):
         ok = cre.kernels.WOTKernel(adata_large, time_key="age(days)")
@@ -281,6 +323,37 @@ class TestWOTKernel:
             for row in ok.transition_matrix:
                 np.testing.assert_allclose(row.data, 1.0 / len(row.data))
 
+    @pytest.mark.parametrize("threshold", [None, "auto"])
+    @pytest.mark.parametrize("top_k", [1, 5])
+    def test_top_k(self, adata_large: AnnData, threshold: Optional[str], top_k: int):
+        ok = cre.kernels.WOTKernel(adata_large, time_key="age(days)")
+        ok = ok.compute_transition_matrix(threshold=threshold, top_k=top_k)
+
+        np.testing.assert_allclose(ok.transition_matrix.sum(1), 1.0)
+        assert np.all(np.diff(ok.transition_matrix.indptr) <= top_k)
+        assert ok.params["top_k"] == top_k
+
+    @pytest.mark.parametrize("threshold", [None, "auto"])
+    def test_matrix_free(self, adata_large: AnnData, threshold: Optional[str]):
+        ok = cre.kernels.WOTKernel(adata_large, time_key="age(days)")
+        ok = ok.compute_transition_matrix(threshold=threshold, matrix_free=True)
+        dk = cre.kernels.WOTKernel(adata_large, time_key="age(days)")
+        dk = dk.compute_transition_matrix(threshold=threshold)
+
+        assert isinstance(ok.transition_matrix, SparsePlusLowRank)
+        assert ok.transition_matrix.rank == 1
+        np.testing.assert_allclose(ok.transition_matrix.sum(1), 1.0)
+        if threshold is None:
+            np.testing.assert_allclose(
+                ok.transition_matrix.toarray(), dk.transition_matrix.A, atol=1e-12
+            )
+
+    def test_matrix_free_top_k(self, adata_large: AnnData):
+        ok = cre.kernels.WOTKernel(adata_large, time_key="age(days)")
+
+        with pytest.raises(ValueError, match="top_k"):
+            ok.compute_transition_matrix(top_k=5, matrix_free=True)
+
     def test_copy(self, adata_large: AnnData):
         ok = cre.kernels.WOTKernel(adata_large, time_key="age(days)")
         ok = ok.compute_transition_matrix()
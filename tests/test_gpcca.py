@@ -1,20 +1,24 @@
 from typing import List, Tuple, Union, Optional, Sequence
 
 import os
+import sys
 import pytest
+import pygpcca
 from copy import deepcopy
 from enum import Enum
 from _helpers import assert_array_nan_equal, assert_estimators_equal
 
 import cellrank as cr
 from anndata import AnnData
-from cellrank.tl import Lineage
+from cellrank.tl import Lineage, SparsePlusLowRank
 from cellrank._key import Key
-from cellrank.tl.kernels import VelocityKernel, ConnectivityKernel
+from cellrank.tl.kernels import VelocityKernel, PrecomputedKernel, ConnectivityKernel
+from cellrank.tl.estimators.mixins.decomposition import _eigen
+from cellrank.tl.estimators.mixins.decomposition._schur import _ScipyGPCCA
 
 import numpy as np
 import pandas as pd
-from scipy.sparse import issparse
+from scipy.sparse import issparse, csr_matrix
 from pandas.testing import assert_frame_equal, assert_series_equal
 
 
@@ -147,10 +151,16 @@ def _check_compute_macro(mc: cr.tl.estimators.GPCCA) -> None:
     assert isinstance(mc.macrostates, pd.Series)
     assert len(mc._macrostates_colors) == len(mc.macrostates.cat.categories)
 
-    if "stationary_dist" in mc.eigendecomposition:  # one state
+    if len(mc.macrostates.cat.categories) == 1:  # one state
         assert isinstance(mc.macrostates_memberships, cr.tl.Lineage)
         assert mc.macrostates_memberships.shape[1] == 1
         np.testing.assert_allclose(mc.macrostates_memberships.X.sum(), 1.0)
+        stat_dist = (mc.eigendecomposition or {}).get(
+            "stationary_dist", mc.stationary_distribution
+        )
+        np.testing.assert_allclose(
+            mc.macrostates_memberships.X.squeeze(), stat_dist, rtol=1e-6
+        )
 
         assert mc.schur_matrix is None
         assert mc.schur_vectors is None
@@ -328,6 +338,144 @@ class TestGPCCA:
 
         _check_eigdecomposition(mc)
 
+    def test_compute_eigendecomposition_reuse(self, adata_large: AnnData, mocker):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        mc = cr.tl.estimators.GPCCA(0.8 * vk + 0.2 * ck)
+        mc.compute_eigendecomposition(k=10)
+        expected = deepcopy(mc.eigendecomposition)
+
+        spy = mocker.spy(_eigen, "_eigs")
+        mc.compute_eigendecomposition(k=5)
+
+        spy.assert_not_called()
+        np.testing.assert_array_equal(mc.eigendecomposition["D"], expected["D"][:5])
+        np.testing.assert_array_equal(
+            mc.eigendecomposition["V_r"], expected["V_r"][:, :5]
+        )
+        np.testing.assert_array_equal(
+            mc.eigendecomposition["stationary_dist"], expected["stationary_dist"]
+        )
+
+        mc.compute_eigendecomposition(k=5, which="LM")
+        assert spy.call_count == 1
+
+    def test_compute_eigendecomposition_warm_start(self, adata_large: AnnData, mocker):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        kernel = 0.8 * vk + 0.2 * ck
+        mc1 = cr.tl.estimators.GPCCA(kernel)
+        mc2 = cr.tl.estimators.GPCCA(kernel)
+
+        mc1.compute_eigendecomposition(k=10)
+        mc2.compute_eigendecomposition(k=5)
+        spy = mocker.spy(_eigen, "_eigs")
+        mc2.compute_eigendecomposition(k=10)
+
+        assert spy.call_args.kwargs["v0"].keys() == {"left", "right"}
+        np.testing.assert_allclose(
+            mc1.eigendecomposition["D"], mc2.eigendecomposition["D"], atol=1e-10
+        )
+        np.testing.assert_allclose(
+            mc1.eigendecomposition["stationary_dist"],
+            mc2.eigendecomposition["stationary_dist"],
+            atol=1e-10,
+        )
+
+    def test_compute_eigendecomposition_different_tmat(
+        self, adata_large: AnnData, mocker
+    ):
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        mc = cr.tl.estimators.GPCCA(ck)
+        mc.compute_eigendecomposition(k=5)
+        ck.compute_transition_matrix(density_normalize=False)
+
+        spy = mocker.spy(_eigen, "_eigs")
+        mc.compute_eigendecomposition(k=5)
+
+        assert spy.call_args.kwargs["v0"] == {}
+        T, V_r = mc.transition_matrix, mc.eigendecomposition["V_r"]
+        np.testing.assert_allclose(T @ V_r, V_r * mc.eigendecomposition["D"], atol=1e-8)
+
+    def test_compute_eigendecomposition_n_jobs(self, adata_large: AnnData):
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        mc1 = cr.tl.estimators.GPCCA(ck)
+        mc2 = cr.tl.estimators.GPCCA(ck)
+
+        mc1.compute_eigendecomposition(k=5, n_jobs=1)
+        mc2.compute_eigendecomposition(k=5, n_jobs=2)
+
+        for key in ["D", "stationary_dist"]:
+            np.testing.assert_allclose(
+                mc1.eigendecomposition[key], mc2.eigendecomposition[key], atol=1e-10
+            )
+
+    @pytest.mark.parametrize("method", ["linear", "power"])
+    def test_compute_stationary_distribution(self, adata_large: AnnData, method: str):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        mc = cr.tl.estimators.GPCCA(0.8 * vk + 0.2 * ck)
+
+        mc.compute_stationary_distribution(method=method, tol=1e-12)
+        mc.compute_eigendecomposition(k=5)
+
+        pi = mc.stationary_distribution
+        report = mc.params["stationary_distribution_fwd"]
+        assert report["method"] == method
+        assert report["converged"]
+        assert report["residual"] <= 1e-12
+        np.testing.assert_allclose(pi.sum(), 1.0)
+        np.testing.assert_allclose(mc.transition_matrix.T @ pi, pi, atol=1e-12)
+        np.testing.assert_allclose(
+            pi, mc.eigendecomposition["stationary_dist"], atol=1e-10
+        )
+
+    def test_compute_stationary_distribution_reuse(self, adata_large: AnnData, mocker):
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        mc = cr.tl.estimators.GPCCA(ck)
+        mc.compute_stationary_distribution()
+
+        spy = mocker.spy(_eigen, "_stationary_distribution")
+        mc.compute_stationary_distribution()
+        spy.assert_not_called()
+
+        ck.compute_transition_matrix(density_normalize=False)
+        mc.compute_stationary_distribution()
+        assert spy.call_count == 1
+        np.testing.assert_allclose(
+            mc.transition_matrix.T @ mc.stationary_distribution,
+            mc.stationary_distribution,
+            atol=1e-10,
+        )
+
+    def test_compute_stationary_distribution_reducible(self):
+        T = np.array(
+            [
+                [0.5, 0.5, 0.0, 0.0],
+                [0.3, 0.7, 0.0, 0.0],
+                [0.0, 0.0, 0.1, 0.9],
+                [0.0, 0.0, 0.8, 0.2],
+            ]
+        )
+
+        for mat in [csr_matrix(T), SparsePlusLowRank(T)]:
+            pi, report = _eigen._stationary_distribution(
+                mat, method="linear", tol=1e-12
+            )
+
+            if isinstance(mat, SparsePlusLowRank):
+                assert report["method"] == "power"
+            assert report["converged"]
+            np.testing.assert_allclose(pi @ T, pi, atol=1e-12)
+            np.testing.assert_allclose(pi.sum(), 1.0)
+
+    def test_compute_stationary_distribution_invalid_method(self, adata_large: AnnData):
+        mc = cr.tl.estimators.GPCCA(
+            ConnectivityKernel(adata_large).compute_transition_matrix()
+        )
+        with pytest.raises(ValueError, match=r"Invalid method"):
+            mc.compute_stationary_distribution(method="foo")
+
     def test_compute_schur_invalid_n_comps(self, adata_large: AnnData):
         vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
         ck = ConnectivityKernel(adata_large).compute_transition_matrix()
@@ -478,6 +626,57 @@ class TestGPCCA:
 
         _check_compute_macro(mc)
 
+    @pytest.mark.parametrize("backend", ["loky", "threading"])
+    def test_compute_macrostates_min_chi_parallel(
+        self, adata_large: AnnData, backend: str
+    ):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        terminal_kernel = 0.8 * vk + 0.2 * ck
+
+        mc = cr.tl.estimators.GPCCA(terminal_kernel)
+        mc.compute_schur(n_components=10, method="brandts")
+        mc.compute_macrostates(n_states=[3, 6], n_cells=5, n_jobs=2, backend=backend)
+        cached = set(mc._gpcca._cache)
+        n_states = len(mc.macrostates.cat.categories)
+
+        mc_seq = cr.tl.estimators.GPCCA(terminal_kernel)
+        mc_seq.compute_schur(n_components=10, method="brandts")
+        mc_seq.compute_macrostates(n_states=n_states, n_cells=5)
+
+        _check_compute_macro(mc)
+        assert n_states in cached
+        assert cached <= set(range(3, 7))
+        np.testing.assert_allclose(
+            mc.macrostates_memberships.X, mc_seq.macrostates_memberships.X
+        )
+        np.testing.assert_allclose(mc.coarse_T.values, mc_seq.coarse_T.values)
+
+    def test_compute_macrostates_memoized(self, adata_large: AnnData, mocker):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        terminal_kernel = 0.8 * vk + 0.2 * ck
+
+        mc = cr.tl.estimators.GPCCA(terminal_kernel)
+        mc.compute_schur(n_components=10, method="brandts")
+        mc.compute_macrostates(n_states=[3, 6], n_cells=5, backend="threading")
+        cached = sorted(mc._gpcca._cache)
+        assert len(cached) > 1
+
+        spy = mocker.spy(pygpcca._gpcca, "_gpcca_core")
+        res = {}
+        for n_states in cached:
+            mc.compute_macrostates(n_states=n_states, n_cells=5)
+            res[n_states] = mc.macrostates_memberships.X, mc.coarse_T.values
+        assert spy.call_count == 0
+
+        # new Schur decomposition invalidates the cache
+        mc.compute_schur(n_components=10, method="brandts")
+        mc.compute_macrostates(n_states=cached[0], n_cells=5)
+        assert spy.call_count == 1
+        np.testing.assert_allclose(mc.macrostates_memberships.X, res[cached[0]][0])
+        np.testing.assert_allclose(mc.coarse_T.values, res[cached[0]][1])
+
     def test_compute_macro_invalid_cluster_key(self, adata_large: AnnData):
         vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
         ck = ConnectivityKernel(adata_large).compute_transition_matrix()
@@ -1090,6 +1289,180 @@ class TestGPCCA:
         _assert_params(g, state, fwd=True)
 
 
+class TestGPCCAMatrixFree:
+    @staticmethod
+    def _kernels(adata: AnnData) -> Tuple[PrecomputedKernel, PrecomputedKernel]:
+        ck = ConnectivityKernel(adata).compute_transition_matrix()
+        n = adata.n_obs
+        ones = np.ones(n)
+        op = SparsePlusLowRank(0.9 * ck.transition_matrix, U=ones, V=0.1 * ones / n)
+
+        return PrecomputedKernel(op, adata=adata), PrecomputedKernel(
+            op.toarray(), adata=adata
+        )
+
+    def test_eigendecomposition(self, adata_large: AnnData):
+        ok, dk = self._kernels(adata_large)
+        g_op, g_dense = cr.tl.estimators.GPCCA(ok), cr.tl.estimators.GPCCA(dk)
+
+        g_op.compute_eigendecomposition(k=5)
+        g_dense.compute_eigendecomposition(k=5)
+
+        np.testing.assert_allclose(
+            g_op.eigendecomposition["D"], g_dense.eigendecomposition["D"], atol=1e-6
+        )
+        np.testing.assert_allclose(
+            g_op.eigendecomposition["stationary_dist"],
+            g_dense.eigendecomposition["stationary_dist"],
+            rtol=1e-5,
+        )
+
+    def test_schur(self, adata_large: AnnData):
+        ok, dk = self._kernels(adata_large)
+        g_op, g_dense = cr.tl.estimators.GPCCA(ok), cr.tl.estimators.GPCCA(dk)
+
+        g_op.compute_schur(n_components=4)
+        g_dense.compute_schur(n_components=4, method="brandts")
+
+        X, R = g_op.schur_vectors, g_op.schur_matrix
+        eta = np.full(adata_large.n_obs, 1.0 / adata_large.n_obs)
+        assert X.shape == (adata_large.n_obs, 4)
+        np.testing.assert_allclose(X[:, 0], 1.0)
+        np.testing.assert_allclose(X.T @ (X * eta[:, None]), np.eye(4), atol=1e-8)
+        np.testing.assert_allclose(dk.transition_matrix @ X, X @ R, atol=1e-8)
+        np.testing.assert_allclose(
+            g_op.eigendecomposition["D"], g_dense.eigendecomposition["D"], atol=1e-6
+        )
+
+    def test_absorption_probabilities(self, adata_large: AnnData):
+        ok, dk = self._kernels(adata_large)
+        states = {
+            "foo": adata_large.obs_names[:5],
+            "bar": adata_large.obs_names[100:105],
+        }
+        res = []
+        for kernel in (ok, dk):
+            g = cr.tl.estimators.GPCCA(kernel)
+            g.set_terminal_states(states)
+            g.compute_absorption_probabilities(
+                tol=1e-10, time_to_absorption="all", show_progress_bar=False
+            )
+            res.append(g)
+
+        np.testing.assert_allclose(
+            res[0].absorption_probabilities.X,
+            res[1].absorption_probabilities.X,
+            rtol=1e-6,
+        )
+        np.testing.assert_allclose(
+            res[0].absorption_times.values, res[1].absorption_times.values, rtol=1e-5
+        )
+
+    def test_macrostates_raises(self, adata_large: AnnData):
+        ok, _ = self._kernels(adata_large)
+        g = cr.tl.estimators.GPCCA(ok)
+
+        with pytest.raises(TypeError, match="explicit transition matrix"):
+            g.compute_macrostates(n_states=2)
+
+
+class TestGPCCAScipyKrylov:
+    @pytest.fixture(autouse=True)
+    def _no_petsc(self, monkeypatch):
+        monkeypatch.setitem(sys.modules, "petsc4py", None)
+        monkeypatch.setitem(sys.modules, "slepc4py", None)
+
+    def test_macrostates_same_as_brandts(self, adata_large: AnnData):
+        vk = VelocityKernel(adata_large).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata_large).compute_transition_matrix()
+        kernel = (0.8 * vk + 0.2 * ck).compute_transition_matrix()
+        g_krylov = cr.tl.estimators.GPCCA(kernel)
+        g_brandts = cr.tl.estimators.GPCCA(kernel)
+
+        g_krylov.compute_schur(n_components=5, method="krylov")
+        g_brandts.compute_schur(n_components=5, method="brandts")
+        assert isinstance(g_krylov._gpcca, _ScipyGPCCA)
+        assert g_krylov.schur_vectors.shape == (adata_large.n_obs, 5)
+        np.testing.assert_allclose(
+            g_krylov.eigendecomposition["D"],
+            g_brandts.eigendecomposition["D"],
+            atol=1e-8,
+        )
+
+        # requires more Schur vectors than precomputed
+        g_krylov.compute_macrostates(n_states=6)
+        g_brandts.compute_macrostates(n_states=6)
+
+        np.testing.assert_allclose(
+            g_krylov.macrostates_memberships.X,
+            g_brandts.macrostates_memberships.X,
+            atol=1e-8,
+        )
+        np.testing.assert_allclose(
+            g_krylov.coarse_T.values, g_brandts.coarse_T.values, atol=1e-8
+        )
+
+
+class TestGPCCAMetacells:
+    @staticmethod
+    def _kernel(adata: AnnData):
+        vk = VelocityKernel(adata).compute_transition_matrix(softmax_scale=4)
+        ck = ConnectivityKernel(adata).compute_transition_matrix()
+        return (0.8 * vk + 0.2 * ck).compute_transition_matrix()
+
+    @pytest.mark.parametrize("n_metacells", [50, 100])
+    def test_macrostates_close_to_full(self, adata_large: AnnData, n_metacells: int):
+        kernel = self._kernel(adata_large)
+        g_full = cr.tl.estimators.GPCCA(kernel)
+        g_meta = cr.tl.estimators.GPCCA(kernel)
+
+        g_full.compute_schur(n_components=10)
+        g_meta.compute_schur(n_components=10, n_metacells=n_metacells)
+        g_full.compute_macrostates(n_states=4, n_cells=5)
+        g_meta.compute_macrostates(n_states=4, n_cells=5)
+
+        _check_compute_macro(g_meta)
+        assert g_meta.schur_vectors.shape[0] == adata_large.n_obs
+        assert g_meta.macrostates_memberships.shape == (adata_large.n_obs, 4)
+        np.testing.assert_allclose(
+            g_meta.macrostates_memberships.X.sum(1), 1.0, rtol=1e-6
+        )
+        np.testing.assert_allclose(
+            g_meta.eigendecomposition["D"][:3],
+            g_full.eigendecomposition["D"][:3],
+            atol=0.05,
+        )
+        corr = np.corrcoef(
+            g_full.macrostates_memberships.X.T, g_meta.macrostates_memberships.X.T
+        )[:4, 4:]
+        assert np.all(np.max(corr, axis=1) > 0.9)
+
+    def test_error_diagnostic(self, adata_large: AnnData):
+        kernel = self._kernel(adata_large)
+        g = cr.tl.estimators.GPCCA(kernel)
+        g.compute_schur(n_components=5)
+        assert "metacells" not in g.eigendecomposition
+
+        g.compute_schur(n_components=5, n_metacells=50)
+        err = g.eigendecomposition["metacells"]
+
+        assert 0 < err["n_metacells"] <= 50
+        assert 0 <= err["lumpability_error"] <= 1
+        assert 0 <= err["schur_residual"] < 0.5
+
+    @pytest.mark.parametrize("n_metacells", [5, 10, 200])
+    def test_invalid_n_metacells(self, adata_large: AnnData, n_metacells: int):
+        g = cr.tl.estimators.GPCCA(self._kernel(adata_large))
+        with pytest.raises(ValueError, match="n_metacells"):
+            g.compute_schur(n_components=10, n_metacells=n_metacells)
+
+    def test_matrix_free_raises(self, adata_large: AnnData):
+        ok, _ = TestGPCCAMatrixFree._kernels(adata_large)
+        g = cr.tl.estimators.GPCCA(ok)
+        with pytest.raises(TypeError, match="explicit transition matrix"):
+            g.compute_schur(n_components=5, n_metacells=50)
+
+
 class TestGPCCASerialization:
     @pytest.mark.parametrize("state", list(State))
     def test_to_adata(self, adata_large: AnnData, state: State):
@@ -1,5 +1,6 @@
 from typing import Tuple, Callable, Optional
 
+import time
 import pickle
 import pytest
 from copy import copy
@@ -25,20 +26,31 @@ from cellrank.tl.kernels import (
     PseudotimeKernel,
     PrecomputedKernel,
     ConnectivityKernel,
+    TransportMapKernel,
+    HardThresholdScheme,
+    SoftThresholdScheme,
 )
+from cellrank.tl._linear_operator import SparsePlusLowRank
+from cellrank.tl.kernels._tmat_flow import FlowPlotter
 from cellrank.tl.kernels._base_kernel import (
     Kernel,
     Constant,
+    Reductor,
     KernelAdd,
     KernelMul,
     _dtype,
     _is_bin_mult,
+    _graph_checks,
 )
+from cellrank.tl.kernels._exp_time_kernel import LastTimePoint
 from cellrank.tl.kernels._cytotrace_kernel import CytoTRACEAggregation
 
 import numpy as np
+import pandas as pd
+from scipy.stats import gmean, hmean
 from scipy.sparse import eye as speye
-from scipy.sparse import isspmatrix_csr
+from scipy.sparse import csr_matrix, isspmatrix_csr
+from scipy.sparse.linalg import LinearOperator, aslinearoperator
 from pandas.core.dtypes.common import is_bool_dtype, is_integer_dtype
 
 _rtol = 1e-6
@@ -816,6 +828,76 @@ class TestKernelAddition:
 
         np.testing.assert_allclose(k.transition_matrix.A, expected)
 
+    def test_addition_children_transition_matrix(self, adata: AnnData):
+        vk, ck = create_kernels(adata)
+        k = (0.8 * vk + 0.2 * ck).compute_transition_matrix()
+
+        np.testing.assert_allclose(
+            k[0].transition_matrix.A, 0.8 * vk.transition_matrix.A
+        )
+        np.testing.assert_allclose(
+            k[1].transition_matrix.A, 0.2 * ck.transition_matrix.A
+        )
+
+    def test_addition_reweighting(self, adata: AnnData):
+        vk, ck = create_kernels(adata)
+        k = (0.8 * vk + 0.2 * ck).compute_transition_matrix()
+        k[0][0]._recalculate(3)
+        k[1][0]._recalculate(1)
+        k.compute_transition_matrix()
+
+        expected = Reductor(np.add, 0)(
+            [0.75 * vk.transition_matrix, 0.25 * ck.transition_matrix]
+        )
+
+        np.testing.assert_allclose(k.transition_matrix.A, expected.A)
+        np.testing.assert_allclose(
+            k[0].transition_matrix.A, 0.75 * vk.transition_matrix.A
+        )
+
+    def test_adaptive_addition_child_mutated_inplace(self, adata: AnnData):
+        adata.obsp["velocity_variances"] = vv = np.random.random(
+            size=(adata.n_obs, adata.n_obs)
+        )
+        adata.obsp["connectivity_variances"] = cv = np.random.random(
+            size=(adata.n_obs, adata.n_obs)
+        )
+        vk, ck = create_kernels(
+            adata,
+            velocity_variances="velocity_variances",
+            connectivity_variances="connectivity_variances",
+        )
+        k = (vk ^ ck).compute_transition_matrix()
+        vk.transition_matrix.data[:] = np.random.random(vk.transition_matrix.nnz)
+        k.compute_transition_matrix()
+
+        expected = _normalize(
+            0.5 * vv * vk.transition_matrix + 0.5 * cv * ck.transition_matrix
+        )
+
+        np.testing.assert_allclose(k.transition_matrix.A, expected)
+
+    def test_adaptive_addition_pickle(self, adata: AnnData, tmpdir):
+        adata.obsp["velocity_variances"] = np.random.random(
+            size=(adata.n_obs, adata.n_obs)
+        )
+        adata.obsp["connectivity_variances"] = np.random.random(
+            size=(adata.n_obs, adata.n_obs)
+        )
+        vk, ck = create_kernels(
+            adata,
+            velocity_variances="velocity_variances",
+            connectivity_variances="connectivity_variances",
+        )
+        k = (vk ^ ck).compute_transition_matrix()
+        expected = k.transition_matrix.copy()
+        k.write(tmpdir / "kernel.pickle")
+
+        k2 = KernelAdd.read(tmpdir / "kernel.pickle")
+        k2.compute_transition_matrix()
+
+        np.testing.assert_allclose(k2.transition_matrix.A, expected.A)
+
     def test_addition_adaptive(self, adata: AnnData):
         adata.obsp["velocity_variances"] = vv = np.random.random(
             size=(adata.n_obs, adata.n_obs)
@@ -970,6 +1052,19 @@ class TestKernelCopy:
         assert vk1.params == vk2.params
         assert vk1.backward == vk2.backward
 
+    def test_graph_checks_memoized(self, adata: AnnData, mocker):
+        _graph_checks.clear()
+        spy = mocker.spy(cr.tl.kernels._base_kernel, "_symmetric")
+        spy.__name__ = "_symmetric"
+
+        ConnectivityKernel(adata)
+        VelocityKernel(adata)
+        spy.assert_called_once()
+
+        adata.obsp["connectivities"] = adata.obsp["connectivities"] * 2
+        ConnectivityKernel(adata)
+        assert spy.call_count == 2
+
     def test_copy_connectivity_kernel(self, adata: AnnData):
         ck1 = ConnectivityKernel(adata).compute_transition_matrix()
         ck2 = ck1.copy()
@@ -1054,6 +1149,26 @@ class TestGeneral:
         assert ck.condition_number is None
         assert isinstance(v.condition_number, float)
 
+    def test_comp_cond_num_matches_dense(self, adata: AnnData):
+        ck = ConnectivityKernel(adata, compute_cond_num=True)
+        ck.compute_transition_matrix()
+        expected = np.linalg.cond(ck.transition_matrix.A)
+
+        np.testing.assert_allclose(ck.condition_number, expected, rtol=_rtol)
+
+    def test_comp_cond_num_reset_on_recompute(self, adata: AnnData):
+        vk = VelocityKernel(adata, compute_cond_num=True)
+        vk.compute_transition_matrix(softmax_scale=4)
+        cond_num = vk.condition_number
+        vk.compute_transition_matrix(softmax_scale=4)
+
+        assert vk.condition_number == cond_num
+
+        vk.compute_transition_matrix(softmax_scale=1)
+
+        assert isinstance(vk.condition_number, float)
+        assert vk.condition_number != cond_num
+
 
 class TestTransitionProbabilities:
     def test_pearson_correlations_fwd(self, adata: AnnData):
@@ -1362,6 +1477,59 @@ class TestComputeProjection:
         assert not np.all(np.isnan(res))
         assert np.all(np.isnan(res[-1, :]))
 
+    @pytest.mark.parametrize("copy", [True, False])
+    def test_multiple_bases(self, adata: AnnData, copy: bool):
+        ck = cr.tl.kernels.ConnectivityKernel(adata).compute_transition_matrix()
+        expected = {
+            basis: ck.compute_projection(basis=basis, copy=True)
+            for basis in ["umap", "pca"]
+        }
+        res = ck.compute_projection(basis=["umap", "pca"], copy=copy)
+
+        if copy:
+            assert isinstance(res, dict)
+            assert list(res.keys()) == ["umap", "pca"]
+        else:
+            assert res is None
+            key = Key.uns.kernel(ck.backward)
+            assert adata.uns[f"{key}_params"] == {"embeddings": ["umap", "pca"]}
+            res = {basis: adata.obsm[f"{key}_{basis}"] for basis in ["umap", "pca"]}
+
+        for basis, T_emb in expected.items():
+            np.testing.assert_allclose(res[basis], T_emb)
+
+    def test_projection_values(self, adata: AnnData):
+        vk = VelocityKernel(adata).compute_transition_matrix(softmax_scale=4)
+        res = vk.compute_projection(basis="umap", copy=True)
+
+        tmat, conn, emb = vk.transition_matrix, vk._conn, adata.obsm["X_umap"]
+        expected = np.empty_like(emb)
+        for i in range(adata.n_obs):
+            ixs = conn[i].indices
+            dX = emb[ixs] - emb[i]
+            dX /= np.linalg.norm(dX, axis=1)[:, None]
+            expected[i] = tmat[i, ixs].A.squeeze().dot(dX) - dX.mean(0)
+
+        from scvelo.tools.velocity_embedding import quiver_autoscale
+
+        expected /= 3 * quiver_autoscale(emb, expected)
+
+        np.testing.assert_allclose(res, expected)
+
+    def test_projection_nan_neighbors(self, adata: AnnData):
+        vk = VelocityKernel(adata).compute_transition_matrix(softmax_scale=4)
+        adata.obsm["X_nan"] = adata.obsm["X_umap"].copy()
+        adata.obsm["X_nan"][0] = np.nan
+        res = vk.compute_projection(basis="nan", copy=True)
+
+        conn = vk._conn.tocsr()
+        is_nan = np.zeros(adata.n_obs, dtype=bool)
+        is_nan[0] = True
+        is_nan[conn[:, 0].nonzero()[0]] = True
+
+        assert np.all(np.isnan(res[is_nan]))
+        assert not np.any(np.isnan(res[~is_nan]))
+
 
 class TestPseudotimeKernelScheme:
     def test_invalid_scheme(self, adata: AnnData):
@@ -1408,6 +1576,67 @@ class TestPseudotimeKernelScheme:
             assert pk.params["nu"] == 0.5
             assert "k" not in pk.params
 
+    @pytest.mark.parametrize(
+        "scheme,kwargs",
+        [
+            (HardThresholdScheme, {"frac_to_keep": 0.0}),
+            (HardThresholdScheme, {"frac_to_keep": 0.3}),
+            (HardThresholdScheme, {"frac_to_keep": 1.0}),
+            (SoftThresholdScheme, {"b": 10, "nu": 0.5}),
+            (SoftThresholdScheme, {"b": 2, "nu": 1}),
+        ],
+    )
+    def test_vectorized_scheme_matches_rows(
+        self, adata: AnnData, scheme: type, kwargs: dict
+    ):
+        conn = _get_neighs(adata, "connectivities").tocsr()
+        pseudotime = adata.obs["latent_time"].values.astype(np.float64)
+        scheme = scheme()
+
+        expected = np.concatenate(
+            [
+                scheme(
+                    pseudotime[i],
+                    pseudotime[conn.indices[conn.indptr[i] : conn.indptr[i + 1]]],
+                    conn.data[conn.indptr[i] : conn.indptr[i + 1]],
+                    **kwargs,
+                )
+                for i in range(conn.shape[0])
+            ]
+        )
+        actual = scheme._bias_knn_vectorized(conn, pseudotime, **kwargs)
+
+        np.testing.assert_allclose(actual, expected)
+
+    def test_jitted_custom_scheme(self, adata: AnnData):
+        from numba import njit
+
+        @njit
+        def scheme(cpt: float, npt: np.ndarray, ndist: np.ndarray) -> np.ndarray:
+            return ndist * (npt >= cpt)
+
+        pk_jit = PseudotimeKernel(adata).compute_transition_matrix(
+            threshold_scheme=scheme
+        )
+        pk_py = PseudotimeKernel(adata).compute_transition_matrix(
+            threshold_scheme=scheme.py_func
+        )
+
+        np.testing.assert_allclose(
+            pk_jit.transition_matrix.A, pk_py.transition_matrix.A
+        )
+
+    def test_invalid_jitted_custom_scheme(self, adata: AnnData):
+        from numba import njit
+
+        @njit
+        def scheme(cpt: float, npt: np.ndarray, ndist: np.ndarray) -> np.ndarray:
+            return ndist[1:]
+
+        pk = PseudotimeKernel(adata)
+        with pytest.raises(ValueError, match="Expected row of shape"):
+            pk.compute_transition_matrix(threshold_scheme=scheme)
+
 
 class TestCytoTRACEKernel:
     @pytest.mark.parametrize("layer", ["X", "Ms", "foo"])
@@ -1443,6 +1672,7 @@ class TestCytoTRACEKernel:
             "layer": "X",
             "aggregation": "mean",
             "use_raw": False,
+            "top_n": 200,
         }
 
         assert np.all(adata.var[Key.cytotrace("gene_corr")] <= 1.0)
@@ -1466,6 +1696,41 @@ class TestCytoTRACEKernel:
 
         np.testing.assert_allclose(k.transition_matrix.sum(1), 1.0)
 
+    @pytest.mark.parametrize("agg", list(CytoTRACEAggregation))
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_chunked(self, adata: AnnData, agg: CytoTRACEAggregation, sparse: bool):
+        adata.X = csr_matrix(adata.X) if sparse else np.asarray(adata.X.A)
+        adata.layers["Ms"] = adata.X.copy()
+        X = adata.X.A if sparse else adata.X
+        top_n = 10
+
+        k = CytoTRACEKernel(
+            adata, layer="X", aggregation=agg, top_n=top_n, chunk_size=7
+        )
+
+        num_exp_genes = np.sum(X > 0, axis=1)
+        gene_corr = np.array(
+            [np.corrcoef(X[:, i], num_exp_genes)[0, 1] for i in range(adata.n_vars)]
+        )
+        np.testing.assert_array_equal(
+            adata.obs[Key.cytotrace("num_exp_genes")], num_exp_genes
+        )
+        np.testing.assert_allclose(
+            adata.var[Key.cytotrace("gene_corr")], gene_corr, rtol=1e-5, atol=1e-8
+        )
+        assert adata.var[Key.cytotrace("correlates")].sum() == top_n
+        assert adata.uns[Key.cytotrace("params")]["top_n"] == top_n
+
+        fn = {
+            CytoTRACEAggregation.MEAN: np.mean,
+            CytoTRACEAggregation.MEDIAN: np.median,
+            CytoTRACEAggregation.GMEAN: gmean,
+            CytoTRACEAggregation.HMEAN: hmean,
+        }[agg]
+        score = fn(X[:, adata.var[Key.cytotrace("correlates")].values], axis=1)
+        score = (score - score.min()) / (score.max() - score.min())
+        np.testing.assert_allclose(1 - k.pseudotime, score, rtol=1e-5, atol=1e-8)
+
     def test_inversion(self, adata: AnnData):
         k = ~CytoTRACEKernel(adata, use_raw=False, layer="X", aggregation="mean")
 
@@ -1473,7 +1738,170 @@ class TestCytoTRACEKernel:
         np.testing.assert_array_equal(np.max(pt) - pt, k.pseudotime)
 
 
+class TestRestitchTransportMaps:
+    class _TransportMapKernel(TransportMapKernel):
+        def compute_transition_matrix(self, *args, **kwargs) -> "TransportMapKernel":
+            return self
+
+    @staticmethod
+    def _tmaps(adata: AnnData) -> Tuple[dict, np.ndarray]:
+        rng = np.random.default_rng(0)
+        adata.obs["exp_time"] = rng.integers(0, 3, size=adata.n_obs).astype(float)
+        names = [adata.obs_names[adata.obs["exp_time"] == t] for t in range(3)]
+
+        tmaps = {}
+        for t in range(2):
+            X = rng.uniform(size=(len(names[t]), len(names[t + 1])))
+            X[X < 0.3] = 0
+            tmaps[t, t + 1] = AnnData(
+                X,
+                obs=pd.DataFrame(
+                    {"g1": rng.uniform(size=len(names[t]))}, index=names[t]
+                ),
+                var=pd.DataFrame(index=names[t + 1]),
+                dtype=X.dtype,
+            )
+
+        expected = np.zeros((adata.n_obs, adata.n_obs))
+        for (t, _), tmap in tmaps.items():
+            rows = adata.obs_names.get_indexer(tmap.obs_names)
+            cols = adata.obs_names.get_indexer(tmap.var_names)
+            expected[np.ix_(rows, cols)] = tmap.X / tmap.X.sum(1, keepdims=True)
+
+        return tmaps, expected
+
+    @pytest.mark.parametrize("ltp", [LastTimePoint.UNIFORM, LastTimePoint.DIAGONAL])
+    def test_restitch(self, adata: AnnData, ltp: LastTimePoint):
+        tmaps, expected = self._tmaps(adata)
+        last = np.where(adata.obs["exp_time"] == 2)[0]
+        if ltp == LastTimePoint.UNIFORM:
+            expected[np.ix_(last, last)] = 1.0 / len(last)
+        else:
+            expected[last, last] = 1.0
+
+        k = self._TransportMapKernel(adata, time_key="exp_time")
+        res = k._restich_tmaps(tmaps, ltp)
+
+        assert isspmatrix_csr(res.X)
+        assert res.X.has_sorted_indices
+        np.testing.assert_array_equal(res.obs_names, adata.obs_names)
+        np.testing.assert_allclose(res.X.A, expected)
+        np.testing.assert_allclose(res.X.sum(1), 1.0)
+        for tmap in tmaps.values():
+            np.testing.assert_array_equal(
+                res.obs.loc[tmap.obs_names, "g1"], tmap.obs["g1"]
+            )
+        assert res.obs.loc[adata.obs_names[last], "g1"].isnull().all()
+
+    @pytest.mark.parametrize(
+        "top_k,mass", [(1, None), (3, None), (None, 0.5), (2, 0.9)]
+    )
+    def test_restitch_sparsify(
+        self, adata: AnnData, top_k: Optional[int], mass: Optional[float]
+    ):
+        tmaps, _ = self._tmaps(adata)
+        k = self._TransportMapKernel(adata, time_key="exp_time")
+
+        dense = k._restich_tmaps(tmaps, LastTimePoint.DIAGONAL).X
+        res = k._restich_tmaps(tmaps, LastTimePoint.DIAGONAL, top_k=top_k, mass=mass).X
+
+        np.testing.assert_allclose(res.sum(1), 1.0)
+        for row_dense, row in zip(dense, res):
+            if row_dense.nnz == 1:
+                continue
+            values = np.sort(row_dense.data)[::-1]
+            n_keep = len(values)
+            if top_k is not None:
+                n_keep = min(n_keep, top_k)
+            if mass is not None:
+                n_keep = min(n_keep, np.searchsorted(np.cumsum(values), mass) + 1)
+            assert row.nnz == n_keep
+            # kept values are the largest ones, re-normalized
+            np.testing.assert_allclose(
+                np.sort(row.data)[::-1], values[:n_keep] / values[:n_keep].sum()
+            )
+
+    def test_restitch_implicit_uniform(self, adata: AnnData):
+        tmaps, expected = self._tmaps(adata)
+        last = np.where(adata.obs["exp_time"] == 2)[0]
+        k = self._TransportMapKernel(adata, time_key="exp_time")
+
+        res = k._restich_tmaps(tmaps, LastTimePoint.UNIFORM, implicit_uniform=True)
+
+        assert np.all(np.diff(res.X.indptr)[last] == 0)
+        np.testing.assert_allclose(res.X.A, expected)
+
+    def test_restitch_missing_cells(self, adata: AnnData):
+        tmaps, _ = self._tmaps(adata)
+        k = self._TransportMapKernel(adata, time_key="exp_time")
+        del tmaps[0, 1]
+
+        with pytest.raises(ValueError, match="to cover all cells"):
+            k._restich_tmaps(tmaps, LastTimePoint.DIAGONAL)
+
+
 class TestSingleFlow:
+    @pytest.mark.parametrize("operator", [False, True])
+    def test_flow_tensor(self, kernel: Kernel, operator: bool):
+        adata = kernel.adata
+        adata.obs["time"] = np.random.RandomState(0).choice([1, 2, 4], adata.n_obs)
+        tmat = kernel.transition_matrix
+        fp = FlowPlotter(
+            adata, aslinearoperator(tmat) if operator else tmat, "clusters", "time"
+        )
+        clusters = adata.obs["clusters"].cat.categories
+
+        flow = fp.compute_flow_tensor([(1, 2), (2, 4)])
+
+        assert flow.shape == (2, len(clusters), len(clusters))
+        for i, (t1, t2) in enumerate([(1, 2), (2, 4)]):
+            for j, c in enumerate(clusters):
+                rows = np.where(
+                    (adata.obs["time"] == t1) & (adata.obs["clusters"] == c)
+                )[0]
+                expected = np.array(
+                    [
+                        tmat[rows][
+                            :,
+                            np.where(
+                                (adata.obs["time"] == t2)
+                                & (adata.obs["clusters"] == c2)
+                            )[0],
+                        ].sum()
+                        for c2 in clusters
+                    ]
+                )
+                if expected.sum() > 0:
+                    expected /= expected.sum()
+                np.testing.assert_allclose(flow[i, j], expected, atol=1e-12)
+
+    def test_flow_plotter_reused(self, kernel: Kernel, mocker):
+        kernel.plot_single_flow("Astrocytes", "clusters", "age(days)", show=False)
+        fp = kernel._flow_plotter
+        joint = fp._joint_flow
+        spy = mocker.spy(FlowPlotter, "__init__")
+
+        for cluster in ["Astrocytes", "OPC"]:
+            kernel.plot_single_flow(
+                cluster, "clusters", "age(days)", clusters=["OL", "OPC"], show=False
+            )
+
+        spy.assert_not_called()
+        assert kernel._flow_plotter is fp
+        assert fp._joint_flow is joint
+
+    def test_flow_plotter_recomputed(self, kernel: Kernel):
+        kernel.plot_single_flow("Astrocytes", "clusters", "age(days)", show=False)
+        fp = kernel._flow_plotter
+        clusters = kernel.adata.obs["clusters"]
+
+        kernel.adata.obs["clusters"] = clusters.cat.reorder_categories(
+            clusters.cat.categories[::-1]
+        )
+        kernel.plot_single_flow("Astrocytes", "clusters", "age(days)", show=False)
+
+        assert kernel._flow_plotter is not fp
+
     def test_no_transition_matrix(self, kernel: Kernel):
         kernel._transition_matrix = None
         with pytest.raises(RuntimeError, match=r"Compute transition matrix first as"):
@@ -1554,3 +1982,169 @@ class TestKernelIO:
                 assert k.adata is kernel.adata
 
         np.testing.assert_array_equal(k.transition_matrix.A, kernel.transition_matrix.A)
+
+
+@pytest.fixture()
+def kernel_cache(tmpdir) -> Path:
+    orig = (
+        cr.settings.cachedir,
+        cr.settings.kernel_cache,
+        cr.settings.kernel_cache_max_size,
+    )
+    cr.settings.cachedir = Path(tmpdir)
+    cr.settings.kernel_cache = True
+    yield Path(tmpdir) / "cellrank_kernels"
+    (
+        cr.settings.cachedir,
+        cr.settings.kernel_cache,
+        cr.settings.kernel_cache_max_size,
+    ) = orig
+
+
+class TestPersistentCache:
+    def test_disabled_by_default(self, adata: AnnData, tmpdir):
+        cachedir = cr.settings.cachedir
+        try:
+            cr.settings.cachedir = Path(tmpdir)
+            PseudotimeKernel(adata, time_key="latent_time").compute_transition_matrix()
+        finally:
+            cr.settings.cachedir = cachedir
+
+        assert not cr.settings.kernel_cache
+        assert not (Path(tmpdir) / "cellrank_kernels").exists()
+
+    def test_velocity_kernel_hit(self, adata: AnnData, kernel_cache: Path, mocker):
+        vk = VelocityKernel(adata).compute_transition_matrix(softmax_scale=None)
+        assert len(list(kernel_cache.glob("*.pickle"))) == 1
+
+        spy = mocker.patch(
+            "cellrank.tl.kernels._velocity_kernel._dispatch_computation",
+            side_effect=RuntimeError("Recomputed."),
+        )
+        vk2 = VelocityKernel(adata).compute_transition_matrix(softmax_scale=None)
+
+        spy.assert_not_called()
+        assert vk2.params == vk.params
+        np.testing.assert_array_equal(vk2.transition_matrix.A, vk.transition_matrix.A)
+        np.testing.assert_array_equal(vk2.logits.A, vk.logits.A)
+
+    def test_velocity_kernel_miss_params(
+        self, adata: AnnData, kernel_cache: Path, mocker
+    ):
+        VelocityKernel(adata).compute_transition_matrix(softmax_scale=4)
+        spy = mocker.spy(cr.tl.kernels._velocity_kernel, "_dispatch_computation")
+        VelocityKernel(adata).compute_transition_matrix(softmax_scale=2)
+
+        spy.assert_called_once()
+        assert len(list(kernel_cache.glob("*.pickle"))) == 2
+
+    def test_velocity_kernel_miss_inputs(
+        self, adata: AnnData, kernel_cache: Path, mocker
+    ):
+        vk = VelocityKernel(adata).compute_transition_matrix(softmax_scale=4)
+        adata.layers["velocity"] = adata.layers["velocity"] + np.random.normal(
+            scale=0.1, size=adata.shape
+        )
+        spy = mocker.spy(cr.tl.kernels._velocity_kernel, "_dispatch_computation")
+        vk2 = VelocityKernel(adata).compute_transition_matrix(softmax_scale=4)
+
+        spy.assert_called_once()
+        assert not np.allclose(vk2.logits.A, vk.logits.A)
+
+    def test_pseudotime_kernel_hit(self, adata: AnnData, kernel_cache: Path, mocker):
+        pk = PseudotimeKernel(adata, time_key="latent_time")
+        pk.compute_transition_matrix(frac_to_keep=0.5)
+
+        spy = mocker.spy(HardThresholdScheme, "bias_knn")
+        pk2 = PseudotimeKernel(adata, time_key="latent_time")
+        pk2.compute_transition_matrix(frac_to_keep=0.5)
+        spy.assert_not_called()
+        np.testing.assert_array_equal(pk2.transition_matrix.A, pk.transition_matrix.A)
+
+        (~pk2).compute_transition_matrix(frac_to_keep=0.5)
+        spy.assert_called_once()
+
+    def test_lru_eviction(self, adata: AnnData, kernel_cache: Path, mocker):
+        pk = PseudotimeKernel(adata, time_key="latent_time")
+        pk.compute_transition_matrix(frac_to_keep=0.1)
+        (fname,) = kernel_cache.glob("*.pickle")
+        cr.settings.kernel_cache_max_size = int(2.5 * fname.stat().st_size)
+
+        pk.compute_transition_matrix(frac_to_keep=0.2)
+        time.sleep(0.05)
+        # touch the first entry, making the second one the least recently used
+        pk.compute_transition_matrix(frac_to_keep=0.1)
+        time.sleep(0.05)
+        pk.compute_transition_matrix(frac_to_keep=0.3)
+
+        assert len(list(kernel_cache.glob("*.pickle"))) == 2
+
+        spy = mocker.spy(HardThresholdScheme, "bias_knn")
+        PseudotimeKernel(adata, time_key="latent_time").compute_transition_matrix(
+            frac_to_keep=0.1
+        )
+        spy.assert_not_called()
+        PseudotimeKernel(adata, time_key="latent_time").compute_transition_matrix(
+            frac_to_keep=0.2
+        )
+        spy.assert_called_once()
+
+
+class TestMatrixFree:
+    @staticmethod
+    def _operator(kernel: Kernel) -> SparsePlusLowRank:
+        n = kernel.adata.n_obs
+        ones = np.ones(n)
+        return SparsePlusLowRank(
+            0.5 * kernel.transition_matrix, U=ones, V=0.5 * ones / n
+        )
+
+    def test_precomputed_kernel(self, adata: AnnData):
+        ck = ConnectivityKernel(adata).compute_transition_matrix()
+        op = self._operator(ck)
+
+        pk = PrecomputedKernel(op, adata=adata)
+
+        assert pk.transition_matrix is op
+        np.testing.assert_allclose(pk.transition_matrix.sum(1), 1.0)
+
+    def test_precomputed_kernel_invalid(self, adata: AnnData):
+        ck = ConnectivityKernel(adata).compute_transition_matrix()
+        op = self._operator(ck)
+
+        with pytest.raises(ValueError, match="not all rows sum to 1"):
+            PrecomputedKernel(2 * op, adata=adata)
+
+    def test_weighted_sum(self, adata: AnnData):
+        ck = ConnectivityKernel(adata).compute_transition_matrix()
+        op = self._operator(ck)
+        pk = PrecomputedKernel(op, adata=adata)
+
+        k = (0.3 * ck + 0.7 * pk).compute_transition_matrix()
+
+        assert isinstance(k.transition_matrix, SparsePlusLowRank)
+        np.testing.assert_allclose(
+            k.transition_matrix.toarray(),
+            0.3 * ck.transition_matrix.A + 0.7 * op.toarray(),
+        )
+
+    def test_product(self, adata: AnnData):
+        ck = ConnectivityKernel(adata).compute_transition_matrix()
+        op = self._operator(ck)
+        pk = PrecomputedKernel(op, adata=adata)
+        x = np.random.RandomState(0).normal(size=(adata.n_obs, 2))
+
+        k = (ck * pk).compute_transition_matrix()
+
+        assert isinstance(k.transition_matrix, LinearOperator)
+        np.testing.assert_allclose(
+            k.transition_matrix.matmat(x),
+            ck.transition_matrix @ (op.toarray() @ x),
+        )
+
+    def test_write_to_adata(self, adata: AnnData):
+        ck = ConnectivityKernel(adata).compute_transition_matrix()
+        pk = PrecomputedKernel(self._operator(ck), adata=adata)
+
+        with pytest.raises(TypeError, match="matrix-free"):
+            pk.write_to_adata()
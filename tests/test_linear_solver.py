@@ -9,6 +9,7 @@ from cellrank.tl._linear_solver import (
 import numpy as np
 from scipy.sparse import eye as speye
 from scipy.sparse import random, csr_matrix
+from scipy.sparse.linalg import aslinearoperator
 
 
 def _petsc_not_installed() -> bool:
@@ -72,6 +73,32 @@ class TestScipyLinearSolver:
 
         np.testing.assert_allclose(A @ sol, B, rtol=1e-6, atol=1e-10)
 
+    @pytest.mark.parametrize("use_eye", [False, True])
+    def test_gmres_operator(self, use_eye: bool):
+        A, B = _create_a_b_matrices(0, sparse=True)
+        A = 0.5 * A / A.sum(1).max()
+
+        sol = _solve_lin_system(
+            aslinearoperator(A),
+            B,
+            solver="gmres",
+            use_petsc=True,
+            use_eye=use_eye,
+            show_progress_bar=False,
+            tol=1e-8,
+        )
+        expected = _solve_lin_system(
+            A, B, solver="direct", use_petsc=False, use_eye=use_eye
+        )
+
+        np.testing.assert_allclose(sol, expected, rtol=1e-6, atol=1e-8)
+
+    def test_direct_solver_operator(self):
+        A, B = _create_a_b_matrices(0, sparse=True)
+
+        with pytest.raises(ValueError, match="explicit matrix"):
+            _solve_lin_system(aslinearoperator(A), B, solver="direct")
+
     @pytest.mark.parametrize(
         "seed,sparse", zip(range(10, 20), [False] * 5 + [True] * 5)
     )
@@ -89,3 +89,100 @@ class TestRandomWalk:
             assert isinstance(r, np.ndarray), i
             assert np.issubdtype(r.dtype, np.integer), i
             np.testing.assert_array_equal(r.shape, (101,))
+
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_transition_frequencies(self, test_matrix_1: np.ndarray, sparse: bool):
+        from scipy.sparse import csr_matrix
+
+        tmat = csr_matrix(test_matrix_1) if sparse else test_matrix_1
+        res = RandomWalk(tmat).simulate_many(
+            1000, max_iter=200, seed=0, n_jobs=1, show_progress_bar=False
+        )
+
+        counts = np.zeros_like(test_matrix_1)
+        for r in res:
+            np.add.at(counts, (r[:-1], r[1:]), 1)
+        freqs = counts / counts.sum(1, keepdims=True)
+
+        np.testing.assert_allclose(freqs, test_matrix_1, atol=0.03)
+        np.testing.assert_array_equal(counts[test_matrix_1 == 0], 0)
+
+    def test_independent_of_n_jobs(self, test_matrix_1: np.ndarray):
+        rw = RandomWalk(test_matrix_1, stop_ixs=[1])
+        r1 = rw.simulate_many(
+            2000, max_iter=20, seed=42, n_jobs=1, show_progress_bar=False
+        )
+        r2 = rw.simulate_many(
+            2000,
+            max_iter=20,
+            seed=42,
+            n_jobs=3,
+            backend="threading",
+            show_progress_bar=False,
+        )
+
+        assert len(r1) == len(r2) == 2000
+        for a, b in zip(r1, r2):
+            np.testing.assert_array_equal(a, b)
+
+    def test_simulate_one_is_first_of_many(self, test_matrix_1: np.ndarray):
+        rw = RandomWalk(test_matrix_1)
+        r1 = rw.simulate_one(max_iter=50, seed=42)
+        r2 = rw.simulate_many(5, max_iter=50, seed=42, show_progress_bar=False)
+
+        np.testing.assert_array_equal(r1, r2[0])
+
+    def test_matrix_free(self, test_matrix_1: np.ndarray):
+        from scipy.sparse.linalg import aslinearoperator
+
+        with pytest.raises(TypeError, match=r"explicit transition matrix"):
+            _ = RandomWalk(aslinearoperator(test_matrix_1))
+
+
+class TestRandomWalkStats:
+    @pytest.mark.parametrize("successive_hits", [0, 1])
+    def test_matches_simulate_many(
+        self, test_matrix_1: np.ndarray, successive_hits: int
+    ):
+        rw = RandomWalk(test_matrix_1, stop_ixs=[0, 5])
+        kwargs = {
+            "max_iter": 30,
+            "seed": 42,
+            "successive_hits": successive_hits,
+            "show_progress_bar": False,
+        }
+        sims = rw.simulate_many(1500, n_jobs=1, **kwargs)
+        stats = rw.simulate_stats(1500, n_jobs=2, backend="threading", **kwargs)
+
+        n = test_matrix_1.shape[0]
+        visits, edges = np.zeros(n), np.zeros((n, n))
+        hits, hitting_times = np.zeros(n), np.zeros(31)
+        for sim in sims:
+            np.add.at(visits, sim, 1)
+            np.add.at(edges, (sim[:-1], sim[1:]), 1)
+            tail = sim[1:][-(successive_hits + 1) :]
+            if len(tail) == successive_hits + 1 and np.all(rw._stop_mask[tail]):
+                hits[sim[-1]] += 1
+                hitting_times[len(sim) - 1] += 1
+
+        assert stats.n_sims == 1500
+        np.testing.assert_array_equal(stats.visits, visits)
+        np.testing.assert_array_equal(stats.edges.toarray(), edges)
+        np.testing.assert_array_equal(stats.hits, hits)
+        np.testing.assert_array_equal(stats.hitting_times, hitting_times)
+        np.testing.assert_array_equal(stats.hitting_probabilities, hits / 1500)
+        assert np.sum(stats.hits[[0, 5]]) == np.sum(stats.hits)
+
+    def test_no_stop_ixs(self, test_matrix_1: np.ndarray):
+        stats = RandomWalk(test_matrix_1).simulate_stats(
+            100, max_iter=10, seed=0, show_progress_bar=False
+        )
+
+        assert stats.visits.sum() == 100 * 11
+        assert stats.edges.sum() == 100 * 10
+        np.testing.assert_array_equal(stats.hits, 0)
+        np.testing.assert_array_equal(stats.hitting_times, 0)
+
+    def test_invalid_n_sims(self, test_matrix_1: np.ndarray):
+        with pytest.raises(ValueError, match=r"simulations"):
+            RandomWalk(test_matrix_1).simulate_stats(0)
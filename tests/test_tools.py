@@ -143,6 +143,101 @@ class TestLineageDrivers:
             assert np.all(res_narrow[f"{name}_ci_low"] >= res_wide[f"{name}_ci_low"])
             assert np.all(res_narrow[f"{name}_ci_high"] <= res_wide[f"{name}_ci_high"])
 
+    @pytest.mark.parametrize("method", ["fischer", "perm_test"])
+    @pytest.mark.parametrize("subset", [False, True])
+    def test_chunk_size(self, adata_cflare: AnnData, method: str, subset: bool):
+        cr.tl.lineages(adata_cflare)
+        clusters = (
+            list(adata_cflare.obs["clusters"].cat.categories[1:]) if subset else None
+        )
+        kwargs = {
+            "use_raw": False,
+            "method": method,
+            "cluster_key": "clusters",
+            "clusters": clusters,
+            "n_perms": 10,
+            "seed": 0,
+            "show_progress_bar": False,
+        }
+        expected = cr.tl.lineage_drivers(adata_cflare, chunk_size=None, **kwargs)
+        actual = cr.tl.lineage_drivers(adata_cflare, chunk_size=7, **kwargs)
+
+        pd.testing.assert_frame_equal(actual, expected)
+
+    def test_chunk_size_parallel(self, adata_cflare: AnnData):
+        cr.tl.lineages(adata_cflare)
+        expected = cr.tl.lineage_drivers(adata_cflare, use_raw=False, chunk_size=None)
+        actual = cr.tl.lineage_drivers(
+            adata_cflare,
+            use_raw=False,
+            chunk_size=50,
+            n_jobs=2,
+            backend="threading",
+            show_progress_bar=False,
+        )
+
+        pd.testing.assert_frame_equal(actual, expected)
+
+    def test_invalid_chunk_size(self, adata_cflare: AnnData):
+        cr.tl.lineages(adata_cflare)
+        with pytest.raises(ValueError, match="chunk_size"):
+            cr.tl.lineage_drivers(adata_cflare, use_raw=False, chunk_size=0)
+
+    def test_per_cluster(self, adata_cflare: AnnData):
+        adata_cflare.X = adata_cflare.X.astype(np.float64)
+        cr.tl.lineages(adata_cflare)
+        clusters = ["Granule immature", "Granule mature"]
+        res = cr.tl.lineage_drivers(
+            adata_cflare,
+            use_raw=False,
+            cluster_key="clusters",
+            per_cluster=True,
+            chunk_size=100,
+            show_progress_bar=False,
+        )
+
+        assert res.index.names == ["clusters", None]
+        assert len(res) == adata_cflare.n_vars * len(
+            adata_cflare.obs["clusters"].cat.categories
+        )
+        for cluster in clusters:
+            expected = cr.tl.lineage_drivers(
+                adata_cflare, use_raw=False, cluster_key="clusters", clusters=cluster
+            )
+            pd.testing.assert_frame_equal(
+                res.loc[cluster].loc[expected.index], expected
+            )
+
+    def test_per_cluster_subset(self, adata_cflare: AnnData):
+        cr.tl.lineages(adata_cflare)
+        res = cr.tl.lineage_drivers(
+            adata_cflare,
+            use_raw=False,
+            cluster_key="clusters",
+            clusters=["Granule mature", "Granule immature"],
+            per_cluster=True,
+        )
+
+        np.testing.assert_array_equal(
+            res.index.get_level_values(0).unique(),
+            ["Granule mature", "Granule immature"],
+        )
+
+    def test_per_cluster_invalid(self, adata_cflare: AnnData):
+        cr.tl.lineages(adata_cflare)
+        with pytest.raises(KeyError, match="foo"):
+            cr.tl.lineage_drivers(
+                adata_cflare, use_raw=False, cluster_key="foo", per_cluster=True
+            )
+        with pytest.raises(NotImplementedError, match="per_cluster"):
+            cr.tl.lineage_drivers(
+                adata_cflare,
+                use_raw=False,
+                cluster_key="clusters",
+                method="perm_test",
+                per_cluster=True,
+            )
+
 
 class TestRootFinal:
     def test_find_root(self, adata: AnnData):
@@ -1,5 +1,7 @@
 from typing import Any, Optional
 
+import time
+import pickle
 import pytest
 from _helpers import create_model, assert_array_nan_equal, jax_not_installed_skip
 
@@ -16,11 +18,24 @@ from cellrank.tl._utils import (
     _one_hot,
     _cluster_X,
     _connected,
+    _normalize,
     _partition,
+    _perm_test,
     _symmetric,
+    _n_smallest,
     _irreducible,
+    _filter_cells,
     _process_series,
+    _update_smallest,
+    _correlation_test,
+    _estimate_cond_num,
     _fuzzy_to_discrete,
+    _knn_connectivities,
+    _mat_mat_corr_dense,
+    _mat_mat_corr_sparse,
+    _quantile_from_smallest,
+    _correlation_test_helper,
+    _grouped_correlation_test,
     _merge_categorical_series,
     _series_from_one_hot_matrix,
 )
@@ -33,12 +48,16 @@ from cellrank.tl.kernels._utils import (
     np_max,
     np_sum,
     np_mean,
+    _row_max,
     _random_normal,
+    _sparsify_rows,
     _reconstruct_one,
     _calculate_starts,
+    _fused_weighted_sum,
     _np_apply_along_axis,
     _get_probs_for_zero_vec,
 )
+from cellrank.tl._linear_operator import SparsePlusLowRank, _restrict
 from cellrank.tl.kernels._velocity_schemes import (
     _predict_transition_probabilities_jax,
     _predict_transition_probabilities_numpy,
@@ -47,9 +66,13 @@ from cellrank.tl.kernels._velocity_schemes import (
 import numpy as np
 import pandas as pd
 from numba import njit
+from scipy.sparse import eye as speye
 from scipy.sparse import rand as srand
-from scipy.sparse import diags, random, csr_matrix
+from scipy.sparse import diags, random, spmatrix, csr_matrix
+from pandas.testing import assert_series_equal
 from pandas.api.types import is_categorical_dtype
+from sklearn.neighbors import kneighbors_graph
+from scipy.sparse.linalg import aslinearoperator
 
 
 class TestToolsUtils:
@@ -178,6 +201,41 @@ class TestToolsUtils:
         assert not _symmetric(test_matrix_1)
         assert _symmetric(test_matrix_4)
 
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matrix_symmetry_sparse(self, seed: int):
+        x = random(100, 100, density=0.05, random_state=seed, format="csr")
+        x = x + x.T
+        # explicitly stored zeros
+        rows, cols = np.repeat(np.arange(100), np.diff(x.indptr)), x.indices
+        x.data[
+            ((rows == rows[0]) & (cols == cols[0]))
+            | ((rows == cols[0]) & (cols == rows[0]))
+        ] = 0
+
+        assert _symmetric(x)
+        assert _symmetric(x, only_check_sparsity_pattern=True)
+        assert _symmetric(x.tocoo())
+
+        y = x.tolil()
+        i, j = x.nonzero()
+        y[i[1], j[1]] += 1
+        assert not _symmetric(y.tocsr())
+        assert _symmetric(y.tocsr(), only_check_sparsity_pattern=True)
+
+        y[i[1], j[1]] = 0
+        assert not _symmetric(y.tocsr())
+        assert not _symmetric(y.tocsr(), only_check_sparsity_pattern=True)
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_matrix_connectivity_sparse(self, seed: int):
+        import networkx as nx
+
+        x = random(100, 100, density=0.015, random_state=seed, format="csr")
+        G = nx.from_scipy_sparse_array(x, create_using=nx.DiGraph)
+
+        assert _connected(x) == nx.is_weakly_connected(G)
+        assert _irreducible(x) == nx.is_strongly_connected(G)
+
     def test_matrix_partition(
         self,
         test_matrix_1: np.ndarray,
@@ -202,6 +260,135 @@ class TestToolsUtils:
         np.testing.assert_array_equal(_partition(test_matrix_3)[1], [])
 
 
+def _knn_transition_matrix(
+    n_obs: int, n_neighbors: int = 30, seed: int = 0
+) -> csr_matrix:
+    rng = np.random.RandomState(seed)
+    conn = kneighbors_graph(rng.normal(size=(n_obs, 10)), n_neighbors)
+    conn = conn + conn.T
+    conn.data = rng.uniform(0.1, 1, size=conn.nnz)
+
+    return csr_matrix(diags(1.0 / np.asarray(conn.sum(1)).squeeze()) @ conn)
+
+
+class TestEstimateCondNum:
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_small_is_exact(self, sparse: bool):
+        tmat = _knn_transition_matrix(200, n_neighbors=10)
+        expected = np.linalg.cond(tmat.A)
+
+        actual = _estimate_cond_num(tmat if sparse else tmat.A)
+
+        np.testing.assert_allclose(actual, expected, rtol=1e-6)
+
+    def test_iterative_is_lower_bound(self):
+        tmat = _knn_transition_matrix(1000, n_neighbors=15)
+        expected = np.linalg.cond(tmat.A)
+
+        actual = _estimate_cond_num(tmat, n_dense=0)
+
+        assert np.isfinite(actual)
+        assert 1 <= actual <= expected * (1 + 1e-6)
+
+    def test_singular(self):
+        tmat = _knn_transition_matrix(200, n_neighbors=10).tolil()
+        tmat[1] = tmat[0]
+
+        assert _estimate_cond_num(tmat.tocsr()) > 1e15
+
+    def test_large_runtime(self):
+        tmat = _knn_transition_matrix(20000)
+
+        start = time.perf_counter()
+        actual = _estimate_cond_num(tmat)
+
+        assert np.isfinite(actual) and actual >= 1
+        assert time.perf_counter() - start < 60
+
+
+class TestSparsePlusLowRank:
+    @staticmethod
+    def _create(n: int = 100, rank: int = 2, seed: int = 0) -> SparsePlusLowRank:
+        rng = np.random.RandomState(seed)
+        return SparsePlusLowRank(
+            _knn_transition_matrix(n, n_neighbors=5, seed=seed),
+            U=rng.uniform(size=(n, rank)),
+            V=rng.uniform(size=(n, rank)),
+        )
+
+    def test_products(self):
+        op = self._create()
+        dense = op.toarray()
+        x = np.random.RandomState(1).normal(size=(op.shape[0], 3))
+
+        np.testing.assert_allclose(op.matvec(x[:, 0]), dense @ x[:, 0])
+        np.testing.assert_allclose(op.rmatvec(x[:, 0]), dense.T @ x[:, 0])
+        np.testing.assert_allclose(op.matmat(x), dense @ x)
+        np.testing.assert_allclose(op.T.matmat(x), dense.T @ x)
+
+    def test_algebra(self):
+        op1, op2 = self._create(seed=0), self._create(rank=1, seed=1)
+        res = 0.3 * op1 + op2 * 0.7
+
+        assert isinstance(res, SparsePlusLowRank)
+        assert res.rank == 3
+        np.testing.assert_allclose(
+            res.toarray(), 0.3 * op1.toarray() + 0.7 * op2.toarray()
+        )
+        np.testing.assert_allclose(
+            (op1 + op2.sparse).toarray(), op1.toarray() + op2.sparse.A
+        )
+
+    def test_sum_and_normalize(self):
+        op = self._create()
+        dense = op.toarray()
+
+        np.testing.assert_allclose(op.sum(), dense.sum())
+        np.testing.assert_allclose(op.sum(0), dense.sum(0, keepdims=True))
+        np.testing.assert_allclose(op.sum(1), dense.sum(1, keepdims=True))
+        np.testing.assert_allclose(_normalize(op).toarray().sum(1), 1.0)
+        np.testing.assert_allclose(
+            _normalize(aslinearoperator(dense)).matvec(np.ones(op.shape[0])), 1.0
+        )
+
+    @pytest.mark.parametrize("generic", [False, True])
+    def test_restrict(self, generic: bool):
+        op = self._create()
+        dense = op.toarray()
+        rows, cols = np.arange(10, 50), np.arange(30, 90)
+        x = np.random.RandomState(1).normal(size=(len(cols), 2))
+
+        res = _restrict(aslinearoperator(dense) if generic else op, rows, cols)
+
+        assert res.shape == (len(rows), len(cols))
+        np.testing.assert_allclose(res.matmat(x), dense[rows][:, cols] @ x)
+        np.testing.assert_allclose(
+            res.H.matvec(np.ones(len(rows))),
+            dense[rows][:, cols].T @ np.ones(len(rows)),
+        )
+
+    def test_pickle(self):
+        op = self._create()
+
+        res = pickle.loads(pickle.dumps(op))
+
+        assert isinstance(res, SparsePlusLowRank)
+        np.testing.assert_array_equal(res.toarray(), op.toarray())
+
+    def test_invalid_shapes(self):
+        with pytest.raises(ValueError, match="same rank"):
+            SparsePlusLowRank(speye(10), U=np.ones((10, 2)), V=np.ones((10, 1)))
+        with pytest.raises(ValueError, match="rows"):
+            SparsePlusLowRank(speye(10), U=np.ones(10), V=np.ones(5))
+
+    def test_cond_num(self):
+        op = self._create()
+
+        np.testing.assert_allclose(
+            _estimate_cond_num(op), np.linalg.cond(op.toarray()), rtol=1e-6
+        )
+
+
 class TestProcessSeries:
     def test_not_categorical(self):
         x = pd.Series(["a", "b", np.nan, "b", np.nan])
@@ -424,6 +611,56 @@ class TestFuzzyToDiscrete:
         assert c_1 == np.array(2)
         np.testing.assert_array_equal(c_2, np.array([1, 2]))
 
+    @pytest.mark.parametrize("remove_overlap", [False, True])
+    def test_return_codes(self, remove_overlap: bool):
+        a_fuzzy = np.random.RandomState(42).dirichlet(np.ones(5) * 0.5, size=200)
+
+        a_discrete, c_1 = _fuzzy_to_discrete(
+            a_fuzzy, n_most_likely=30, remove_overlap=remove_overlap
+        )
+        codes, c_2 = _fuzzy_to_discrete(
+            a_fuzzy,
+            n_most_likely=30,
+            remove_overlap=remove_overlap,
+            return_codes=True,
+        )
+
+        assert codes.shape == (200,)
+        np.testing.assert_array_equal(codes >= 0, a_discrete.any(1))
+        np.testing.assert_array_equal(
+            codes[codes >= 0], np.argmax(a_discrete[codes >= 0], 1)
+        )
+        np.testing.assert_array_equal(c_1, c_2)
+
+    def test_overlap_most_likely(self):
+        a_fuzzy = np.array(
+            [
+                [0.5, 0.45, 0.05],
+                [0.1, 0.1, 0.8],
+                [0.1, 0.4, 0.5],
+                [0.2, 0.1, 0.7],
+                [0.4, 0.3, 0.3],
+                [0.3, 0.2, 0.5],
+            ]
+        )
+
+        codes, critical = _fuzzy_to_discrete(
+            a_fuzzy, n_most_likely=2, remove_overlap=False, return_codes=True
+        )
+        # sample 0 is among the 2 most likely for clusters 0 and 1
+        np.testing.assert_array_equal(codes, [0, 2, 1, 2, 0, -1])
+        np.testing.assert_array_equal(critical, [1])
+
+        codes, critical = _fuzzy_to_discrete(
+            a_fuzzy,
+            n_most_likely=2,
+            remove_overlap=True,
+            raise_threshold=None,
+            return_codes=True,
+        )
+        np.testing.assert_array_equal(codes, [-1, 2, 1, 2, 0, -1])
+        np.testing.assert_array_equal(critical, [0, 1])
+
     def test_passing_lineage_object(self):
         a_fuzzy = np.array(
             [
@@ -447,6 +684,175 @@ class TestFuzzyToDiscrete:
         assert len(c_l) == 0
 
 
+class TestFilterCells:
+    @staticmethod
+    def _filter_cells_loop(
+        distances: csr_matrix, labels: pd.Series, n_matches_min: int
+    ) -> pd.Series:
+        res = labels.copy()
+        for cell in range(len(labels)):
+            if pd.isnull(labels.iloc[cell]):
+                continue
+            neighbors = distances[cell].indices
+            if np.sum(labels.iloc[neighbors] == labels.iloc[cell]) < n_matches_min:
+                res.iloc[cell] = np.nan
+        return res
+
+    @pytest.mark.parametrize("n_matches_min", [1, 3, 5])
+    def test_same_as_loop(self, n_matches_min: int):
+        rng = np.random.RandomState(42)
+        distances = random(200, 200, density=0.05, format="csr", random_state=rng)
+        # include a cell without any neighbors
+        distances[10] = 0
+        distances.eliminate_zeros()
+        labels = pd.Series(
+            rng.choice(["a", "b", "c", None], size=200),
+            index=[f"c{i}" for i in range(200)],
+            dtype="category",
+        )
+
+        actual = _filter_cells(distances, labels.copy(), n_matches_min=n_matches_min)
+        expected = self._filter_cells_loop(distances, labels, n_matches_min)
+
+        assert_series_equal(actual, expected)
+        assert pd.isnull(actual.iloc[10])
+
+    def test_does_not_modify_inplace(self):
+        distances = csr_matrix(np.ones((4, 4)) - np.eye(4))
+        labels = pd.Series(["a", "a", "b", "b"], dtype="category")
+
+        res = _filter_cells(distances, labels, n_matches_min=1)
+
+        assert_series_equal(labels, pd.Series(["a", "a", "b", "b"], dtype="category"))
+        assert_series_equal(res, labels)
+        assert res.cat.categories.equals(labels.cat.categories)
+
+    def test_not_categorical(self):
+        with pytest.raises(TypeError, match="categorical"):
+            _filter_cells(speye(2, format="csr"), pd.Series(["a", "b"]), 1)
+
+
+class TestPermTest:
+    @pytest.mark.parametrize("q", [0.0, 0.025, 0.3, 0.5])
+    @pytest.mark.parametrize("n", [1, 7, 100])
+    def test_quantile_from_smallest(self, q: float, n: int):
+        x = np.random.RandomState(0).normal(size=(n, 4, 3))
+        k = _n_smallest(q, n)
+
+        smallest = None
+        for chunk in np.array_split(x, 5):
+            if len(chunk):
+                smallest = _update_smallest(smallest, chunk, k)
+
+        assert smallest.shape == (min(n, k), 4, 3)
+        np.testing.assert_allclose(
+            _quantile_from_smallest(smallest, q, n), np.quantile(x, q, axis=0)
+        )
+
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_same_as_loop(self, sparse: bool):
+        rs = np.random.RandomState(42)
+        X = random(50, 100, density=0.3, random_state=rs, format="csr")
+        Y = rs.dirichlet(np.ones(3), size=100)
+        mmc = _mat_mat_corr_sparse if sparse else _mat_mat_corr_dense
+        if not sparse:
+            X = X.toarray()
+        corr = mmc(X, Y)
+        n_perms, q = 20, 0.025
+
+        pvals, smallest, largest, has_nan = _perm_test(
+            np.arange(n_perms), corr, X, Y, n_perms=n_perms, q=q, seed=0
+        )
+
+        rs = np.random.RandomState(0)
+        cell_ixs = np.arange(X.shape[1])
+        expected_pvals = np.zeros_like(corr)
+        corr_bs = np.zeros((n_perms,) + corr.shape)
+        for i in range(n_perms):
+            rs.shuffle(cell_ixs)
+            expected_pvals += np.abs(mmc(X, Y[cell_ixs])) >= np.abs(corr)
+            bs = rs.choice(cell_ixs, replace=True, size=len(cell_ixs))
+            corr_bs[i] = mmc(X[:, bs], Y[bs])
+
+        assert not np.any(has_nan)
+        np.testing.assert_array_equal(pvals, expected_pvals)
+        np.testing.assert_allclose(
+            _quantile_from_smallest(smallest, q, n_perms),
+            np.quantile(corr_bs, q, axis=0),
+        )
+        np.testing.assert_allclose(
+            -_quantile_from_smallest(largest, q, n_perms),
+            np.quantile(corr_bs, 1 - q, axis=0),
+        )
+
+    def test_constant_gene(self):
+        rs = np.random.RandomState(0)
+        X = rs.normal(size=(5, 100))
+        X[2] = 1.0
+        Y = rs.dirichlet(np.ones(2), size=100)
+
+        corr, pvals, ci_low, ci_high = _correlation_test_helper(
+            X, Y, method="perm_test", n_perms=10, seed=0, show_progress_bar=False
+        )
+
+        assert np.all(np.isnan(ci_low[2])) and np.all(np.isnan(ci_high[2]))
+        assert not np.any(np.isnan(np.delete(ci_low, 2, axis=0)))
+        assert np.all(ci_low[[0, 1, 3, 4]] <= ci_high[[0, 1, 3, 4]])
+
+
+class TestCorrelationTest:
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_backed(self, tmpdir, sparse: bool):
+        rs = np.random.RandomState(0)
+        X = random(100, 30, density=0.3, random_state=rs, format="csr")
+        adata = AnnData(X if sparse else X.toarray(), dtype=np.float64)
+        adata.write_h5ad(tmpdir / "adata.h5ad")
+        backed = sc.read_h5ad(tmpdir / "adata.h5ad", backed="r")
+        Y = Lineage(rs.dirichlet(np.ones(2), size=100), names=["a", "b"])
+        cells = rs.rand(100) < 0.7
+
+        expected = _correlation_test(adata.X[cells], Y[cells], adata.var_names)
+        actual = _correlation_test(
+            backed.X, Y[cells], adata.var_names, cells=cells, chunk_size=4
+        )
+
+        assert not isinstance(backed.X, (np.ndarray, spmatrix))
+        pd.testing.assert_frame_equal(actual, expected)
+
+    @pytest.mark.parametrize("sparse", [False, True])
+    def test_grouped(self, sparse: bool):
+        rs = np.random.RandomState(42)
+        X = random(300, 20, density=0.5, random_state=rs, format="csr")
+        X[:, 3] = 2.0
+        X = X if sparse else X.toarray()
+        Y = Lineage(rs.dirichlet(np.ones(3), size=300), names=["a", "b", "c"])
+        groups = pd.Series(rs.choice(["x", "y", "z"], size=300), name="foo").astype(
+            "category"
+        )
+        groups[:10] = np.nan
+        gene_names = pd.Index([f"g{i}" for i in range(20)])
+
+        res = _grouped_correlation_test(X, Y, groups, gene_names, chunk_size=6)
+
+        assert res.index.names == ["foo", None]
+        for group in ["x", "y", "z"]:
+            mask = np.asarray(groups == group)
+            # the constant gene is not tested and doesn't influence the q-values
+            keep = np.arange(20) != 3
+            expected = _correlation_test(X[mask][:, keep], Y[mask], gene_names[keep])
+            actual = res.loc[group]
+            assert np.all(np.isnan(actual.loc["g3"]))
+            actual = actual.loc[expected.index]
+            assert not np.any(np.isnan(actual))
+            pd.testing.assert_frame_equal(actual, expected)
+
+    def test_grouped_not_categorical(self):
+        X = np.random.RandomState(0).normal(size=(10, 2))
+        Y = Lineage(np.ones((10, 1)), names=["a"])
+        with pytest.raises(TypeError, match="categorical"):
+            _grouped_correlation_test(X, Y, pd.Series(["a"] * 10), ["g0", "g1"])
+
+
 class TestSeriesFromOneHotMatrix:
     def test_normal_run(self):
         a = np.array(
@@ -895,6 +1301,57 @@ class TestClusterX:
 
         assert len(labels_kmeans) == len(labels_leiden) == adata.n_obs
 
+    def test_minibatch_kmeans(self):
+        adata = sc.datasets.blobs(n_observations=200, n_variables=6, n_centers=4)
+
+        labels = _cluster_X(
+            adata.X, n_clusters=4, method="minibatch_kmeans", batch_size=32
+        )
+
+        assert len(labels) == adata.n_obs
+        assert len(set(labels)) == 4
+
+    def test_knn_connectivities_same_as_scanpy(self):
+        adata = sc.datasets.blobs(n_observations=200, n_variables=6)
+        sc.pp.neighbors(adata, use_rep="X", n_neighbors=15)
+
+        conn = _knn_connectivities(adata.X, n_neighbors=15, n_jobs=2)
+
+        np.testing.assert_allclose(
+            conn.toarray(), adata.obsp["connectivities"].toarray(), atol=1e-5
+        )
+
+    def test_leiden_connectivities(self):
+        adata = sc.datasets.blobs(n_observations=200, n_variables=6)
+        sc.pp.neighbors(adata, use_rep="X", n_neighbors=15)
+
+        labels = _cluster_X(
+            adata.X,
+            n_clusters=5,
+            method="leiden",
+            n_neighbors=15,
+        )
+        labels_conn = _cluster_X(
+            adata.X,
+            n_clusters=5,
+            method="leiden",
+            connectivities=adata.obsp["connectivities"],
+        )
+
+        np.testing.assert_array_equal(labels, labels_conn)
+
+    def test_leiden_invalid_connectivities(self):
+        adata = sc.datasets.blobs(n_observations=100, n_variables=6)
+        sc.pp.neighbors(adata, use_rep="X")
+
+        with pytest.raises(ValueError, match="connectivities"):
+            _cluster_X(
+                adata.X[:50],
+                n_clusters=5,
+                method="leiden",
+                connectivities=adata.obsp["connectivities"],
+            )
+
 
 class TestKernelUtils:
     @pytest.mark.parametrize("seed", range(5))
@@ -1025,6 +1482,21 @@ class TestKernelUtils:
 
         np.testing.assert_allclose(np_res, jax_res)
 
+    @pytest.mark.parametrize("seed", range(3))
+    def test_fused_weighted_sum(self, seed: int):
+        mats = [
+            random(50, 50, density=0.1, random_state=seed + i, format="csr")
+            for i in range(3)
+        ]
+        mats[-1] = mats[-1].A
+        weights = np.random.RandomState(seed).uniform(size=(3,))
+
+        res = _fused_weighted_sum(mats, weights)
+
+        assert isinstance(res, csr_matrix)
+        assert res.has_canonical_format
+        np.testing.assert_allclose(res.A, sum(w * m for w, m in zip(weights, mats)))
+
     def test_random_normal_wrong_ndim(self):
         with pytest.raises(AssertionError):
             _random_normal(np.array([[1, 2, 3]]), np.array([[1, 2, 3]]))
@@ -1043,6 +1515,33 @@ class TestKernelUtils:
 
         assert x.shape == (1, 1)
 
+    def test_row_max(self):
+        X = random(50, 30, density=0.1, format="csr", random_state=0)
+        nonempty = np.diff(X.indptr) > 0
+        assert not np.all(nonempty)
+
+        np.testing.assert_array_equal(
+            _row_max(X), [X[i].data.max() for i in np.where(nonempty)[0]]
+        )
+
+    @pytest.mark.parametrize("top_k", [1, 3, 100])
+    def test_sparsify_rows_top_k(self, top_k: int):
+        X = random(50, 30, density=0.3, format="csr", random_state=0)
+
+        res = _sparsify_rows(X, top_k=top_k)
+
+        for row, row_res in zip(X, res):
+            assert row_res.nnz == min(top_k, row.nnz)
+            np.testing.assert_array_equal(
+                np.sort(row_res.data), np.sort(row.data)[::-1][: row_res.nnz][::-1]
+            )
+
+    def test_sparsify_rows_invalid(self):
+        with pytest.raises(ValueError, match="top_k"):
+            _sparsify_rows(np.eye(3), top_k=0)
+        with pytest.raises(ValueError, match="mass"):
+            _sparsify_rows(np.eye(3), mass=0)
+
 
 class TestParallelize:
     @pytest.mark.parametrize("n_jobs", [1, 3, 4])